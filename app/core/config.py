@@ -3,7 +3,7 @@ from __future__ import annotations
 from pydantic import Field, model_validator
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
-from app.core.enums import Env, JwtAlg
+from app.core.enums import BlobBackend, Env, IngestBackend, JwtAlg
 from app.core.security_defaults import (
     DEFAULT_HSTS_MAX_AGE,
     DEFAULT_PERMISSIONS_POLICY,
@@ -30,6 +30,12 @@ class Settings(BaseSettings):
     elasticsearch_username: str | None = Field(default=None, alias="ELASTICSEARCH_USERNAME")
     elasticsearch_password: str | None = Field(default=None, alias="ELASTICSEARCH_PASSWORD")
     elasticsearch_verify_certs: bool = Field(default=False, alias="ELASTICSEARCH_VERIFY_CERTS")
+    es_kb_index_prefix: str = Field(default="kb-chunks", alias="ES_KB_INDEX_PREFIX")
+    es_kb_index_version: int = Field(default=1, alias="ES_KB_INDEX_VERSION")
+    es_bulk_chunk_size: int = Field(default=500, alias="ES_BULK_CHUNK_SIZE")
+    es_bulk_max_inflight: int = Field(default=4, alias="ES_BULK_MAX_INFLIGHT")
+    es_bulk_large_threshold: int = Field(default=5000, alias="ES_BULK_LARGE_THRESHOLD")  # chunk数超过这个值时暂停refresh
+    es_refresh_interval: str = Field(default="1s", alias="ES_REFRESH_INTERVAL")
 
     db_pool_size: int = Field(default=10, alias="DB_POOL_SIZE")
     db_max_overflow: int = Field(default=20, alias="DB_MAX_OVERFLOW")
@@ -74,8 +80,9 @@ class Settings(BaseSettings):
     qdrant_url: str = Field(default="http://127.0.0.1:6333", alias="QDRANT_URL")
     qdrant_api_key: str | None = Field(default=None, alias="QDRANT_API_KEY")
     qdrant_timeout_seconds: float = Field(default=10.0, alias="QDRANT_TIMEOUT_SECONDS")
+    qdrant_collection: str = Field(default="kb_chunks", alias="QDRANT_COLLECTION")
 
-    blob_backend: str = Field(default="local", alias="BLOB_BACKEND")
+    blob_backend: BlobBackend = Field(default=BlobBackend.local, alias="BLOB_BACKEND")
     blob_local_root: str = Field(default=".data/blobs", alias="BLOB_LOCAL_ROOT")
 
     blob_s3_endpoint_url: str | None = Field(default=None, alias="BLOB_S3_ENDPOINT_URL")
@@ -83,6 +90,65 @@ class Settings(BaseSettings):
     blob_s3_access_key_id: str | None = Field(default=None, alias="BLOB_S3_ACCESS_KEY_ID")
     blob_s3_secret_access_key: str | None = Field(default=None, alias="BLOB_S3_SECRET_ACCESS_KEY")
     blob_s3_region: str | None = Field(default=None, alias="BLOB_S3_REGION")
+    blob_s3_part_size_bytes: int = Field(default=8 * 1024 * 1024, alias="BLOB_S3_PART_SIZE_BYTES")  # 超过它走分片上传，最小5MB
+    blob_s3_upload_concurrency: int = Field(default=4, alias="BLOB_S3_UPLOAD_CONCURRENCY")  # 单个对象同时在传的分片数
+    blob_s3_max_connections: int = Field(default=64, alias="BLOB_S3_MAX_CONNECTIONS")
+    blob_s3_timeout_seconds: float = Field(default=60.0, alias="BLOB_S3_TIMEOUT_SECONDS")
+
+    blob_cache_dir: str = Field(default=".data/blob_cache", alias="BLOB_CACHE_DIR")
+    blob_cache_max_bytes: int = Field(default=20 * 1024 * 1024 * 1024, alias="BLOB_CACHE_MAX_BYTES")  # 0表示不缓存；只对远端存储生效
+
+    kb_upload_max_bytes: int = Field(default=2 * 1024 * 1024 * 1024, alias="KB_UPLOAD_MAX_BYTES")
+    kb_blob_gc_interval_seconds: float = Field(default=3600.0, alias="KB_BLOB_GC_INTERVAL_SECONDS")  # celery beat多久清理一次无引用的内容
+    kb_blob_gc_grace_seconds: int = Field(default=3600, alias="KB_BLOB_GC_GRACE_SECONDS")  # 引用归零后至少保留多久才删
+    kb_blob_gc_batch_size: int = Field(default=200, alias="KB_BLOB_GC_BATCH_SIZE")
+
+    kb_extract_section_chars: int = Field(default=4000, alias="KB_EXTRACT_SECTION_CHARS")
+    kb_extract_spool_max_bytes: int = Field(default=16 * 1024 * 1024, alias="KB_EXTRACT_SPOOL_MAX_BYTES")
+    kb_pdf_fanout_min_pages: int = Field(default=300, alias="KB_PDF_FANOUT_MIN_PAGES")  # 0表示不拆分
+    kb_pdf_fanout_min_bytes: int = Field(default=4 * 1024 * 1024, alias="KB_PDF_FANOUT_MIN_BYTES")  # 小于这个大小不去数页数
+    kb_pdf_fanout_pages_per_part: int = Field(default=100, alias="KB_PDF_FANOUT_PAGES_PER_PART")
+    kb_pdf_fanout_queue: str = Field(default="kb.small", alias="KB_PDF_FANOUT_QUEUE")
+
+    kb_chunk_encoding: str = Field(default="cl100k_base", alias="KB_CHUNK_ENCODING")
+    kb_chunk_max_tokens: int = Field(default=512, alias="KB_CHUNK_MAX_TOKENS")
+    kb_chunk_overlap_tokens: int = Field(default=64, alias="KB_CHUNK_OVERLAP_TOKENS")
+    kb_chunk_insert_batch_size: int = Field(default=500, alias="KB_CHUNK_INSERT_BATCH_SIZE")
+
+    kb_embed_model: str = Field(default="BAAI/bge-small-en-v1.5", alias="KB_EMBED_MODEL")
+    kb_embed_batch_size: int = Field(default=64, alias="KB_EMBED_BATCH_SIZE")
+    kb_embed_pool_size: int = Field(default=0, alias="KB_EMBED_POOL_SIZE")  # 每个worker进程的编码进程数，0表示本机核数按prefork并发数平分
+    kb_embed_cache_enabled: bool = Field(default=True, alias="KB_EMBED_CACHE_ENABLED")
+    kb_embed_cache_ttl_seconds: int = Field(default=30 * 24 * 3600, alias="KB_EMBED_CACHE_TTL_SECONDS")
+    kb_embed_cache_dir: str | None = Field(default=None, alias="KB_EMBED_CACHE_DIR")  # 不配置就不启用磁盘层
+    kb_embed_cache_disk_max_bytes: int = Field(default=1024 * 1024 * 1024, alias="KB_EMBED_CACHE_DISK_MAX_BYTES")
+
+    kb_search_candidate_multiplier: int = Field(default=4, alias="KB_SEARCH_CANDIDATE_MULTIPLIER")
+    kb_search_rrf_k: int = Field(default=60, alias="KB_SEARCH_RRF_K")
+
+    kb_ingest_batch_concurrency: int = Field(default=8, alias="KB_INGEST_BATCH_CONCURRENCY")  # 不要超过db连接池大小
+    kb_ingest_batch_size: int = Field(default=100, alias="KB_INGEST_BATCH_SIZE")
+    kb_ingest_workspace_max_inflight: int = Field(default=4, alias="KB_INGEST_WORKSPACE_MAX_INFLIGHT")  # 0表示不限制
+    kb_ingest_slot_lease_seconds: int = Field(default=300, alias="KB_INGEST_SLOT_LEASE_SECONDS")
+    kb_ingest_defer_seconds: float = Field(default=10.0, alias="KB_INGEST_DEFER_SECONDS")
+    kb_ingest_max_retries: int = Field(default=5, alias="KB_INGEST_MAX_RETRIES")
+    kb_ingest_retry_base_seconds: float = Field(default=5.0, alias="KB_INGEST_RETRY_BASE_SECONDS")
+    kb_ingest_retry_max_seconds: float = Field(default=600.0, alias="KB_INGEST_RETRY_MAX_SECONDS")
+    kb_ingest_pipeline_version: int = Field(default=1, alias="KB_INGEST_PIPELINE_VERSION")  # 抽取/切块/编码逻辑有变化时加一，允许同一文件重新处理
+    kb_ingest_idem_lease_seconds: int = Field(default=300, alias="KB_INGEST_IDEM_LEASE_SECONDS")  # 处理期间会续租
+    kb_ingest_idem_done_ttl_seconds: int = Field(default=7 * 24 * 3600, alias="KB_INGEST_IDEM_DONE_TTL_SECONDS")
+    kb_ingest_backend: IngestBackend = Field(default=IngestBackend.celery, alias="KB_INGEST_BACKEND")
+    kb_pg_queue_batch_size: int = Field(default=8, alias="KB_PG_QUEUE_BATCH_SIZE")
+    kb_pg_queue_poll_seconds: float = Field(default=2.0, alias="KB_PG_QUEUE_POLL_SECONDS")
+    kb_pg_queue_lease_seconds: int = Field(default=300, alias="KB_PG_QUEUE_LEASE_SECONDS")
+    kb_progress_keepalive_seconds: float = Field(default=15.0, alias="KB_PROGRESS_KEEPALIVE_SECONDS")
+    kb_queue_large_min_bytes: int = Field(default=50 * 1024 * 1024, alias="KB_QUEUE_LARGE_MIN_BYTES")
+    kb_queue_small_concurrency: int = Field(default=8, alias="KB_QUEUE_SMALL_CONCURRENCY")
+    kb_queue_small_prefetch: int = Field(default=4, alias="KB_QUEUE_SMALL_PREFETCH")
+    kb_queue_large_concurrency: int = Field(default=2, alias="KB_QUEUE_LARGE_CONCURRENCY")
+    kb_queue_large_prefetch: int = Field(default=1, alias="KB_QUEUE_LARGE_PREFETCH")
+    kb_queue_media_concurrency: int = Field(default=1, alias="KB_QUEUE_MEDIA_CONCURRENCY")
+    kb_queue_media_prefetch: int = Field(default=1, alias="KB_QUEUE_MEDIA_PREFETCH")
 
     @model_validator(mode="after")
     def _validate_cors(self) -> "Settings":
@@ -90,6 +156,23 @@ class Settings(BaseSettings):
             raise ValueError("CORS_ALLOW_CREDENTIALS cannot be true when CORS_ALLOW_ORIGINS is '*'.")
         return self
 
+    @model_validator(mode="after")
+    def _validate_blob(self) -> "Settings":
+        if self.blob_backend == BlobBackend.s3:
+            missing = [
+                alias
+                for alias, v in (
+                    ("BLOB_S3_ENDPOINT_URL", self.blob_s3_endpoint_url),
+                    ("BLOB_S3_BUCKET", self.blob_s3_bucket),
+                    ("BLOB_S3_ACCESS_KEY_ID", self.blob_s3_access_key_id),
+                    ("BLOB_S3_SECRET_ACCESS_KEY", self.blob_s3_secret_access_key),
+                )
+                if not (v or "").strip()
+            ]
+            if missing:
+                raise ValueError(f"BLOB_BACKEND=s3 requires {', '.join(missing)}.")
+        return self
+
     @staticmethod
     def _csv(s: str) -> list[str]:
         s = (s or "").strip()
@@ -9,3 +9,11 @@ class Env(str, Enum):  		# 定义这个东西主要是开发、生产与发布
 class JwtAlg(str, Enum):  	# 这个主要搞签名算法的枚举
     HS256 = "HS256"  		# 对称密钥算法：用同一把secret做签名与验签
     RS256 = "RS256"  		# 非对称密钥算法：用私钥签名、公钥验签（你当前实现主要用 HS256）
+
+class IngestBackend(str, Enum):  	# 入库任务怎么分发
+    celery = "celery"  		# 走RabbitMQ，由celery worker消费
+    pg = "pg"  			# worker直接从kb_index_jobs表里用SKIP LOCKED认领，小规模部署可以不要broker
+
+class BlobBackend(str, Enum):  	# 原始文件和派生文件存在哪
+    local = "local"  		# 本机磁盘，只适合单机部署
+    s3 = "s3"  			# S3兼容的对象存储，多个API/worker实例共享
@@ -55,6 +55,18 @@ ERROR_MESSAGES: dict[str, str] = {
 
     # 存储：数据库错误
     "storage.db_error": "db_error",
+
+    # 知识库：请求没有带workspace
+    "kb.workspace_required": "workspace_required",
+
+    # 知识库：资产不存在或不属于当前workspace
+    "kb.asset_not_found": "asset_not_found",
+
+    # 知识库：上传内容超过大小上限
+    "kb.upload_too_large": "upload_too_large",
+
+    # 知识库：上传内容为空
+    "kb.upload_empty": "upload_empty",
 }
 
 # ERROR_STATUS：错误码 -> HTTP状态码
@@ -112,5 +124,17 @@ ERROR_STATUS: dict[str, int] = {
 
     # DB错误：500
     "storage.db_error": 500,
+
+    # 缺workspace：400
+    "kb.workspace_required": 400,
+
+    # 资产不存在：404
+    "kb.asset_not_found": 404,
+
+    # 上传太大：413
+    "kb.upload_too_large": 413,
+
+    # 空文件：400
+    "kb.upload_empty": 400,
 }
 
@@ -0,0 +1,9 @@
+from __future__ import annotations
+
+from fastapi import Request
+
+from app.infra.blob_storage.interface import StorageBackend
+
+
+def get_storage(request: Request) -> StorageBackend:
+    return request.app.state.storage
@@ -0,0 +1,199 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import os
+import uuid
+from collections import OrderedDict
+from typing import Any, AsyncIterator
+
+import aiofiles
+
+from app.infra.blob_storage.interface import DEFAULT_STREAM_CHUNK_SIZE, StorageBackend, StoredObject
+
+
+def _digest(s: str) -> str:
+    return hashlib.sha256(s.encode("utf-8")).hexdigest()
+
+
+class DiskCachedStorage:
+    # 远端存储前面加一层本机磁盘读缓存：重试、重新切块、PDF分段都会反复读同一个原文件。
+    # 缓存文件名里带着etag，命中前先stat一次（HEAD）核对版本，同一个key被覆盖写后不会读到旧内容。
+    # 容量按字节做LRU；同一个key的并发未命中只会回源下载一次。
+    # 淘汰记账是进程内的：同一目录被多个worker进程共享时，总占用上限约为 max_bytes * 进程数。
+    def __init__(self, inner: StorageBackend, *, root_dir: str, max_bytes: int) -> None:
+        self._inner = inner
+        self.root_dir = root_dir
+        self.max_bytes = int(max_bytes)
+        self._lru: OrderedDict[str, int] = OrderedDict()  # 缓存文件路径 -> 字节数，越靠后越新
+        self._keys: dict[str, str] = {}  # key的摘要 -> 当前缓存的那个版本的文件路径
+        self._total = 0
+        self._inflight: dict[str, asyncio.Task[str]] = {}
+        os.makedirs(self.root_dir, exist_ok=True)
+        self._load()
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._inner, name)
+
+    def _load(self) -> None:
+        # 重启后按mtime恢复LRU顺序，命中时会刷新mtime
+        found: list[tuple[float, str, int]] = []
+        for d, _, files in os.walk(self.root_dir):
+            for fn in files:
+                p = os.path.join(d, fn)
+                if fn.endswith(".part"):  # 上次没下载完的
+                    self._unlink(p)
+                    continue
+                try:
+                    st = os.stat(p)
+                except FileNotFoundError:
+                    continue
+                found.append((st.st_mtime, p, int(st.st_size)))
+        for _, p, size in sorted(found):
+            self._add(p, size)
+        self._evict(keep=None)
+
+    def _path(self, key: str, etag: str | None) -> str:
+        h = _digest(key)
+        return os.path.join(self.root_dir, h[:2], f"{h}.{_digest(etag or '')[:16]}")
+
+    def _add(self, p: str, size: int) -> None:
+        old = self._keys.get(os.path.basename(p).split(".", 1)[0])
+        if old is not None and old != p:  # 同一个key只留最新的版本
+            self._drop(old)
+        self._keys[os.path.basename(p).split(".", 1)[0]] = p
+        self._lru[p] = int(size)
+        self._total += int(size)
+
+    @staticmethod
+    def _unlink(p: str) -> None:
+        try:
+            os.remove(p)
+        except FileNotFoundError:
+            pass
+
+    def _drop(self, p: str) -> None:
+        size = self._lru.pop(p, None)
+        if size is not None:
+            self._total -= size
+        h = os.path.basename(p).split(".", 1)[0]
+        if self._keys.get(h) == p:
+            del self._keys[h]
+        self._unlink(p)
+
+    def _drop_key(self, key: str) -> None:
+        p = self._keys.get(_digest(key))
+        if p is not None:
+            self._drop(p)
+
+    def _evict(self, *, keep: str | None) -> None:
+        # 刚写入的那个不淘汰：单个对象超过上限时允许暂时超出，下一次写入时再被挤掉
+        for p in list(self._lru):
+            if self._total <= self.max_bytes:
+                break
+            if p != keep:
+                self._drop(p)
+
+    async def _fill(self, key: str, p: str) -> str:
+        tmp = f"{p}.{uuid.uuid4().hex}.part"
+        os.makedirs(os.path.dirname(p), exist_ok=True)
+        size = 0
+        try:
+            async with aiofiles.open(tmp, "wb") as f:
+                async for b in self._inner.open_stream(key=key):
+                    await f.write(b)
+                    size += len(b)
+            os.replace(tmp, p)
+        except BaseException:
+            self._unlink(tmp)
+            raise
+        self._add(p, size)
+        self._evict(keep=p)
+        return p
+
+    async def _cached(self, key: str) -> str | None:
+        # 返回本地缓存文件路径；对象太大放不进缓存时返回None，调用方直接读远端
+        meta = await self._inner.stat(key=key)
+        if meta is None:
+            self._drop_key(key)
+            raise FileNotFoundError(key)
+        if self.max_bytes <= 0 or int(meta.size) > self.max_bytes:
+            return None
+        p = self._path(key, meta.etag)
+        if p in self._lru:
+            self._lru.move_to_end(p)
+            try:
+                os.utime(p)
+                return p
+            except FileNotFoundError:  # 被共享同一目录的其他进程淘汰了
+                self._drop(p)
+        task = self._inflight.get(p)
+        if task is None:
+            task = asyncio.create_task(self._fill(key, p))
+            self._inflight[p] = task
+            task.add_done_callback(lambda _t: self._inflight.pop(p, None))
+        return await asyncio.shield(task)  # 某个等待方被取消不影响其他人继续用这次下载
+
+    async def put_bytes(self, *, key: str, data: bytes, content_type: str | None = None) -> StoredObject:
+        self._drop_key(key)
+        return await self._inner.put_bytes(key=key, data=data, content_type=content_type)
+
+    async def put_stream(self, *, key: str, chunks: AsyncIterator[bytes], content_type: str | None = None) -> StoredObject:
+        self._drop_key(key)
+        return await self._inner.put_stream(key=key, chunks=chunks, content_type=content_type)
+
+    async def get_bytes(self, *, key: str) -> bytes:
+        p = await self._cached(key)
+        if p is None:
+            return await self._inner.get_bytes(key=key)
+        try:
+            async with aiofiles.open(p, "rb") as f:
+                return await f.read()
+        except FileNotFoundError:
+            self._drop(p)
+            return await self._inner.get_bytes(key=key)
+
+    async def open_stream(self, *, key: str, chunk_size: int = DEFAULT_STREAM_CHUNK_SIZE) -> AsyncIterator[bytes]:
+        p = await self._cached(key)
+        f = None
+        if p is not None:
+            try:
+                f = await aiofiles.open(p, "rb")  # 打开之后再被淘汰也不影响这次读
+            except FileNotFoundError:
+                self._drop(p)
+        if f is None:
+            async for b in self._inner.open_stream(key=key, chunk_size=chunk_size):
+                yield b
+            return
+        try:
+            while True:
+                b = await f.read(int(chunk_size))
+                if not b:
+                    break
+                yield b
+        finally:
+            await f.close()
+
+    async def get_range(self, *, key: str, start: int, length: int) -> bytes:
+        # 范围读多是嗅探文件头这种小读取，未命中时直接读远端，不为它下载整个对象
+        if _digest(key) in self._keys:
+            if int(start) < 0 or int(length) < 0:
+                raise ValueError("bad_range")
+            p = await self._cached(key)
+            if p is not None:
+                try:
+                    async with aiofiles.open(p, "rb") as f:
+                        await f.seek(int(start))
+                        return await f.read(int(length))
+                except FileNotFoundError:
+                    self._drop(p)
+        return await self._inner.get_range(key=key, start=start, length=length)
+
+    async def move(self, *, src: str, dst: str) -> None:
+        self._drop_key(src)
+        self._drop_key(dst)
+        await self._inner.move(src=src, dst=dst)
+
+    async def delete(self, *, key: str) -> None:
+        self._drop_key(key)
+        await self._inner.delete(key=key)
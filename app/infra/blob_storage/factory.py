@@ -0,0 +1,28 @@
+from __future__ import annotations
+
+from app.core.config import settings
+from app.core.enums import BlobBackend
+from app.infra.blob_storage.disk_cache import DiskCachedStorage
+from app.infra.blob_storage.interface import StorageBackend
+from app.infra.blob_storage.local_fs import LocalFSStorage
+from app.infra.blob_storage.s3_compat import S3CompatStorage
+
+
+def create_storage(*, read_cache: bool = False) -> StorageBackend:
+    # read_cache只给worker用：入库会反复读同一个原文件，API进程基本是一次性的上传下载
+    if settings.blob_backend == BlobBackend.s3:
+        s3 = S3CompatStorage(
+            endpoint_url=str(settings.blob_s3_endpoint_url),
+            bucket=str(settings.blob_s3_bucket),
+            access_key_id=str(settings.blob_s3_access_key_id),
+            secret_access_key=str(settings.blob_s3_secret_access_key),
+            region=settings.blob_s3_region,
+            part_size=int(settings.blob_s3_part_size_bytes),
+            max_concurrency=int(settings.blob_s3_upload_concurrency),
+            max_connections=int(settings.blob_s3_max_connections),
+            timeout_seconds=float(settings.blob_s3_timeout_seconds),
+        )
+        if read_cache and int(settings.blob_cache_max_bytes) > 0:
+            return DiskCachedStorage(s3, root_dir=str(settings.blob_cache_dir), max_bytes=int(settings.blob_cache_max_bytes))
+        return s3
+    return LocalFSStorage(root_dir=str(settings.blob_local_root))
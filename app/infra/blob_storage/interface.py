@@ -1,7 +1,9 @@
 from __future__ import annotations
 
 from dataclasses import dataclass
-from typing import Protocol
+from typing import AsyncIterator, Protocol
+
+DEFAULT_STREAM_CHUNK_SIZE = 1024 * 1024
 
 
 @dataclass(frozen=True)
@@ -10,19 +12,17 @@ class StoredObject:
     size: int
     content_type: str | None = None
     etag: str | None = None
+    sha256: str | None = None  # 写入时顺带算出的内容摘要，调用方不用再把数据过一遍
 
 
 class StorageBackend(Protocol):
     async def put_bytes(self, *, key: str, data: bytes, content_type: str | None = None) -> StoredObject: ...
+    async def put_stream(self, *, key: str, chunks: AsyncIterator[bytes], content_type: str | None = None) -> StoredObject: ...
     async def get_bytes(self, *, key: str) -> bytes: ...
+    def open_stream(self, *, key: str, chunk_size: int = DEFAULT_STREAM_CHUNK_SIZE) -> AsyncIterator[bytes]: ...
+    async def get_range(self, *, key: str, start: int, length: int) -> bytes: ...
     async def exists(self, *, key: str) -> bool: ...
+    async def stat(self, *, key: str) -> StoredObject | None: ...  # 只取大小和etag，不存在返回None
     async def delete(self, *, key: str) -> None: ...
-
-
-
-
-
-
-
-
-
+    async def move(self, *, src: str, dst: str) -> None: ...  # dst已存在时直接覆盖
+    def local_path(self, *, key: str) -> str | None: ...  # 本地盘上的文件路径，下载时可以直接sendfile；远端存储返回None
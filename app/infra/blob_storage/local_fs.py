@@ -2,11 +2,13 @@ from __future__ import annotations
 
 import hashlib
 import os
+import uuid
 from dataclasses import dataclass
+from typing import AsyncIterator
 
 import aiofiles
 
-from app.infra.blob_storage.interface import StorageBackend, StoredObject
+from app.infra.blob_storage.interface import DEFAULT_STREAM_CHUNK_SIZE, StorageBackend, StoredObject
 
 
 def _safe_key(key: str) -> str:
@@ -37,18 +39,77 @@ class LocalFSStorage(StorageBackend):
         os.makedirs(os.path.dirname(p), exist_ok=True)
         async with aiofiles.open(p, "wb") as f:
             await f.write(data)
-        etag = hashlib.sha256(data).hexdigest()
-        return StoredObject(key=key, size=len(data), content_type=content_type, etag=etag)
+        digest = hashlib.sha256(data).hexdigest()
+        return StoredObject(key=key, size=len(data), content_type=content_type, etag=digest, sha256=digest)
+
+    async def put_stream(self, *, key: str, chunks: AsyncIterator[bytes], content_type: str | None = None) -> StoredObject:
+        # 边收边写临时文件，写完再原子替换：内存里只有当前这一块，中途失败不会留下半个文件
+        p = _join(self.root_dir, key)
+        os.makedirs(os.path.dirname(p), exist_ok=True)
+        tmp = f"{p}.{uuid.uuid4().hex}.part"
+        h = hashlib.sha256()
+        size = 0
+        try:
+            async with aiofiles.open(tmp, "wb") as f:
+                async for b in chunks:
+                    if not b:
+                        continue
+                    await f.write(b)
+                    h.update(b)
+                    size += len(b)
+            os.replace(tmp, p)
+        except BaseException:
+            try:
+                os.remove(tmp)
+            except FileNotFoundError:
+                pass
+            raise
+        digest = h.hexdigest()
+        return StoredObject(key=key, size=size, content_type=content_type, etag=digest, sha256=digest)
 
     async def get_bytes(self, *, key: str) -> bytes:
         p = _join(self.root_dir, key)
         async with aiofiles.open(p, "rb") as f:
             return await f.read()
 
+    async def open_stream(self, *, key: str, chunk_size: int = DEFAULT_STREAM_CHUNK_SIZE) -> AsyncIterator[bytes]:
+        p = _join(self.root_dir, key)
+        async with aiofiles.open(p, "rb") as f:
+            while True:
+                b = await f.read(int(chunk_size))
+                if not b:
+                    break
+                yield b
+
+    async def get_range(self, *, key: str, start: int, length: int) -> bytes:
+        # 越过文件末尾时返回的内容会比length短，和HTTP Range的语义一致
+        if int(start) < 0 or int(length) < 0:
+            raise ValueError("bad_range")
+        p = _join(self.root_dir, key)
+        async with aiofiles.open(p, "rb") as f:
+            await f.seek(int(start))
+            return await f.read(int(length))
+
     async def exists(self, *, key: str) -> bool:
         p = _join(self.root_dir, key)
         return os.path.exists(p)
 
+    async def stat(self, *, key: str) -> StoredObject | None:
+        p = _join(self.root_dir, key)
+        try:
+            st = os.stat(p)
+        except FileNotFoundError:
+            return None
+        return StoredObject(key=key, size=int(st.st_size), etag=f"{st.st_mtime_ns:x}-{st.st_size:x}")
+
+    def local_path(self, *, key: str) -> str | None:
+        return _join(self.root_dir, key)
+
+    async def move(self, *, src: str, dst: str) -> None:
+        s, d = _join(self.root_dir, src), _join(self.root_dir, dst)
+        os.makedirs(os.path.dirname(d), exist_ok=True)
+        os.replace(s, d)
+
     async def delete(self, *, key: str) -> None:
         p = _join(self.root_dir, key)
         try:
@@ -1,26 +1,297 @@
-
 from __future__ import annotations
 
-from dataclasses import dataclass
+import asyncio
+import hashlib
+import hmac
+import xml.etree.ElementTree as ET
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import AsyncIterator
+from urllib.parse import quote
+
+import httpx
+
+from app.infra.blob_storage.interface import DEFAULT_STREAM_CHUNK_SIZE, StorageBackend, StoredObject
+
+EMPTY_SHA256 = hashlib.sha256(b"").hexdigest()
+MIN_PART_SIZE = 5 * 1024 * 1024  # S3要求除最后一块外每块至少5MB
+MAX_PARTS = 10000
+
+_S3_NS = "{http://s3.amazonaws.com/doc/2006-03-01/}"
+
+
+def _hmac(key: bytes, msg: str) -> bytes:
+    return hmac.new(key, msg.encode("utf-8"), hashlib.sha256).digest()
+
+
+def _q(s: str, safe: str = "-_.~") -> str:
+    return quote(s, safe=safe)
+
+
+def _xml_text(body: bytes, tag: str) -> str | None:
+    root = ET.fromstring(body)
+    for el in root.iter():
+        if el.tag in (tag, f"{_S3_NS}{tag}"):
+            return el.text
+    return None
 
-from app.infra.blob_storage.interface import StorageBackend, StoredObject
 
 @dataclass(frozen=True)
 class S3CompatStorage(StorageBackend):
+    # 只依赖S3的REST接口（path-style寻址，SigV4签名），MinIO/Ceph/各家对象存储都能用
     endpoint_url: str
     bucket: str
     access_key_id: str
     secret_access_key: str
     region: str | None = None
+    part_size: int = 8 * 1024 * 1024
+    max_concurrency: int = 4  # 分片上传时单个对象同时在传的分片数，内存占用上限约为 part_size * max_concurrency
+    max_connections: int = 64
+    timeout_seconds: float = 60.0
+    _client: httpx.AsyncClient = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        # 整个进程共用一个连接池，不要每次请求都重新握手
+        client = httpx.AsyncClient(
+            timeout=httpx.Timeout(float(self.timeout_seconds)),
+            limits=httpx.Limits(max_connections=int(self.max_connections), max_keepalive_connections=int(self.max_connections)),
+        )
+        object.__setattr__(self, "_client", client)
+
+    async def aclose(self) -> None:
+        await self._client.aclose()
+
+    def _url(self, key: str | None, query: dict[str, str] | None) -> tuple[str, str, str]:
+        base = httpx.URL(str(self.endpoint_url).rstrip("/"))
+        path = f"{base.path.rstrip('/')}/{_q(self.bucket)}"
+        if key is not None:
+            path += "/" + _q(key, safe="-_.~/")
+        qs = "&".join(f"{_q(k)}={_q(v)}" for k, v in sorted((query or {}).items()))
+        url = f"{base.scheme}://{base.netloc.decode()}{path}" + (f"?{qs}" if qs else "")
+        return url, path, qs
+
+    def _sign(
+        self,
+        method: str,
+        *,
+        host: str,
+        path: str,
+        qs: str,
+        payload_sha256: str,
+        now: datetime,
+        amz_headers: dict[str, str] | None = None,
+    ) -> dict[str, str]:
+        region = self.region or "us-east-1"
+        amz_date = now.strftime("%Y%m%dT%H%M%SZ")
+        day = amz_date[:8]
+        headers = {k.lower(): v for k, v in (amz_headers or {}).items()}  # x-amz-*请求头都要参与签名
+        headers.update({"host": host, "x-amz-content-sha256": payload_sha256, "x-amz-date": amz_date})
+        signed = ";".join(sorted(headers))
+        canonical = "\n".join([
+            method,
+            path,
+            qs,
+            "".join(f"{k}:{headers[k]}\n" for k in sorted(headers)),
+            signed,
+            payload_sha256,
+        ])
+        scope = f"{day}/{region}/s3/aws4_request"
+        to_sign = "\n".join(["AWS4-HMAC-SHA256", amz_date, scope, hashlib.sha256(canonical.encode("utf-8")).hexdigest()])
+        k = _hmac(_hmac(_hmac(_hmac(("AWS4" + self.secret_access_key).encode("utf-8"), day), region), "s3"), "aws4_request")
+        sig = hmac.new(k, to_sign.encode("utf-8"), hashlib.sha256).hexdigest()
+        return {
+            **{k: v for k, v in headers.items() if k != "host"},
+            "Authorization": f"AWS4-HMAC-SHA256 Credential={self.access_key_id}/{scope}, SignedHeaders={signed}, Signature={sig}",
+        }
+
+    def _request(
+        self,
+        method: str,
+        key: str | None,
+        *,
+        query: dict[str, str] | None = None,
+        content: bytes = b"",
+        payload_sha256: str | None = None,
+        headers: dict[str, str] | None = None,
+    ) -> httpx.Request:
+        url, path, qs = self._url(key, query)
+        amz = {k: v for k, v in (headers or {}).items() if k.lower().startswith("x-amz-")}
+        h = self._sign(
+            method,
+            host=httpx.URL(url).netloc.decode(),
+            path=path,
+            qs=qs,
+            payload_sha256=payload_sha256 or (hashlib.sha256(content).hexdigest() if content else EMPTY_SHA256),
+            now=datetime.now(timezone.utc),
+            amz_headers=amz,
+        )
+        h.update({k: v for k, v in (headers or {}).items() if k not in amz})
+        return self._client.build_request(method, url, headers=h, content=content or None)
+
+    async def _send(self, req: httpx.Request, *, key: str | None = None) -> httpx.Response:
+        resp = await self._client.send(req)
+        if resp.status_code == 404 and key is not None:
+            raise FileNotFoundError(key)  # 和本地盘的行为保持一致
+        resp.raise_for_status()
+        return resp
+
+    async def _put_object(self, *, key: str, data: bytes, content_type: str | None, sha256: str) -> str | None:
+        headers = {"Content-Type": content_type} if content_type else None
+        resp = await self._send(self._request("PUT", key, content=data, payload_sha256=sha256, headers=headers))
+        return resp.headers.get("etag")
 
     async def put_bytes(self, *, key: str, data: bytes, content_type: str | None = None) -> StoredObject:
-        raise NotImplementedError("s3_storage_not_configured")
+        async def _one() -> AsyncIterator[bytes]:
+            yield data
+
+        if len(data) > self._part_size():
+            return await self.put_stream(key=key, chunks=_one(), content_type=content_type)
+        digest = hashlib.sha256(data).hexdigest()
+        etag = await self._put_object(key=key, data=data, content_type=content_type, sha256=digest)
+        return StoredObject(key=key, size=len(data), content_type=content_type, etag=etag, sha256=digest)
+
+    def _part_size(self) -> int:
+        return max(MIN_PART_SIZE, int(self.part_size))
+
+    async def put_stream(self, *, key: str, chunks: AsyncIterator[bytes], content_type: str | None = None) -> StoredObject:
+        # 攒够一个分片就发出去，最多max_concurrency个分片同时在传；不到一个分片大小的对象直接单次PUT
+        part_size = self._part_size()
+        h = hashlib.sha256()
+        size = 0
+        buf = bytearray()
+        upload_id: str | None = None
+        sem = asyncio.Semaphore(max(1, int(self.max_concurrency)))
+        tasks: list[asyncio.Task[tuple[int, str]]] = []
+
+        async def _upload_part(n: int, body: bytes) -> tuple[int, str]:
+            try:
+                req = self._request("PUT", key, query={"partNumber": str(n), "uploadId": str(upload_id)}, content=body)
+                resp = await self._send(req)
+                return n, str(resp.headers.get("etag"))
+            finally:
+                sem.release()
+
+        async def _flush(body: bytes) -> None:
+            nonlocal upload_id
+            if upload_id is None:
+                headers = {"Content-Type": content_type} if content_type else None
+                resp = await self._send(self._request("POST", key, query={"uploads": ""}, headers=headers))
+                upload_id = _xml_text(resp.content, "UploadId")
+                if not upload_id:
+                    raise RuntimeError("s3_multipart_no_upload_id")
+            if len(tasks) >= MAX_PARTS:
+                raise ValueError("s3_too_many_parts")
+            await sem.acquire()  # 在途分片满了就停在这里，不再继续读上游，内存不会涨
+            failed = next((t for t in tasks if t.done() and t.exception() is not None), None)
+            if failed is not None:
+                sem.release()
+                raise failed.exception()
+            tasks.append(asyncio.create_task(_upload_part(len(tasks) + 1, body)))
+
+        try:
+            async for b in chunks:
+                if not b:
+                    continue
+                h.update(b)
+                size += len(b)
+                buf += b
+                while len(buf) >= part_size:
+                    body = bytes(buf[:part_size])
+                    del buf[:part_size]
+                    await _flush(body)
+            if upload_id is None:  # 整个对象都还在buf里，摘要就是请求体的摘要
+                digest = h.hexdigest()
+                etag = await self._put_object(key=key, data=bytes(buf), content_type=content_type, sha256=digest)
+                return StoredObject(key=key, size=size, content_type=content_type, etag=etag, sha256=digest)
+            if buf:
+                await _flush(bytes(buf))
+                buf.clear()
+            parts = sorted(await asyncio.gather(*tasks))
+            body = (
+                "<CompleteMultipartUpload>"
+                + "".join(f"<Part><PartNumber>{n}</PartNumber><ETag>{etag}</ETag></Part>" for n, etag in parts)
+                + "</CompleteMultipartUpload>"
+            ).encode("utf-8")
+            resp = await self._send(self._request("POST", key, query={"uploadId": upload_id}, content=body))
+            if b"<Error>" in resp.content:  # Complete失败时S3可能返回200加错误体
+                raise RuntimeError("s3_multipart_complete_failed")
+            etag = _xml_text(resp.content, "ETag")
+            return StoredObject(key=key, size=size, content_type=content_type, etag=etag, sha256=h.hexdigest())
+        except BaseException:
+            for t in tasks:
+                t.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if upload_id is not None:
+                try:
+                    await self._client.send(self._request("DELETE", key, query={"uploadId": upload_id}))
+                except httpx.HTTPError:
+                    pass
+            raise
 
     async def get_bytes(self, *, key: str) -> bytes:
-        raise NotImplementedError("s3_storage_not_configured")
+        resp = await self._send(self._request("GET", key), key=key)
+        return resp.content
+
+    async def open_stream(self, *, key: str, chunk_size: int = DEFAULT_STREAM_CHUNK_SIZE) -> AsyncIterator[bytes]:
+        resp = await self._client.send(self._request("GET", key), stream=True)
+        try:
+            if resp.status_code == 404:
+                raise FileNotFoundError(key)
+            resp.raise_for_status()
+            async for b in resp.aiter_bytes(int(chunk_size)):
+                yield b
+        finally:
+            await resp.aclose()
+
+    async def get_range(self, *, key: str, start: int, length: int) -> bytes:
+        # 越过对象末尾时返回的内容会比length短，和本地盘的实现一致
+        if int(start) < 0 or int(length) < 0:
+            raise ValueError("bad_range")
+        if int(length) == 0:
+            return b""
+        req = self._request("GET", key, headers={"Range": f"bytes={int(start)}-{int(start) + int(length) - 1}"})
+        resp = await self._client.send(req)
+        if resp.status_code == 416:
+            return b""
+        if resp.status_code == 404:
+            raise FileNotFoundError(key)
+        resp.raise_for_status()
+        if resp.status_code == 200:  # 不支持Range的实现会返回整个对象
+            return resp.content[int(start):int(start) + int(length)]
+        return resp.content
 
     async def exists(self, *, key: str) -> bool:
-        raise NotImplementedError("s3_storage_not_configured")
+        resp = await self._client.send(self._request("HEAD", key))
+        if resp.status_code == 404:
+            return False
+        resp.raise_for_status()
+        return True
+
+    async def stat(self, *, key: str) -> StoredObject | None:
+        resp = await self._client.send(self._request("HEAD", key))
+        if resp.status_code == 404:
+            return None
+        resp.raise_for_status()
+        return StoredObject(
+            key=key,
+            size=int(resp.headers.get("content-length") or 0),
+            content_type=resp.headers.get("content-type"),
+            etag=resp.headers.get("etag"),
+        )
+
+    async def move(self, *, src: str, dst: str) -> None:
+        # 服务端复制再删源，数据不经过本机；单次CopyObject最大5GB
+        req = self._request("PUT", dst, headers={"x-amz-copy-source": "/" + _q(self.bucket) + "/" + _q(src, safe="-_.~/")})
+        resp = await self._send(req)
+        if b"<Error>" in resp.content:  # 复制中途失败时S3可能返回200加错误体
+            raise RuntimeError("s3_copy_failed")
+        await self.delete(key=src)
 
     async def delete(self, *, key: str) -> None:
-        raise NotImplementedError("s3_storage_not_configured")
+        resp = await self._client.send(self._request("DELETE", key))
+        if resp.status_code == 404:
+            return
+        resp.raise_for_status()
+
+    def local_path(self, *, key: str) -> str | None:
+        return None
@@ -1,15 +1,25 @@
 from __future__ import annotations
 
+import os
+from typing import Any
+
 from celery import Celery
+from celery.signals import celeryd_init, worker_process_init, worker_process_shutdown
+from kombu import Queue
 
 from app.core.config import settings
 
+KB_QUEUE_SMALL = "kb.small"
+KB_QUEUE_LARGE = "kb.large"
+KB_QUEUE_MEDIA = "kb.media"
+
 celery_app = Celery(
     "enterprise_assistant",
     broker=settings.rabbitmq_url,
     backend=settings.celery_result_backend,
     include=[
         "app.workers.tasks.kb_ingest",
+        "app.workers.tasks.kb_blobs",
     ],
 )
 
@@ -20,4 +30,57 @@ celery_app.conf.update(
     enable_utc=True,
     timezone="UTC",
     task_always_eager=bool(settings.celery_task_always_eager),
-)
\ No newline at end of file
+    task_queues=[Queue(KB_QUEUE_SMALL), Queue(KB_QUEUE_LARGE), Queue(KB_QUEUE_MEDIA)],
+    task_default_queue=KB_QUEUE_SMALL,
+    task_routes={"kb.*": {"queue": KB_QUEUE_SMALL}},  # 真正的队列由dispatch按资产大小和类型在发送时指定
+    beat_schedule={
+        "kb-sweep-blobs": {"task": "kb.sweep_blobs", "schedule": float(settings.kb_blob_gc_interval_seconds)},
+    },
+)
+
+
+def queue_profiles() -> dict[str, dict[str, int]]:
+    # prefetch和并发是worker进程级别的配置，所以每个队列单独起worker（celery worker -Q kb.large），按队列套用
+    return {
+        KB_QUEUE_SMALL: {"concurrency": settings.kb_queue_small_concurrency, "prefetch": settings.kb_queue_small_prefetch},
+        KB_QUEUE_LARGE: {"concurrency": settings.kb_queue_large_concurrency, "prefetch": settings.kb_queue_large_prefetch},
+        KB_QUEUE_MEDIA: {"concurrency": settings.kb_queue_media_concurrency, "prefetch": settings.kb_queue_media_prefetch},
+    }
+
+
+def _worker_queues(options: dict[str, Any]) -> list[str]:
+    q = options.get("queues") or []
+    if isinstance(q, str):
+        q = q.split(",")
+    return [str(x).strip() for x in q if str(x).strip()]
+
+
+@celeryd_init.connect
+def _apply_queue_profile(sender: Any = None, conf: Any = None, options: dict[str, Any] | None = None, **kwargs: Any) -> None:
+    opts = options or {}
+    if conf is None:
+        return
+    profiles = queue_profiles()
+    # 同时消费多个队列时取最保守的配置，避免大文件占满小队列的预取
+    matched = [profiles[q] for q in _worker_queues(opts) if q in profiles]
+    if matched and not opts.get("concurrency"):  # 命令行显式指定的优先
+        conf.worker_concurrency = min(int(p["concurrency"]) for p in matched)
+    if matched and not opts.get("prefetch_multiplier"):
+        conf.worker_prefetch_multiplier = min(int(p["prefetch"]) for p in matched)
+    # 把最终生效的并发数写回conf，fork出来的子进程据此平分编码进程池；celery自己的默认值是本机核数
+    conf.worker_concurrency = int(opts.get("concurrency") or conf.worker_concurrency or os.cpu_count() or 1)
+
+
+@worker_process_init.connect
+def _configure_embed_pool(**kwargs: Any) -> None:
+    # 每个prefork子进程在第一次编码时建自己的编码进程池，池子大小按本机核数在子进程之间平分
+    from app.modules.kb.embeddings import configure_pool
+
+    configure_pool(share=int(celery_app.conf.worker_concurrency or 1))
+
+
+@worker_process_shutdown.connect
+def _stop_embed_pool(**kwargs: Any) -> None:
+    from app.modules.kb.embeddings import shutdown_pool
+
+    shutdown_pool()
@@ -1,14 +1,15 @@
 from __future__ import annotations
 
+from fastapi import Request
 from qdrant_client import AsyncQdrantClient
 
-from app.core.config import Settings
+from app.core.config import settings
 
 
 def create_qdrant_client() -> AsyncQdrantClient:
-    url = str(Settings.qdrant_url).strip()
-    api_key = (Settings.qdrant_api_key or "").strip() or None
-    return AsyncQdrantClient(url=url, api_key=api_key, timeout=float(Settings.qdrant_timeout_seconds))
+    url = str(settings.qdrant_url).strip()
+    api_key = (settings.qdrant_api_key or "").strip() or None
+    return AsyncQdrantClient(url=url, api_key=api_key, timeout=float(settings.qdrant_timeout_seconds))
 
 
 async def qdrant_ping(client: AsyncQdrantClient) -> bool:
@@ -16,4 +17,8 @@ async def qdrant_ping(client: AsyncQdrantClient) -> bool:
         await client.get_collections()
         return True
     except Exception:
-        return False
\ No newline at end of file
+        return False
+
+
+def get_qdrant(request: Request) -> AsyncQdrantClient:
+    return request.app.state.qdrant
@@ -21,9 +21,11 @@ from app.infra.elasticsearch_client import create_es_client
 from app.modules.admin.routes import router as admin_router
 from app.modules.authn.routes import router as auth_router
 from app.modules.authz.seed_sync import sync_authz
+from app.modules.kb.ingestion.progress import ProgressHub
+from app.modules.kb.routes import router as kb_router
 
 from app.infra.qdrant_client import create_qdrant_client
-from app.infra.blob_storage.local_fs import LocalFSStorage
+from app.infra.blob_storage.factory import create_storage
 
 
 @asynccontextmanager
@@ -34,7 +36,7 @@ async def lifespan(application: FastAPI):
     application.state.db_engine = engine
     application.state.db_session_maker = create_session_maker(engine)
     application.state.qdrant = create_qdrant_client()
-    application.state.storage = LocalFSStorage(root_dir=str(settings.blob_local_root))
+    application.state.storage = create_storage()
 
     redis = Redis.from_url(
         settings.redis_url,
@@ -46,6 +48,7 @@ async def lifespan(application: FastAPI):
         health_check_interval=settings.redis_health_check_interval,
     )
     application.state.redis = redis
+    application.state.kb_progress = ProgressHub(redis)
 
     application.state.es = create_es_client()
 
@@ -57,6 +60,18 @@ async def lifespan(application: FastAPI):
 
     yield
 
+    try:
+        await application.state.kb_progress.close()
+    except Exception:
+        pass
+
+    try:
+        aclose = getattr(application.state.storage, "aclose", None)
+        if callable(aclose):
+            await aclose()
+    except Exception:
+        pass
+
     try:
         await application.state.es.close()
     except Exception:
@@ -98,6 +113,7 @@ if settings.security_headers_enabled:
 app.include_router(health_router)
 app.include_router(auth_router)
 app.include_router(admin_router)
+app.include_router(kb_router)
 
 install_openapi(app)
 
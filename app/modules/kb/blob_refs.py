@@ -0,0 +1,65 @@
+from __future__ import annotations
+
+import logging
+from datetime import timedelta
+
+from sqlalchemy import delete, func, literal, select, update
+from sqlalchemy.dialects.postgresql import INTERVAL
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from app.infra.blob_storage.interface import StorageBackend
+from app.modules.kb.models import KBBlobRef
+
+logger = logging.getLogger(__name__)
+
+# 引用计数只管内容寻址的原文件：资产指向kb_blob_refs里的一行，删除资产时减一。
+# 归零的行不会立刻删，留一段宽限期给并发的同内容上传复用，过期后由sweep连同对象一起删掉。
+
+
+async def acquire(db: AsyncSession, *, sha256: str, storage_key: str, size_bytes: int) -> int:
+    # 在调用方的事务里执行；返回加一之后的引用数，1表示这份内容是第一次（或归零后重新）被引用
+    stmt = (
+        pg_insert(KBBlobRef)
+        .values(sha256=str(sha256), storage_key=str(storage_key), size_bytes=int(size_bytes), ref_count=1)
+        .on_conflict_do_update(
+            index_elements=[KBBlobRef.sha256],
+            set_={"ref_count": KBBlobRef.ref_count + 1, "updated_at": func.now()},
+        )
+        .returning(KBBlobRef.ref_count)
+    )
+    return int((await db.execute(stmt)).scalar_one())
+
+
+async def release(db: AsyncSession, *, sha256: str) -> None:
+    await db.execute(
+        update(KBBlobRef.__table__)
+        .where(KBBlobRef.sha256 == str(sha256), KBBlobRef.ref_count > 0)
+        .values(ref_count=KBBlobRef.ref_count - 1, updated_at=func.now())
+    )
+
+
+async def sweep(session_maker: async_sessionmaker[AsyncSession], storage: StorageBackend, *, grace_seconds: int, limit: int) -> int:
+    # 锁住待删的行直到对象删完再提交：同内容的新上传会在acquire上等这把锁，
+    # 等到的时候行已经没了，会重新插入并把内容写回去，不会指向一个刚被删掉的对象
+    picked = (
+        select(KBBlobRef.sha256, KBBlobRef.storage_key)
+        .where(KBBlobRef.ref_count == 0, KBBlobRef.updated_at < func.now() - literal(timedelta(seconds=int(grace_seconds)), INTERVAL))
+        .order_by(KBBlobRef.updated_at)
+        .limit(max(1, int(limit)))
+        .with_for_update(skip_locked=True)
+    )
+    async with session_maker() as db:
+        async with db.begin():
+            rows = (await db.execute(picked)).all()
+            done: list[str] = []
+            for r in rows:
+                try:
+                    await storage.delete(key=str(r.storage_key))
+                except Exception:
+                    logger.warning("kb_blob_sweep_delete_failed", exc_info=True, extra={"sha256": r.sha256})
+                    continue
+                done.append(str(r.sha256))
+            if done:
+                await db.execute(delete(KBBlobRef).where(KBBlobRef.sha256.in_(done), KBBlobRef.ref_count == 0))
+    return len(done)
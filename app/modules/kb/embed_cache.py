@@ -0,0 +1,181 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+
+import numpy as np
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+EMB_REDIS_KEY_PREFIX = "kb:emb"
+
+_disk: "_DiskTier | None" = None
+_disk_lock = threading.Lock()
+
+
+def cache_key(model_name: str, text: str) -> str:
+    # 只做轻量归一化（Unicode NFC + 空白折叠），页眉页脚这类重复文本空白不同也能命中
+    norm = " ".join(unicodedata.normalize("NFC", str(text)).split())
+    return hashlib.sha256(f"{model_name}\n{norm}".encode("utf-8")).hexdigest()
+
+
+def _pack(vec: list[float]) -> bytes:
+    return np.asarray(vec, dtype=np.float32).tobytes()
+
+
+def _unpack(raw: bytes) -> list[float]:
+    return np.frombuffer(raw, dtype=np.float32).tolist()
+
+
+def _marks(n: int) -> str:
+    return ",".join("?" * int(n))
+
+
+class _DiskTier:  # worker本机上的sqlite，多个prefork子进程共用一个文件
+    # 缓存只是加速手段：sqlite的任何错误（多进程争用时的database is locked之类）都只记日志，读当作未命中、写直接跳过
+    def __init__(self, path: str, *, max_bytes: int) -> None:
+        self.max_bytes = int(max_bytes)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=5.0, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA busy_timeout=5000")
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS emb (k TEXT PRIMARY KEY, v BLOB NOT NULL, used_at REAL NOT NULL)"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_emb_used_at ON emb (used_at)")
+            # 总字节数记在单行计数表里，由触发器随增删改增量维护，写入时不用每次全表SUM
+            self.conn.execute("CREATE TABLE IF NOT EXISTS emb_size (id INTEGER PRIMARY KEY CHECK (id = 0), total INTEGER NOT NULL)")
+            self.conn.execute("INSERT OR IGNORE INTO emb_size (id, total) SELECT 0, COALESCE(SUM(LENGTH(v)), 0) FROM emb")
+            self.conn.execute(
+                "CREATE TRIGGER IF NOT EXISTS emb_size_ins AFTER INSERT ON emb "
+                "BEGIN UPDATE emb_size SET total = total + LENGTH(NEW.v) WHERE id = 0; END"
+            )
+            self.conn.execute(
+                "CREATE TRIGGER IF NOT EXISTS emb_size_upd AFTER UPDATE OF v ON emb "
+                "BEGIN UPDATE emb_size SET total = total + LENGTH(NEW.v) - LENGTH(OLD.v) WHERE id = 0; END"
+            )
+            self.conn.execute(
+                "CREATE TRIGGER IF NOT EXISTS emb_size_del AFTER DELETE ON emb "
+                "BEGIN UPDATE emb_size SET total = total - LENGTH(OLD.v) WHERE id = 0; END"
+            )
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+
+    def get_many(self, keys: list[str]) -> dict[str, bytes]:
+        if not keys:
+            return {}
+        with self.lock:
+            try:
+                rows = self.conn.execute(f"SELECT k, v FROM emb WHERE k IN ({_marks(len(keys))})", keys).fetchall()
+            except sqlite3.Error:
+                logger.warning("kb_embed_cache_disk_get_failed", exc_info=True)
+                return {}
+            if rows:
+                hit = [r[0] for r in rows]
+                try:
+                    self.conn.execute(f"UPDATE emb SET used_at = ? WHERE k IN ({_marks(len(hit))})", [time.time(), *hit])
+                except sqlite3.Error:  # 只是没刷新LRU时间，命中的结果照常返回
+                    logger.warning("kb_embed_cache_disk_touch_failed", exc_info=True)
+        return {str(k): bytes(v) for k, v in rows}
+
+    def put_many(self, items: dict[str, bytes]) -> None:
+        if not items:
+            return
+        now = time.time()
+        try:
+            with self.lock:
+                # 用upsert而不是INSERT OR REPLACE：REPLACE删旧行时不触发删除触发器，计数会偏大
+                self.conn.executemany(
+                    "INSERT INTO emb (k, v, used_at) VALUES (?, ?, ?) "
+                    "ON CONFLICT (k) DO UPDATE SET v = excluded.v, used_at = excluded.used_at",
+                    [(k, v, now) for k, v in items.items()],
+                )
+                self._evict()
+        except sqlite3.Error:
+            logger.warning("kb_embed_cache_disk_put_failed", exc_info=True)
+
+    def _evict(self) -> None:
+        # 超出磁盘预算时按最近使用时间淘汰，一次删到预算的90%，避免每次写入都触发淘汰
+        size = int(self.conn.execute("SELECT total FROM emb_size WHERE id = 0").fetchone()[0])
+        if size <= self.max_bytes:
+            return
+        target = size - int(self.max_bytes * 0.9)
+        freed = 0
+        victims: list[str] = []
+        for k, n in self.conn.execute("SELECT k, LENGTH(v) FROM emb ORDER BY used_at"):
+            victims.append(str(k))
+            freed += int(n)
+            if freed >= target:
+                break
+        self.conn.executemany("DELETE FROM emb WHERE k = ?", [(k,) for k in victims])
+
+
+def _disk_tier() -> _DiskTier | None:
+    global _disk
+    root = settings.kb_embed_cache_dir
+    if not root:
+        return None
+    with _disk_lock:
+        if _disk is None:
+            try:
+                os.makedirs(str(root), exist_ok=True)
+                _disk = _DiskTier(os.path.join(str(root), "embeddings.sqlite3"), max_bytes=int(settings.kb_embed_cache_disk_max_bytes))
+            except (sqlite3.Error, OSError):
+                logger.warning("kb_embed_cache_disk_open_failed", exc_info=True)  # 这次不用磁盘层，下次调用再试
+                return None
+        return _disk
+
+
+async def lookup(redis: Redis | None, keys: list[str]) -> dict[str, list[float]]:
+    # 先查本机磁盘，再查redis；redis命中的顺手回填到磁盘
+    found: dict[str, bytes] = {}
+    disk = _disk_tier()
+    if disk is not None and keys:
+        found.update(await asyncio.to_thread(disk.get_many, keys))
+    missing = [k for k in keys if k not in found]
+    if redis is not None and missing:
+        try:
+            raws = await redis.mget([f"{EMB_REDIS_KEY_PREFIX}:{k}" for k in missing])
+        except RedisError:
+            logger.warning("kb_embed_cache_redis_get_failed", exc_info=True)
+            raws = []
+        hits = {k: bytes(raw) for k, raw in zip(missing, raws) if raw}
+        if hits and disk is not None:
+            await asyncio.to_thread(disk.put_many, hits)
+        found.update(hits)
+    return {k: _unpack(v) for k, v in found.items()}
+
+
+async def store(redis: Redis | None, items: dict[str, list[float]]) -> None:
+    if not items:
+        return
+    packed = {k: _pack(v) for k, v in items.items()}
+    disk = _disk_tier()
+    if disk is not None:
+        await asyncio.to_thread(disk.put_many, packed)
+    if redis is None:
+        return
+    # key都带TTL，redis按volatile-lru/allkeys-lru策略在内存不够时优先淘汰最久未用的
+    ttl = int(settings.kb_embed_cache_ttl_seconds)
+    try:
+        async with redis.pipeline(transaction=False) as pipe:
+            for k, v in packed.items():
+                pipe.set(f"{EMB_REDIS_KEY_PREFIX}:{k}", v, ex=ttl)
+            await pipe.execute()
+    except RedisError:
+        logger.warning("kb_embed_cache_redis_set_failed", exc_info=True)
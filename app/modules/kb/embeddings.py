@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import threading
+
+import billiard
+import numpy as np
+from billiard.pool import Pool
+from fastembed import TextEmbedding
+from redis.asyncio import Redis
+
+from app.core.config import settings
+from app.modules.kb import embed_cache
+
+logger = logging.getLogger(__name__)
+
+_proc_model: TextEmbedding | None = None  # 进程池子进程里各自持有的模型
+
+_pool: Pool | None = None
+_pool_lock = threading.Lock()
+_pool_share = 1  # 本机上各自建池子的进程数，由celery在prefork子进程里设置
+
+_local_models: dict[str, TextEmbedding] = {}
+_local_lock = threading.Lock()
+
+
+def _init_pool_worker(model_name: str) -> None:
+    global _proc_model
+    _proc_model = TextEmbedding(model_name=model_name, threads=1)  # 每个进程单线程，进程数就是并行度
+
+
+def _encode_in_pool(texts: list[str]) -> np.ndarray:
+    assert _proc_model is not None
+    return np.stack(list(_proc_model.embed(texts, batch_size=max(1, len(texts))))).astype(np.float32)
+
+
+def _local_model(model_name: str) -> TextEmbedding:
+    with _local_lock:
+        m = _local_models.get(model_name)
+        if m is None:
+            m = TextEmbedding(model_name=model_name)
+            _local_models[model_name] = m
+        return m
+
+
+def _encode_local(model_name: str, texts: list[str]) -> np.ndarray:
+    m = _local_model(model_name)
+    return np.stack(list(m.embed(texts, batch_size=max(1, len(texts))))).astype(np.float32)
+
+
+def configure_pool(*, share: int) -> None:
+    global _pool_share
+    _pool_share = max(1, int(share))
+
+
+def pool_size(*, share: int | None = None) -> int:
+    # share是同一台机器上各自开池子的进程数（celery prefork的并发数），默认按核数平分
+    n = int(settings.kb_embed_pool_size or 0)
+    return n if n > 0 else max(1, (os.cpu_count() or 1) // max(1, int(share or _pool_share)))
+
+
+def start_pool(*, size: int | None = None) -> Pool:
+    # 第一次编码时才建：只消费媒体队列的worker、beat这类进程永远不会加载模型。
+    # 用billiard的spawn池：celery prefork的子进程是daemon进程，标准库的进程池在里面建不起来，billiard允许；
+    # spawn出来的进程不继承worker里的连接和线程
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            n = int(size) if size else pool_size()
+            _pool = billiard.get_context("spawn").Pool(
+                processes=n,
+                initializer=_init_pool_worker,
+                initargs=(str(settings.kb_embed_model),),
+            )
+            logger.info("kb_embed_pool_started", extra={"workers": n, "model": settings.kb_embed_model})
+        return _pool
+
+
+def shutdown_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.terminate()
+            _pool.join()
+            _pool = None
+
+
+async def _encode_uncached(texts: list[str]) -> list[list[float]]:
+    # 批量编码走进程池，CPU密集的推理不占用worker事件循环所在的线程
+    pool = start_pool()
+    loop = asyncio.get_running_loop()
+    fut: asyncio.Future[np.ndarray] = loop.create_future()
+
+    def _done(res: np.ndarray) -> None:
+        loop.call_soon_threadsafe(lambda: fut.done() or fut.set_result(res))
+
+    def _failed(e: BaseException) -> None:
+        loop.call_soon_threadsafe(lambda: fut.done() or fut.set_exception(e))
+
+    pool.apply_async(_encode_in_pool, (list(texts),), callback=_done, error_callback=_failed)
+    arr = await fut
+    return arr.tolist()
+
+
+async def encode_texts(texts: list[str], *, redis: Redis | None = None) -> list[list[float]]:
+    if not texts:
+        return []
+    if not settings.kb_embed_cache_enabled:
+        return await _encode_uncached(list(texts))
+    model = str(settings.kb_embed_model)
+    keys = [embed_cache.cache_key(model, t) for t in texts]
+    vecs = await embed_cache.lookup(redis, list(dict.fromkeys(keys)))
+    # 同一批里重复的文本也只编码一次
+    todo = {k: t for k, t in zip(keys, texts) if k not in vecs}
+    if todo:
+        fresh = dict(zip(todo, await _encode_uncached(list(todo.values()))))
+        await embed_cache.store(redis, fresh)
+        vecs.update(fresh)
+    return [vecs[k] for k in keys]
+
+
+async def encode_query(text: str, *, redis: Redis | None = None) -> list[float]:
+    model = str(settings.kb_embed_model)
+    key = embed_cache.cache_key(model, text)
+    if settings.kb_embed_cache_enabled:
+        hit = (await embed_cache.lookup(redis, [key])).get(key)
+        if hit is not None:
+            return hit
+    # 单条查询不值得跨进程传输，直接在线程里用进程内的模型
+    arr = await asyncio.to_thread(_encode_local, model, [str(text)])
+    vec = arr[0].tolist()
+    if settings.kb_embed_cache_enabled:
+        await embed_cache.store(redis, {key: vec})
+    return vec
@@ -0,0 +1,62 @@
+from __future__ import annotations
+
+from typing import Any
+
+from elasticsearch import AsyncElasticsearch, BadRequestError
+
+from app.core.config import settings
+
+FIELD_TEXT = "text"
+FIELD_WORKSPACE_ID = "workspace_id"
+FIELD_ASSET_ID = "asset_id"
+FIELD_CHUNK_INDEX = "chunk_index"
+
+
+def workspace_alias(workspace_id: int) -> str:
+    # 检索和写入都只认别名，具体落在哪个物理索引由别名决定
+    return f"{settings.es_kb_index_prefix}-ws-{int(workspace_id)}"
+
+
+def workspace_routing(workspace_id: int) -> str:
+    return str(int(workspace_id))
+
+
+def physical_index_name(workspace_id: int) -> str:
+    # 物理索引带版本号，改mapping时建新版本再切别名即可，不影响线上检索
+    return f"{workspace_alias(workspace_id)}-v{int(settings.es_kb_index_version)}"
+
+
+_MAPPINGS: dict[str, Any] = {
+    "_routing": {"required": True},
+    "properties": {
+        FIELD_TEXT: {"type": "text"},
+        FIELD_WORKSPACE_ID: {"type": "long"},
+        FIELD_ASSET_ID: {"type": "long"},
+        FIELD_CHUNK_INDEX: {"type": "integer"},
+    },
+}
+
+_ensured: set[str] = set()
+
+
+async def ensure_workspace_index(es: AsyncElasticsearch, *, workspace_id: int) -> str:
+    alias = workspace_alias(workspace_id)
+    if alias in _ensured:
+        return alias
+    if not await es.indices.exists_alias(name=alias):
+        try:
+            await es.indices.create(
+                index=physical_index_name(workspace_id),
+                mappings=_MAPPINGS,
+                settings={"index": {"refresh_interval": str(settings.es_refresh_interval)}},
+                aliases={alias: {"is_write_index": True}},
+            )
+        except BadRequestError as e:
+            if e.error != "resource_already_exists_exception":  # 并发的任务先建好了
+                raise
+    _ensured.add(alias)
+    return alias
+
+
+async def set_refresh_interval(es: AsyncElasticsearch, *, workspace_id: int, interval: str) -> None:
+    await es.indices.put_settings(index=workspace_alias(workspace_id), settings={"index": {"refresh_interval": interval}})
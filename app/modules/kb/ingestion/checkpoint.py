@@ -0,0 +1,83 @@
+from __future__ import annotations
+
+from typing import Any, Awaitable, Callable
+
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from app.modules.kb.ingestion.progress import EVENT_STAGE, ProgressPublisher
+from app.modules.kb.ingestion.utils import json_merge
+from app.modules.kb.models import KBAsset, KBIndexJob
+
+STAGE_EXTRACT = "extract"
+STAGE_CHUNK = "chunk"
+STAGE_DEDUP = "dedup"
+STAGE_EMBED = "embed"
+STAGE_INDEX = "index"
+
+
+def source_fingerprint(asset: KBAsset) -> dict[str, Any]:
+    # 断点只对同一份源文件有效，重新上传后旧job的进度要作废
+    return {"storage_key": asset.storage_key, "sha256": asset.sha256, "size_bytes": asset.size_bytes}
+
+
+class JobCheckpoint:
+    def __init__(self, session_maker: async_sessionmaker[AsyncSession], *, job_id: int, meta: dict[str, Any] | None) -> None:
+        self.session_maker = session_maker
+        self.job_id = int(job_id)
+        self.meta: dict[str, Any] = dict(meta or {})
+        self.stages: dict[str, dict[str, Any]] = dict(self.meta.get("stages") or {})
+        self.publisher: ProgressPublisher | None = None  # 设置了就把每次阶段进度推给订阅方
+
+    @property
+    def resumed(self) -> bool:
+        return bool(self.stages)
+
+    def stage(self, name: str) -> dict[str, Any]:
+        return dict(self.stages.get(name) or {})
+
+    def done(self, name: str) -> bool:
+        return bool(self.stage(name).get("done"))
+
+    def stats(self, name: str) -> dict[str, Any] | None:
+        return self.stage(name).get("stats")
+
+    def resume_point(self, name: str) -> tuple[int, int]:
+        # (最后一个已提交的chunk_index, 已处理条数)，没有断点时从头开始
+        st = self.stage(name)
+        return int(st.get("last", -1)), int(st.get("count") or 0)
+
+    def progress_saver(self, name: str) -> Callable[[int, int], Awaitable[None]]:
+        _, base = self.resume_point(name)
+
+        async def _save(last: int, count: int) -> None:
+            await self.save(name, last=int(last), count=base + int(count))
+
+        return _save
+
+    async def save(self, name: str, **fields: Any) -> None:
+        cur = self.stage(name)
+        cur.update(fields)
+        self.stages[name] = cur
+        await self.put(stages=self.stages)
+        if self.publisher is not None:
+            await self.publisher.publish(EVENT_STAGE, stage=name, **fields)
+
+    async def finish(self, name: str, stats: dict[str, Any] | None) -> None:
+        await self.save(name, done=True, stats=stats)
+
+    async def finish_many(self, stats: dict[str, dict[str, Any] | None], **patch: Any) -> None:
+        # 多个阶段一次写回，只有一条UPDATE
+        for name, st in stats.items():
+            cur = self.stage(name)
+            cur.update(done=True, stats=st)
+            self.stages[name] = cur
+        await self.put(stages=self.stages, **patch)
+
+    async def put(self, **patch: Any) -> None:
+        self.meta.update(patch)
+        async with self.session_maker() as db:
+            async with db.begin():
+                await db.execute(
+                    update(KBIndexJob).where(KBIndexJob.id == self.job_id).values(meta=json_merge(KBIndexJob.meta, patch))
+                )
@@ -0,0 +1,55 @@
+from __future__ import annotations
+
+import json
+import logging
+import time
+from typing import Any
+
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+logger = logging.getLogger(__name__)
+
+# 每个资产只保留最近一次最终失败的记录，重新处理成功后删掉，所以这里始终是"当前还坏着的资产"
+DEAD_LETTER_REDIS_KEY = "kb:ingest:dead"
+
+
+async def push(
+        redis: Redis | None,
+        *,
+        asset_id: int,
+        job_id: int,
+        attempt: int,
+        error: str,
+        error_type: str,
+        transient: bool) -> None:
+    if redis is None:
+        return
+    row = {
+        "asset_id": int(asset_id),
+        "job_id": int(job_id),
+        "attempt": int(attempt),
+        "error": error,
+        "error_type": error_type,
+        "transient": bool(transient),  # True表示重试次数用完了，依赖恢复后可以直接重新入队
+        "failed_at": int(time.time()),
+    }
+    try:
+        await redis.hset(DEAD_LETTER_REDIS_KEY, str(int(asset_id)), json.dumps(row, ensure_ascii=False))
+    except RedisError:
+        logger.warning("kb_ingest_dead_letter_push_failed", exc_info=True, extra={"asset_id": int(asset_id)})
+
+
+async def clear(redis: Redis | None, *, asset_id: int) -> None:
+    if redis is None:
+        return
+    try:
+        await redis.hdel(DEAD_LETTER_REDIS_KEY, str(int(asset_id)))
+    except RedisError:
+        logger.warning("kb_ingest_dead_letter_clear_failed", exc_info=True, extra={"asset_id": int(asset_id)})
+
+
+async def list_dead(redis: Redis, *, limit: int = 100) -> list[dict[str, Any]]:
+    rows = [json.loads(v) for v in (await redis.hgetall(DEAD_LETTER_REDIS_KEY)).values()]
+    rows.sort(key=lambda r: r.get("failed_at") or 0, reverse=True)
+    return rows[:max(1, int(limit))]
@@ -0,0 +1,95 @@
+from __future__ import annotations
+
+from typing import Iterable
+
+from celery import chord
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.core.enums import IngestBackend
+from app.infra.celery.celery_app import KB_QUEUE_LARGE, KB_QUEUE_MEDIA, KB_QUEUE_SMALL, celery_app
+from app.modules.kb.ingestion import pg_queue
+from app.modules.kb.ingestion.steps.sniff import sniff
+from app.modules.kb.models import KBAsset
+
+TASK_INGEST_ASSET = "kb.ingest_asset"
+TASK_INGEST_ASSETS = "kb.ingest_assets"
+TASK_INGEST_PDF_PART = "kb.ingest_pdf_part"
+TASK_INGEST_PDF_MERGE = "kb.ingest_pdf_merge"
+PG_QUEUE = "pg"
+
+_MEDIA_SOURCE_TYPES = {"audio", "video"}
+
+
+def ingest_queue(*, size_bytes: int | None, source_type: str | None) -> str:
+    # 音视频一律单独排队；其余按文件大小分流，大文件不堵住小文件
+    if source_type in _MEDIA_SOURCE_TYPES:
+        return KB_QUEUE_MEDIA
+    if size_bytes is not None and int(size_bytes) >= int(settings.kb_queue_large_min_bytes):
+        return KB_QUEUE_LARGE
+    return KB_QUEUE_SMALL
+
+
+async def asset_queue(asset: KBAsset) -> str:
+    source_type = asset.source_type
+    if not source_type:  # 还没跑过pipeline的资产按文件名/mime先判断一次
+        source_type = (await sniff(filename=asset.filename, mime_type_hint=asset.mime_type)).source_type
+    return ingest_queue(size_bytes=asset.size_bytes, source_type=source_type)
+
+
+def _pg_session(db: AsyncSession | None) -> AsyncSession:
+    if db is None:  # pg后端的入队就是写job表，必须和资产在同一个事务里
+        raise RuntimeError("KB_INGEST_BACKEND=pg requires the caller's db session to enqueue")
+    return db
+
+
+async def enqueue_ingest(asset: KBAsset, *, db: AsyncSession | None = None) -> str:
+    if settings.kb_ingest_backend == IngestBackend.pg:
+        await pg_queue.enqueue(_pg_session(db), asset)
+        return PG_QUEUE
+    queue = await asset_queue(asset)
+    celery_app.send_task(
+        TASK_INGEST_ASSET,
+        args=[int(asset.id)],
+        kwargs={"workspace_id": int(asset.workspace_id), "sha256": asset.sha256},
+        queue=queue,
+    )
+    return queue
+
+
+async def enqueue_ingest_many(
+        assets: Iterable[KBAsset],
+        *,
+        batch_size: int | None = None,
+        db: AsyncSession | None = None) -> dict[str, int]:
+    if settings.kb_ingest_backend == IngestBackend.pg:
+        n = 0
+        for a in assets:
+            await pg_queue.enqueue(_pg_session(db), a)
+            n += 1
+        return {PG_QUEUE: n}
+    # 回填时按队列分组，每组再切成固定大小的批次交给kb.ingest_assets
+    bs = max(1, int(batch_size or settings.kb_ingest_batch_size))
+    by_queue: dict[str, list[int]] = {}
+    for a in assets:
+        by_queue.setdefault(await asset_queue(a), []).append(int(a.id))
+    for queue, ids in by_queue.items():
+        for i in range(0, len(ids), bs):
+            celery_app.send_task(TASK_INGEST_ASSETS, args=[ids[i:i + bs]], queue=queue)
+    return {q: len(ids) for q, ids in by_queue.items()}
+
+
+def dispatch_pdf_parts(asset_id: int, job_id: int, mime_type: str | None, ranges: list[tuple[int, int]]) -> None:
+    # 各段进同一个队列让整个worker池分摊，全部成功后chord回调合并
+    queue = str(settings.kb_pdf_fanout_queue)
+    header = [
+        celery_app.signature(
+            TASK_INGEST_PDF_PART,
+            args=[int(asset_id), int(job_id), i, int(start), int(end)],
+            kwargs={"mime_type": mime_type},
+            queue=queue,
+        )
+        for i, (start, end) in enumerate(ranges)
+    ]
+    body = celery_app.signature(TASK_INGEST_PDF_MERGE, kwargs={"asset_id": int(asset_id), "job_id": int(job_id)}, queue=queue)
+    chord(header)(body)
@@ -0,0 +1,157 @@
+from __future__ import annotations
+
+import math
+from typing import Any, AsyncIterator
+
+from qdrant_client import AsyncQdrantClient
+from redis.asyncio import Redis
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from app.core.config import settings
+from app.infra.blob_storage.interface import StorageBackend
+from app.modules.kb.consts import ASSET_STATUS_PROCESSING, INDEX_JOB_STATUS_RUNNING
+from app.modules.kb.ingestion.progress import EVENT_PART, ProgressPublisher
+from app.modules.kb.ingestion.slots import renewing_slot
+from app.modules.kb.ingestion.steps.chunk import TokenChunker, write_chunks
+from app.modules.kb.ingestion.steps.embed import embed_chunks
+from app.modules.kb.ingestion.steps.extract import KIND_PDF, ExtractedSection, document_kind, extract_sections, pdf_page_count
+from app.modules.kb.models import KBAsset, KBChunk, KBIndexJob
+from app.modules.kb.vectors import delete_points
+
+STAGE_FANOUT = "fanout"
+
+# 每一段的chunk先写到各自的暂存序号区间里：[STAGING_BASE + part * PART_STRIDE, 下一段起点)。
+# 暂存序号全是负数，不会和正式的0..n-1冲突，按序号排序正好是(段号, 段内序号)的顺序。
+STAGING_BASE = -2_000_000_000
+PART_STRIDE = 1_000_000
+MAX_PARTS = -STAGING_BASE // PART_STRIDE
+
+
+def part_offset(part: int) -> int:
+    return STAGING_BASE + int(part) * PART_STRIDE
+
+
+def page_ranges(page_count: int) -> list[tuple[int, int]]:
+    per = max(1, int(settings.kb_pdf_fanout_pages_per_part), math.ceil(int(page_count) / MAX_PARTS))
+    return [(s, min(int(page_count), s + per)) for s in range(0, int(page_count), per)]
+
+
+async def plan_fanout(storage: StorageBackend, *, asset: KBAsset, mime_type: str | None) -> list[tuple[int, int]] | None:
+    min_pages = int(settings.kb_pdf_fanout_min_pages)
+    if min_pages <= 0 or document_kind(mime_type=mime_type, filename=asset.filename) != KIND_PDF:
+        return None
+    if int(asset.size_bytes or 0) < int(settings.kb_pdf_fanout_min_bytes):  # 数页数要把整个文件读一遍，小文件直接跳过
+        return None
+    n = await pdf_page_count(storage, str(asset.storage_key))
+    if n < min_pages:
+        return None
+    ranges = page_ranges(n)
+    return ranges if len(ranges) > 1 else None
+
+
+async def run_part(
+    *,
+    session_maker: async_sessionmaker[AsyncSession],
+    storage: StorageBackend,
+    qdrant: AsyncQdrantClient,
+    redis: Redis | None,
+    asset_id: int,
+    job_id: int,
+    part: int,
+    pages: tuple[int, int],
+    mime_type: str | None = None,
+) -> dict[str, Any]:
+    async with session_maker() as db:
+        async with db.begin():
+            asset = (
+                await db.execute(select(KBAsset).where(KBAsset.id == int(asset_id), KBAsset.status == ASSET_STATUS_PROCESSING))
+            ).scalar_one_or_none()
+    if asset is None or not await fanout_active(session_maker, job_id=int(job_id)):  # 资产在拆分处理期间被删除或重新上传了，或者别的段已经失败
+        return {"part": int(part), "skipped": True}
+
+    stats: dict[str, Any] = {"part": int(part), "pages": [int(pages[0]), int(pages[1])], "sections": 0, "chars": 0}
+
+    async def _counted(it: AsyncIterator[ExtractedSection]) -> AsyncIterator[ExtractedSection]:
+        async for sec in it:
+            stats["sections"] += 1
+            stats["chars"] += len(sec.text)
+            yield sec
+
+    # 段与段之间切块各自独立：跨页码边界的那一个chunk不会合并，也没有overlap
+    offset = part_offset(part)
+    sections = extract_sections(storage=storage, key=str(asset.storage_key), mime_type=mime_type or asset.mime_type, filename=asset.filename, pages=pages)
+    # 各段共用拆分时交出来的那个workspace槽位，处理期间续租，由finish_fanout/fail_fanout释放
+    async with renewing_slot(redis, workspace_id=int(asset.workspace_id), member=str(int(asset.id))):
+        chunk_stats = await write_chunks(
+            session_maker=session_maker,
+            asset_id=int(asset.id),
+            chunks=TokenChunker.from_settings().chunks(_counted(sections)),
+            index_offset=offset,
+            index_span=PART_STRIDE,
+        )
+        emb = await embed_chunks(
+            session_maker=session_maker,
+            qdrant=qdrant,
+            redis=redis,
+            asset=asset,
+            start_after=offset - 1,
+            end_before=offset + PART_STRIDE,
+        )
+    # 写完再确认一次：fail_fanout先清标记再删暂存，标记还在说明这一段写的东西要么留给合并、要么会被它删掉；
+    # 标记已经没了，这一段是在清理之后才写完的，自己删掉，不给下一次拆分留下残余
+    if not await fanout_active(session_maker, job_id=int(job_id)):
+        await discard_staged(session_maker, qdrant, asset_id=int(asset.id), part=int(part))
+        return {"part": int(part), "skipped": True}
+    out = {**stats, **chunk_stats, "embedded": int(emb["embedded"])}
+    progress = ProgressPublisher(redis, workspace_id=int(asset.workspace_id), asset_id=int(asset.id), job_id=int(job_id))
+    await progress.publish(EVENT_PART, **out)
+    return out
+
+
+async def merge_parts(session_maker: async_sessionmaker[AsyncSession], *, asset_id: int) -> int:
+    # 一个事务里删掉旧版本的正式chunk，再把暂存的按序号重排成0..n-1；重复执行时没有暂存行，直接返回现有数量
+    staged = (
+        select(KBChunk.id, (func.row_number().over(order_by=KBChunk.chunk_index) - 1).label("rn"))
+        .where(KBChunk.asset_id == int(asset_id), KBChunk.chunk_index < 0)
+        .subquery()
+    )
+    async with session_maker() as db:
+        async with db.begin():
+            has_staged = (
+                await db.execute(select(KBChunk.id).where(KBChunk.asset_id == int(asset_id), KBChunk.chunk_index < 0).limit(1))
+            ).first() is not None
+            if has_staged:
+                await db.execute(delete(KBChunk).where(KBChunk.asset_id == int(asset_id), KBChunk.chunk_index >= 0))
+                await db.execute(update(KBChunk.__table__).where(KBChunk.id == staged.c.id).values(chunk_index=staged.c.rn))
+            return int(
+                (await db.execute(select(func.count()).select_from(KBChunk).where(KBChunk.asset_id == int(asset_id)))).scalar_one()
+            )
+
+
+async def fanout_active(session_maker: async_sessionmaker[AsyncSession], *, job_id: int) -> bool:
+    async with session_maker() as db:
+        async with db.begin():
+            meta = (
+                await db.execute(select(KBIndexJob.meta).where(KBIndexJob.id == int(job_id), KBIndexJob.status == INDEX_JOB_STATUS_RUNNING))
+            ).scalar_one_or_none()
+    return bool((meta or {}).get(STAGE_FANOUT))
+
+
+async def discard_staged(
+        session_maker: async_sessionmaker[AsyncSession],
+        qdrant: AsyncQdrantClient,
+        *,
+        asset_id: int,
+        part: int | None = None) -> int:
+    # 删掉暂存的chunk和只被它们引用的向量；给了part就只删这一段的序号区间
+    cond = [KBChunk.asset_id == int(asset_id), KBChunk.chunk_index < 0]
+    if part is not None:
+        cond += [KBChunk.chunk_index >= part_offset(part), KBChunk.chunk_index < part_offset(part) + PART_STRIDE]
+    async with session_maker() as db:
+        async with db.begin():
+            refs = {r for r in (await db.execute(delete(KBChunk).where(*cond).returning(KBChunk.embedding_ref))).scalars() if r}
+            if refs:  # 向量按(资产, 内容hash)寻址，正式chunk里还有同内容的就不能删
+                kept = (await db.execute(select(KBChunk.embedding_ref).where(KBChunk.asset_id == int(asset_id), KBChunk.embedding_ref.in_(refs)))).scalars()
+                refs -= set(kept)
+    return await delete_points(qdrant, sorted(refs))
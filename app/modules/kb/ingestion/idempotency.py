@@ -0,0 +1,120 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import logging
+import os
+import socket
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+from app.core.config import settings
+from app.modules.kb.ingestion.steps.text_cache import EXTRACT_FORMAT_VERSION
+
+logger = logging.getLogger(__name__)
+
+IDEM_REDIS_KEY_PREFIX = "kb:ingest:idem"
+
+CLAIM_OK = "claimed"
+CLAIM_DONE = "done"  # 同一份内容在当前pipeline版本下已经处理完
+CLAIM_BUSY = "busy"  # 另一个worker正在处理同一份内容，租约还没过期
+
+# 值是持有者（主机名:pid:task id）或者done，key的过期时间就是租约。持有者处理期间定期续租；
+# 只有租约过期（持有者挂了）或者持有者就是自己时才能重新认领。acks_late下心跳丢失导致的重投
+# 会落到另一个进程上，这时第一个worker还在续租，重投的消息拿到的是busy，不会并发再跑一遍
+_CLAIM_LUA = """
+local cur = redis.call('GET', KEYS[1])
+if cur == 'done' then
+  return 0
+end
+if cur and cur ~= ARGV[1] then
+  return -1
+end
+redis.call('SET', KEYS[1], ARGV[1], 'EX', tonumber(ARGV[2]))
+return 1
+"""
+
+_RENEW_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+  return redis.call('EXPIRE', KEYS[1], tonumber(ARGV[2]))
+end
+return 0
+"""
+
+_RELEASE_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+  return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+def pipeline_version() -> str:
+    # 手动版本号之外，文本抽取格式、切块参数、向量模型任一变化都会得到新的key
+    raw = "|".join((
+        str(settings.kb_ingest_pipeline_version),
+        str(EXTRACT_FORMAT_VERSION),
+        str(settings.kb_chunk_encoding),
+        str(settings.kb_chunk_max_tokens),
+        str(settings.kb_chunk_overlap_tokens),
+        str(settings.kb_embed_model),
+    ))
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:12]
+
+
+def idem_key(*, asset_id: int, sha256: str) -> str:
+    return f"{IDEM_REDIS_KEY_PREFIX}:{int(asset_id)}:{sha256}:{pipeline_version()}"
+
+
+def owner_id(token: str) -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{token}"
+
+
+async def claim(redis: Redis, *, key: str, owner: str) -> str:
+    try:
+        r = int(await redis.eval(_CLAIM_LUA, 1, key, str(owner), int(settings.kb_ingest_idem_lease_seconds)))
+    except RedisError:
+        # 和槽位一样，redis不可用时放行：重复处理只是浪费，结果本身是幂等的
+        logger.warning("kb_ingest_idem_claim_failed", exc_info=True, extra={"key": key})
+        return CLAIM_OK
+    return {1: CLAIM_OK, 0: CLAIM_DONE}.get(r, CLAIM_BUSY)
+
+
+async def _heartbeat(redis: Redis, *, key: str, owner: str) -> None:
+    lease = int(settings.kb_ingest_idem_lease_seconds)
+    while True:
+        await asyncio.sleep(max(1.0, lease / 3.0))
+        try:
+            await redis.eval(_RENEW_LUA, 1, key, str(owner), lease)
+        except RedisError:
+            logger.warning("kb_ingest_idem_renew_failed", exc_info=True, extra={"key": key})
+
+
+@asynccontextmanager
+async def renewing(redis: Redis | None, *, key: str | None, owner: str) -> AsyncIterator[None]:
+    # 处理期间续租，租约只需要覆盖worker失联后的回收时间，不用覆盖整个入库耗时
+    if redis is None or key is None:
+        yield
+        return
+    hb = asyncio.create_task(_heartbeat(redis, key=key, owner=owner))
+    try:
+        yield
+    finally:
+        hb.cancel()
+
+
+async def complete(redis: Redis, *, key: str) -> None:
+    try:
+        await redis.set(key, "done", ex=int(settings.kb_ingest_idem_done_ttl_seconds))
+    except RedisError:
+        logger.warning("kb_ingest_idem_complete_failed", exc_info=True, extra={"key": key})
+
+
+async def release(redis: Redis, *, key: str, owner: str) -> None:
+    try:
+        await redis.eval(_RELEASE_LUA, 1, key, str(owner))
+    except RedisError:
+        logger.warning("kb_ingest_idem_release_failed", exc_info=True, extra={"key": key})
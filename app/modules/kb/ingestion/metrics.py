@@ -0,0 +1,182 @@
+from __future__ import annotations
+
+import logging
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Iterator
+
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+from app.infra.blob_storage.interface import DEFAULT_STREAM_CHUNK_SIZE, StorageBackend
+
+logger = logging.getLogger(__name__)
+
+METRICS_REDIS_KEY_PREFIX = "kb:ingest:metrics"
+
+STAGE_SNIFF = "sniff"
+STAGE_FETCH = "fetch"
+
+# 阶段耗时直方图的桶上限（毫秒），最后一个桶兜底
+WALL_MS_BUCKETS: tuple[float, ...] = (10, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000, 300000, 1800000)
+_INF = "+Inf"
+
+
+@dataclass
+class StageStat:
+    wall_s: float = 0.0
+    cpu_s: float = 0.0  # 进程CPU时间；批量并发时会混入同进程其它任务，进程池里的编码不计入
+    bytes: int = 0
+    chunks: int = 0
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "wall_ms": round(self.wall_s * 1000.0, 3),
+            "cpu_ms": round(self.cpu_s * 1000.0, 3),
+            "bytes": int(self.bytes),
+            "chunks": int(self.chunks),
+        }
+
+
+class IngestMetrics:
+    def __init__(self) -> None:
+        self.stages: dict[str, StageStat] = {}
+
+    def stage(self, name: str) -> StageStat:
+        st = self.stages.get(name)
+        if st is None:
+            st = self.stages[name] = StageStat()
+        return st
+
+    def add(self, name: str, *, wall_s: float, cpu_s: float) -> StageStat:
+        st = self.stage(name)
+        st.wall_s += max(0.0, wall_s)
+        st.cpu_s += max(0.0, cpu_s)
+        return st
+
+    @contextmanager
+    def measure(self, name: str) -> Iterator[StageStat]:
+        t0, c0 = time.perf_counter(), time.process_time()
+        try:
+            yield self.stage(name)
+        finally:
+            self.add(name, wall_s=time.perf_counter() - t0, cpu_s=time.process_time() - c0)
+
+    def exclude(self, outer: str, inner: str) -> None:
+        # 流水线里阶段是嵌套计时的，外层扣掉内层得到各自独占的部分
+        o, i = self.stage(outer), self.stage(inner)
+        o.wall_s = max(0.0, o.wall_s - i.wall_s)
+        o.cpu_s = max(0.0, o.cpu_s - i.cpu_s)
+
+    def as_dict(self) -> dict[str, Any]:
+        return {name: st.as_dict() for name, st in self.stages.items()}
+
+
+class MeteredStorage:  # 包一层存储后端，把等待读取的时间和字节数记到fetch阶段上
+    def __init__(self, inner: StorageBackend, metrics: IngestMetrics) -> None:
+        self._inner = inner
+        self._metrics = metrics
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._inner, name)
+
+    async def get_range(self, *, key: str, start: int, length: int) -> bytes:
+        with self._metrics.measure(STAGE_FETCH) as st:
+            data = await self._inner.get_range(key=key, start=start, length=length)
+            st.bytes += len(data)
+        return data
+
+    async def get_bytes(self, *, key: str) -> bytes:
+        with self._metrics.measure(STAGE_FETCH) as st:
+            data = await self._inner.get_bytes(key=key)
+            st.bytes += len(data)
+        return data
+
+    async def open_stream(self, *, key: str, chunk_size: int = DEFAULT_STREAM_CHUNK_SIZE) -> AsyncIterator[bytes]:
+        it = self._inner.open_stream(key=key, chunk_size=chunk_size).__aiter__()
+        while True:
+            with self._metrics.measure(STAGE_FETCH) as st:
+                try:
+                    part = await it.__anext__()
+                except StopAsyncIteration:
+                    return
+                st.bytes += len(part)
+            yield part
+
+
+def _bucket(wall_ms: float) -> str:
+    for le in WALL_MS_BUCKETS:
+        if wall_ms <= le:
+            return str(int(le))
+    return _INF
+
+
+def _key(stage: str, kind: str) -> str:
+    return f"{METRICS_REDIS_KEY_PREFIX}:{stage}:{kind}"
+
+
+async def record_histograms(redis: Redis | None, *, kind: str | None, metrics: IngestMetrics) -> None:
+    # 所有worker累加到同一组hash里：每个桶一个计数，外加各项总和，查询时再算分位数
+    if redis is None or not metrics.stages:
+        return
+    k = (kind or "unknown").replace(":", "_")
+    try:
+        async with redis.pipeline(transaction=False) as pipe:
+            for name, st in metrics.stages.items():
+                d = st.as_dict()
+                key = _key(name, k)
+                pipe.hincrby(key, f"b:{_bucket(d['wall_ms'])}", 1)
+                pipe.hincrby(key, "count", 1)
+                pipe.hincrbyfloat(key, "wall_ms_sum", d["wall_ms"])
+                pipe.hincrbyfloat(key, "cpu_ms_sum", d["cpu_ms"])
+                pipe.hincrby(key, "bytes_sum", d["bytes"])
+                pipe.hincrby(key, "chunks_sum", d["chunks"])
+            await pipe.execute()
+    except RedisError:
+        logger.warning("kb_ingest_metrics_record_failed", exc_info=True)
+
+
+def _quantile(buckets: list[dict[str, Any]], total: int, q: float) -> float | None:
+    # 直方图只能给出分位数所在桶的上限
+    if total <= 0:
+        return None
+    rank = q * total
+    for b in buckets:
+        if b["count"] >= rank:
+            return None if b["le"] == _INF else float(b["le"])
+    return None
+
+
+def _s(v: Any) -> str:
+    return v.decode() if isinstance(v, bytes) else str(v)
+
+
+async def read_histograms(redis: Redis) -> list[dict[str, Any]]:
+    out: list[dict[str, Any]] = []
+    async for raw_key in redis.scan_iter(match=f"{METRICS_REDIS_KEY_PREFIX}:*", count=500):
+        key = _s(raw_key)
+        stage, kind = key[len(METRICS_REDIS_KEY_PREFIX) + 1:].split(":", 1)
+        h = {_s(f): _s(v) for f, v in (await redis.hgetall(key)).items()}
+        total = int(h.get("count") or 0)
+        cum = 0
+        buckets: list[dict[str, Any]] = []
+        for le in [str(int(x)) for x in WALL_MS_BUCKETS] + [_INF]:
+            cum += int(h.get(f"b:{le}") or 0)
+            buckets.append({"le": le, "count": cum})  # 累计计数，和Prometheus的histogram一致
+        wall_sum = float(h.get("wall_ms_sum") or 0.0)
+        bytes_sum = int(h.get("bytes_sum") or 0)
+        out.append({
+            "stage": stage,
+            "kind": kind,
+            "count": total,
+            "wall_ms_sum": wall_sum,
+            "cpu_ms_sum": float(h.get("cpu_ms_sum") or 0.0),
+            "bytes_sum": bytes_sum,
+            "chunks_sum": int(h.get("chunks_sum") or 0),
+            "bytes_per_s": round(bytes_sum / (wall_sum / 1000.0), 3) if wall_sum > 0 else None,
+            "p50_ms": _quantile(buckets, total, 0.5),
+            "p95_ms": _quantile(buckets, total, 0.95),
+            "buckets": buckets,
+        })
+    return sorted(out, key=lambda r: (r["stage"], r["kind"]))
@@ -0,0 +1,149 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import Any
+
+from sqlalchemy import DateTime, Integer, and_, cast, func, insert, literal, null, or_, select, update
+from sqlalchemy.dialects.postgresql import INTERVAL, JSONB
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from app.core.config import settings
+from app.modules.kb.consts import (
+    INDEX_JOB_STATUS_FAILED,
+    INDEX_JOB_STATUS_QUEUED,
+    INDEX_JOB_STATUS_RUNNING,
+)
+from app.modules.kb.ingestion.checkpoint import source_fingerprint
+from app.modules.kb.ingestion.utils import json_merge
+from app.modules.kb.models import KBAsset, KBIndexJob
+
+PG_QUEUE_CHANNEL = "kb_ingest"
+
+# 调度信息放在job的meta里：run_after是最早可以被认领的时间，lease_until是认领方的租约。
+# 只有这个后端认领的job才有lease_until，celery跑着的job不会被当成过期租约抢走。
+_meta = cast(KBIndexJob.meta, JSONB)
+
+
+@dataclass(frozen=True)
+class ClaimedJob:
+    job_id: int
+    asset_id: int
+    workspace_id: int
+    retries: int
+
+
+def _ts(key: str) -> Any:
+    return _meta[key].astext.cast(DateTime(timezone=True))
+
+
+def _after(seconds: float) -> Any:
+    return func.now() + literal(timedelta(seconds=float(seconds)), INTERVAL)
+
+
+async def enqueue(db: AsyncSession, asset: KBAsset) -> int:
+    # 写在调用方的事务里：资产和job一起提交，不会出现任务先到、数据还没提交的情况
+    fp = source_fingerprint(asset)
+    latest = (
+        select(KBIndexJob.id)
+        .where(KBIndexJob.asset_id == int(asset.id))
+        .order_by(KBIndexJob.id.desc())
+        .limit(1)
+        .scalar_subquery()
+    )
+    # 同一份源文件排着队或失败了的job直接复用：重复入队合并成一个，失败的断点也留着
+    job_id = (
+        await db.execute(
+            update(KBIndexJob)
+            .where(
+                KBIndexJob.id == latest,
+                KBIndexJob.status.in_([INDEX_JOB_STATUS_QUEUED, INDEX_JOB_STATUS_FAILED]),
+                _meta["source"] == literal(fp, JSONB),
+            )
+            .values(status=INDEX_JOB_STATUS_QUEUED, error=None, finished_at=None, meta=json_merge(KBIndexJob.meta, {"retries": 0, "run_after": None}))
+            .returning(KBIndexJob.id),
+            execution_options={"synchronize_session": False},
+        )
+    ).scalar_one_or_none()
+    if job_id is None:
+        job_id = (
+            await db.execute(
+                insert(KBIndexJob)
+                .values(asset_id=int(asset.id), status=INDEX_JOB_STATUS_QUEUED, meta={"source": fp, "attempt": 0, "retries": 0})
+                .returning(KBIndexJob.id)
+            )
+        ).scalar_one()
+    await db.execute(select(func.pg_notify(PG_QUEUE_CHANNEL, str(int(job_id)))))  # 提交时才真正发出去
+    return int(job_id)
+
+
+async def claim(session_maker: async_sessionmaker[AsyncSession], *, limit: int) -> list[ClaimedJob]:
+    # 一条语句认领一批：被别的worker锁住的行直接跳过，多个进程同时取互不阻塞
+    picked = (
+        select(KBIndexJob.id)
+        .where(or_(
+            and_(KBIndexJob.status == INDEX_JOB_STATUS_QUEUED, func.coalesce(_ts("run_after"), func.now()) <= func.now()),
+            and_(KBIndexJob.status == INDEX_JOB_STATUS_RUNNING, _ts("lease_until") < func.now()),
+        ))
+        .order_by(KBIndexJob.created_at)
+        .limit(max(1, int(limit)))
+        .with_for_update(skip_locked=True)
+    )
+    stmt = (
+        update(KBIndexJob)
+        .where(KBIndexJob.id.in_(picked), KBAsset.id == KBIndexJob.asset_id)
+        .values(
+            status=INDEX_JOB_STATUS_RUNNING,
+            started_at=func.now(),
+            meta=json_merge(KBIndexJob.meta, func.jsonb_build_object("lease_until", _after(settings.kb_pg_queue_lease_seconds))),
+        )
+        .returning(
+            KBIndexJob.id,
+            KBIndexJob.asset_id,
+            KBAsset.workspace_id,
+            func.coalesce(_meta["retries"].astext.cast(Integer), 0).label("retries"),
+        )
+    )
+    async with session_maker() as db:
+        async with db.begin():
+            rows = (await db.execute(stmt, execution_options={"synchronize_session": False})).all()
+    return [ClaimedJob(job_id=int(r.id), asset_id=int(r.asset_id), workspace_id=int(r.workspace_id), retries=int(r.retries)) for r in rows]
+
+
+async def extend_leases(session_maker: async_sessionmaker[AsyncSession], *, job_ids: list[int]) -> None:
+    if not job_ids:
+        return
+    async with session_maker() as db:
+        async with db.begin():
+            await db.execute(
+                update(KBIndexJob.__table__)
+                .where(KBIndexJob.id.in_([int(x) for x in job_ids]), KBIndexJob.status == INDEX_JOB_STATUS_RUNNING)
+                .values(meta=json_merge(KBIndexJob.meta, func.jsonb_build_object("lease_until", _after(settings.kb_pg_queue_lease_seconds))))
+            )
+
+
+async def requeue(session_maker: async_sessionmaker[AsyncSession], *, job_id: int, delay_seconds: float, retry: bool) -> None:
+    # retry=True是临时错误的重试，计入次数；槽位满了推迟的不计
+    retries = func.coalesce(_meta["retries"].astext.cast(Integer), 0) + (1 if retry else 0)
+    async with session_maker() as db:
+        async with db.begin():
+            await db.execute(
+                update(KBIndexJob.__table__)
+                .where(KBIndexJob.id == int(job_id), KBIndexJob.status.in_([INDEX_JOB_STATUS_RUNNING, INDEX_JOB_STATUS_FAILED]))
+                .values(
+                    status=INDEX_JOB_STATUS_QUEUED,
+                    finished_at=None,
+                    meta=json_merge(KBIndexJob.meta, func.jsonb_build_object("retries", retries, "run_after", _after(delay_seconds), "lease_until", null())),
+                )
+            )
+
+
+async def close_stale(session_maker: async_sessionmaker[AsyncSession], *, job_id: int, error: str) -> None:
+    # pipeline正常会沿用认领到的这条job；资产已删除或者源文件又换了时它会另起一条，这里把认领的那条收尾
+    async with session_maker() as db:
+        async with db.begin():
+            await db.execute(
+                update(KBIndexJob.__table__)
+                .where(KBIndexJob.id == int(job_id), KBIndexJob.status == INDEX_JOB_STATUS_RUNNING)
+                .values(status=INDEX_JOB_STATUS_FAILED, error=error, finished_at=func.now())
+            )
@@ -1,11 +1,19 @@
 from __future__ import annotations
 
-from datetime import datetime, timezone
-from typing import Any
+import asyncio
+import logging
+import time
+from typing import Any, AsyncIterator, Callable
 
-from sqlalchemy import select
+from elasticsearch import AsyncElasticsearch
+from qdrant_client import AsyncQdrantClient
+from redis.asyncio import Redis
+from sqlalchemy import Integer, String, cast, exists, func, insert, literal, select, update
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
 
+from app.core.config import settings
+from app.infra.blob_storage.interface import StorageBackend
 from app.modules.kb.consts import (
     ASSET_STATUS_DELETED,
     ASSET_STATUS_FAILED,
@@ -15,69 +23,650 @@ from app.modules.kb.consts import (
     INDEX_JOB_STATUS_FAILED,
     INDEX_JOB_STATUS_RUNNING,
 )
+from app.modules.kb.ingestion.checkpoint import (
+    STAGE_CHUNK,
+    STAGE_DEDUP,
+    STAGE_EMBED,
+    STAGE_EXTRACT,
+    STAGE_INDEX,
+    JobCheckpoint,
+    source_fingerprint,
+)
+from app.modules.kb.ingestion import dead_letter
+from app.modules.kb.ingestion.fanout import STAGE_FANOUT, discard_staged, merge_parts, plan_fanout
+from app.modules.kb.ingestion.idempotency import CLAIM_BUSY, CLAIM_OK, claim, complete, idem_key, owner_id, release, renewing
+from app.modules.kb.ingestion.metrics import STAGE_FETCH, STAGE_SNIFF, IngestMetrics, MeteredStorage, record_histograms
+from app.modules.kb.ingestion.steps.chunk import TokenChunker, write_chunks
+from app.modules.kb.ingestion.steps.dedup import clone_from_duplicate, find_ready_duplicate
+from app.modules.kb.ingestion.steps.embed import embed_chunks
+from app.modules.kb.ingestion.steps.extract import UNSUPPORTED_DOCUMENT_TYPE, ExtractedSection, UnsupportedDocumentError, extract_sections
+from app.modules.kb.ingestion.steps.index_es import index_chunks
+from app.modules.kb.ingestion.progress import EVENT_FAILED, EVENT_FANOUT, EVENT_READY, EVENT_STARTED, ProgressPublisher
+from app.modules.kb.ingestion.retry import TransientIngestError, is_transient
+from app.modules.kb.ingestion.slots import SlotLease, workspace_slot
+from app.modules.kb.ingestion.slots import release as release_slot
 from app.modules.kb.ingestion.steps.sniff import sniff
-from app.modules.kb.models import KBAsset, KBIndexJob
+from app.modules.kb.ingestion.steps.text_cache import EXTRACTED_TEXT_NAME, TextCacheWriter, open_cached_sections
+from app.modules.kb.ingestion.utils import json_merge
+from app.modules.kb.models import KBAsset, KBChunk, KBIndexJob
+from app.modules.kb.storage_keys import asset_derivative_key
+from app.modules.kb.vectors import delete_points
+
+logger = logging.getLogger(__name__)
+
+# (asset_id, job_id, mime_type, 页码区间列表)：由任务层把各段发出去，合并后回到finish_fanout
+FanoutDispatcher = Callable[[int, int, str | None, list[tuple[int, int]]], None]
+
+
+async def _extract_and_chunk(
+        *,
+        session_maker: async_sessionmaker[AsyncSession],
+        storage: StorageBackend,
+        asset: KBAsset,
+        mime_type: str | None,
+        cp: JobCheckpoint,
+        metrics: IngestMetrics) -> dict[str, Any]:
+    stats: dict[str, Any] = {"sections": 0, "chars": 0}
+    metered = MeteredStorage(storage, metrics)
+
+    async def _counted(it: AsyncIterator[ExtractedSection]) -> AsyncIterator[ExtractedSection]:
+        ait = it.__aiter__()
+        while True:
+            # 等下一段文本的时间算抽取（其中读存储的部分由MeteredStorage另记在fetch上）
+            t0, c0 = time.perf_counter(), time.process_time()
+            try:
+                sec = await ait.__anext__()
+            except StopAsyncIteration:
+                return
+            finally:
+                metrics.add(STAGE_EXTRACT, wall_s=time.perf_counter() - t0, cpu_s=time.process_time() - c0)
+            stats["sections"] += 1
+            stats["chars"] += len(sec.text)
+            metrics.stage(STAGE_EXTRACT).bytes += len(sec.text.encode("utf-8"))
+            yield sec
 
+    async def _written(last: int, total: int) -> None:
+        await cp.save(STAGE_CHUNK, last=int(last))
 
-async def _set_asset_status(
-        db: AsyncSession,
+    # 之前抽取过同一份文件就直接读缓存的文本，跳过PDF/DOCX解析
+    text_key = asset_derivative_key(workspace_id=int(asset.workspace_id), asset_id=int(asset.id), name=EXTRACTED_TEXT_NAME)
+    writer: TextCacheWriter | None = None
+    sections = await open_cached_sections(metered, key=text_key, sha256=asset.sha256)
+    stats["text_cache"] = "hit" if sections is not None else "miss"
+    if sections is None:
+        # 抽取、切块、写库是一条流水线，整份文档的文本不会同时留在内存里
+        writer = TextCacheWriter(sha256=asset.sha256, mime_type=mime_type)
+        sections = writer.tee(extract_sections(storage=metered, key=str(asset.storage_key), mime_type=mime_type, filename=asset.filename))
+    try:
+        with metrics.measure(STAGE_CHUNK) as chunk_metrics:
+            chunk_stats = await write_chunks(
+                session_maker=session_maker,
+                asset_id=int(asset.id),
+                chunks=TokenChunker.from_settings().chunks(_counted(sections)),
+                resume_after=cp.resume_point(STAGE_CHUNK)[0],
+                on_batch=_written,
+            )
+        chunk_metrics.chunks = int(chunk_stats["chunks"])
+        chunk_metrics.bytes = metrics.stage(STAGE_EXTRACT).bytes
+        if writer is not None:  # 整份文档都抽取成功才落缓存
+            stats["text_cache_bytes"] = await writer.commit(storage, key=text_key)
+    finally:
+        if writer is not None:
+            writer.close()
+        metrics.exclude(STAGE_CHUNK, STAGE_EXTRACT)
+        metrics.exclude(STAGE_EXTRACT, STAGE_FETCH)
+    await cp.finish(STAGE_EXTRACT, stats)
+    await cp.finish(STAGE_CHUNK, chunk_stats)
+    return {"extract": stats, "chunk": chunk_stats}
+
+
+async def _embedding_refs(session_maker: async_sessionmaker[AsyncSession], *, asset_id: int) -> set[str]:
+    async with session_maker() as db:
+        async with db.begin():
+            rows = await db.execute(
+                select(KBChunk.embedding_ref)
+                .where(KBChunk.asset_id == int(asset_id), KBChunk.embedding_ref.is_not(None))
+                .distinct()
+            )
+            return {str(r) for r in rows.scalars()}
+
+
+async def _process_document(
         *,
+        session_maker: async_sessionmaker[AsyncSession],
+        storage: StorageBackend,
+        qdrant: AsyncQdrantClient,
+        es: AsyncElasticsearch,
+        redis: Redis | None,
         asset: KBAsset,
-        status: str,
-        meta_patch: dict[str, Any] | None = None) -> None:
-    m = dict(asset.meta or {})  # 文档自身的元数据先取出来
-    if meta_patch:  #
-        m.update(meta_patch)  # 用一个字典更新另一个字典中的值
-    asset.status = str(status)   # asset是一个对象
-    asset.meta = m or None
-    await db.flush()  # 将上一步已经更新的对象中的信息反馈到数据库表格中
-    # 所以此处实际上会执行一个update语句
+        mime_type: str | None,
+        cp: JobCheckpoint,
+        metrics: IngestMetrics,
+        fanout: FanoutDispatcher | None = None) -> dict[str, Any]:
+    out: dict[str, Any] = {}
+    # 上一版本的向量，用来算出需要删除的部分；续跑时chunk表可能已经被改写了一部分，所以第一次算出来就存进job
+    prev_refs = cp.meta.get("prev_refs")
+    if prev_refs is None:
+        prev_refs = sorted(await _embedding_refs(session_maker, asset_id=int(asset.id)))
+        await cp.put(prev_refs=prev_refs)
+    old_refs = set(prev_refs)
+
+    if cp.done(STAGE_DEDUP) or cp.done(STAGE_CHUNK):  # 续跑：前面的阶段已经完成，只取回统计信息
+        for name in (STAGE_DEDUP, STAGE_EXTRACT, STAGE_CHUNK):
+            if cp.done(name):
+                out[name] = cp.stats(name)
+    else:
+        src_id = await find_ready_duplicate(session_maker, asset=asset)
+        if src_id is not None:  # 同内容的文件已经处理过了，直接复制chunk和向量，跳过抽取和编码
+            with metrics.measure(STAGE_DEDUP) as m:
+                out[STAGE_DEDUP] = await clone_from_duplicate(session_maker=session_maker, qdrant=qdrant, src_asset_id=int(src_id), asset=asset)
+                m.chunks = int(out[STAGE_DEDUP]["chunks"])
+            await cp.finish(STAGE_DEDUP, out[STAGE_DEDUP])
+        elif cp.meta.get(STAGE_FANOUT):  # 已经拆分出去了（消息被重投），等合并任务接手
+            return {STAGE_FANOUT: cp.meta[STAGE_FANOUT]}
+        elif fanout is not None and (ranges := await plan_fanout(storage, asset=asset, mime_type=mime_type)):
+            # 大PDF按页拆成多段，抽取、切块、编码分给多个worker并行；合并后再从断点跑索引阶段。
+            # 先清掉以前失败的拆分留下的暂存行，合并时不会把它们当成这一轮的
+            await discard_staged(session_maker, qdrant, asset_id=int(asset.id))
+            fanout(int(asset.id), cp.job_id, mime_type, ranges)
+            plan = {"parts": len(ranges), "pages": ranges[-1][1]}
+            await cp.put(**{STAGE_FANOUT: plan})
+            if cp.publisher is not None:
+                await cp.publisher.publish(EVENT_FANOUT, **plan)
+            return {STAGE_FANOUT: plan}
+        else:
+            out.update(await _extract_and_chunk(
+                session_maker=session_maker,
+                storage=storage,
+                asset=asset,
+                mime_type=mime_type,
+                cp=cp,
+                metrics=metrics,
+            ))
+    chunks = int((out.get(STAGE_DEDUP) or out.get(STAGE_CHUNK) or {}).get("chunks") or 0)
+
+    if chunks > 0:
+        if cp.done(STAGE_EMBED):
+            out[STAGE_EMBED] = cp.stats(STAGE_EMBED)
+        else:
+            last, _ = cp.resume_point(STAGE_EMBED)
+            with metrics.measure(STAGE_EMBED) as m:
+                out[STAGE_EMBED] = await embed_chunks(
+                    session_maker=session_maker,
+                    qdrant=qdrant,
+                    redis=redis,
+                    asset=asset,
+                    start_after=last,
+                    on_batch=cp.progress_saver(STAGE_EMBED),
+                )
+                m.chunks = int(out[STAGE_EMBED]["embedded"])
+            out[STAGE_EMBED]["resumed_after"] = last
+            await cp.finish(STAGE_EMBED, out[STAGE_EMBED])
+
+    stale = old_refs - await _embedding_refs(session_maker, asset_id=int(asset.id)) if old_refs else set()
+    if chunks > 0 or stale:
+        if cp.done(STAGE_INDEX):
+            out[STAGE_INDEX] = cp.stats(STAGE_INDEX)
+        else:
+            last, _ = cp.resume_point(STAGE_INDEX)
+            with metrics.measure(STAGE_INDEX) as m:
+                out[STAGE_INDEX] = await index_chunks(
+                    session_maker=session_maker,
+                    es=es,
+                    asset=asset,
+                    stale_ids=stale,
+                    check_existing=bool(old_refs),
+                    start_after=last,
+                    on_progress=cp.progress_saver(STAGE_INDEX),
+                )
+                m.chunks = int(out[STAGE_INDEX]["indexed"])
+            out[STAGE_INDEX]["resumed_after"] = last
+            await cp.finish(STAGE_INDEX, out[STAGE_INDEX])
+    if old_refs:
+        out["reindex"] = {"previous_vectors": len(old_refs), "removed_vectors": await delete_points(qdrant, sorted(stale))}
+    return out
+
+
+async def _start_job(
+        session_maker: async_sessionmaker[AsyncSession],
+        *,
+        asset_id: int) -> tuple[KBAsset, JobCheckpoint] | None:
+    # 每个状态迁移都是一条带条件的UPDATE ... RETURNING，不先查再改
+    async with session_maker() as db:
+        async with db.begin():
+            asset = (
+                await db.execute(
+                    update(KBAsset)
+                    .where(
+                        KBAsset.id == int(asset_id),
+                        KBAsset.status != ASSET_STATUS_DELETED,
+                        KBAsset.storage_key.is_not(None),
+                    )
+                    .values(status=ASSET_STATUS_PROCESSING)
+                    .returning(KBAsset),
+                    execution_options={"synchronize_session": False},
+                )
+            ).scalar_one_or_none()
+            if asset is None:  # 被标记删除或者还没有上传完成
+                return None
+
+            # 同一份源文件上一次没跑完的job（worker被杀、失败后重试）直接沿用，从它的断点继续
+            fp = source_fingerprint(asset)
+            job_meta = cast(KBIndexJob.meta, JSONB)
+            latest = (
+                select(KBIndexJob.id)
+                .where(KBIndexJob.asset_id == int(asset.id))
+                .order_by(KBIndexJob.id.desc())
+                .limit(1)
+                .scalar_subquery()
+            )
+            attempt = func.coalesce(job_meta["attempt"].astext.cast(Integer), 1) + 1
+            row = (
+                await db.execute(
+                    update(KBIndexJob)
+                    .where(
+                        KBIndexJob.id == latest,
+                        KBIndexJob.status != INDEX_JOB_STATUS_DONE,
+                        job_meta["source"] == literal(fp, JSONB),
+                    )
+                    .values(
+                        status=INDEX_JOB_STATUS_RUNNING,
+                        error=None,
+                        finished_at=None,
+                        meta=json_merge(KBIndexJob.meta, func.jsonb_build_object("attempt", attempt)),
+                    )
+                    .returning(KBIndexJob.id, KBIndexJob.meta),
+                    execution_options={"synchronize_session": False},
+                )
+            ).one_or_none()
+            if row is None:
+                row = (
+                    await db.execute(
+                        insert(KBIndexJob)
+                        .values(
+                            asset_id=int(asset.id),
+                            status=INDEX_JOB_STATUS_RUNNING,
+                            started_at=func.now(),
+                            meta={"source": fp, "attempt": 1},
+                        )
+                        .returning(KBIndexJob.id, KBIndexJob.meta)
+                    )
+                ).one()
+    return asset, JobCheckpoint(session_maker, job_id=int(row.id), meta=row.meta)
+
+
+async def _mark_ready(
+        session_maker: async_sessionmaker[AsyncSession],
+        *,
+        asset_id: int,
+        job_id: int,
+        mime_type: str | None,
+        source_type: str | None,
+        meta_patch: dict[str, Any] | None,
+        job_meta_patch: dict[str, Any] | None = None) -> bool:
+    values: dict[str, Any] = {
+        "status": ASSET_STATUS_READY,
+        "mime_type": func.coalesce(literal(mime_type, String), KBAsset.mime_type),
+        "source_type": func.coalesce(literal(source_type, String), KBAsset.source_type),
+    }
+    if meta_patch:
+        values["meta"] = json_merge(KBAsset.meta, meta_patch)
+    # 资产和job在同一条语句里更新：资产已经被删除时job也保持原状
+    done_asset = (
+        update(KBAsset.__table__)
+        .where(KBAsset.id == int(asset_id), KBAsset.status != ASSET_STATUS_DELETED)
+        .values(**values)
+        .returning(KBAsset.id)
+        .cte("done_asset")
+    )
+    job_values: dict[str, Any] = {"status": INDEX_JOB_STATUS_DONE, "finished_at": func.now()}
+    if job_meta_patch:
+        job_values["meta"] = json_merge(KBIndexJob.meta, job_meta_patch)
+    stmt = (
+        update(KBIndexJob.__table__)
+        .where(KBIndexJob.id == int(job_id), exists(select(done_asset.c.id)))
+        .values(**job_values)
+    )
+    async with session_maker() as db:
+        async with db.begin():
+            return bool((await db.execute(stmt)).rowcount)
+
+
+async def _mark_failed(
+        session_maker: async_sessionmaker[AsyncSession],
+        *,
+        asset_id: int,
+        job_id: int,
+        error: str,
+        job_meta_patch: dict[str, Any] | None = None,
+        final: bool = True) -> None:
+    # job的meta里的断点保留着，重试时从这里继续
+    job_values: dict[str, Any] = {"status": INDEX_JOB_STATUS_FAILED, "error": error, "finished_at": func.now()}
+    if job_meta_patch:
+        job_values["meta"] = json_merge(KBIndexJob.meta, job_meta_patch)
+    stmt = update(KBIndexJob.__table__).where(KBIndexJob.id == int(job_id)).values(**job_values)
+    if final:  # 还会自动重试时资产保持processing，只有最终失败才对用户可见
+        stmt = stmt.add_cte(
+            update(KBAsset.__table__)
+            .where(KBAsset.id == int(asset_id), KBAsset.status != ASSET_STATUS_DELETED)
+            .values(status=ASSET_STATUS_FAILED, meta=json_merge(KBAsset.meta, {"error": error}))
+            .cte("failed_asset")
+        )
+    async with session_maker() as db:
+        async with db.begin():
+            await db.execute(stmt)
 
 
 async def run_ingestion(
     *,
     session_maker: async_sessionmaker[AsyncSession],
+    storage: StorageBackend,
+    qdrant: AsyncQdrantClient,
+    es: AsyncElasticsearch,
+    redis: Redis | None,
     asset_id: int,
-) -> None:
-    job: KBIndexJob | None = None
-    async with session_maker() as db:
-        asset = (await db.execute(select(KBAsset).where(KBAsset.id == int(asset_id)))).scalar_one_or_none()
-        if not asset or asset.status == ASSET_STATUS_DELETED:
-            return
-        if not asset.storage_key:
-            return
-        # 上面一段是按照asset_id将这个对象查出来，如果这个文档被标记为删除或者storage_key是none都结束
-
-        async with db.begin():  # 创建一个文档ingest的任务（所谓的创建任务就是向KBIndexJob表中插入一行数据）
-            job = KBIndexJob(asset_id=int(asset.id), status=INDEX_JOB_STATUS_RUNNING, started_at=datetime.now(timezone.utc))
-            db.add(job)
-            await _set_asset_status(db, asset=asset, status=ASSET_STATUS_PROCESSING)
+    final_attempt: bool = True,
+    fanout: FanoutDispatcher | None = None,
+    lease: SlotLease | None = None,
+) -> bool:
+    started = await _start_job(session_maker, asset_id=int(asset_id))
+    if started is None:
+        return False
+    asset, cp = started
+    metrics = IngestMetrics()  # 只统计本次尝试，断点续跑时跳过的阶段不计入
+    progress = ProgressPublisher(redis, workspace_id=int(asset.workspace_id), asset_id=int(asset.id), job_id=cp.job_id)
+    cp.publisher = progress
+    await progress.publish(EVENT_STARTED, attempt=int(cp.meta.get("attempt") or 1), resumed=cp.resumed)
 
     try:
-        sr = await sniff(filename=asset.filename, mime_type_hint=asset.mime_type)
-        async with session_maker() as db:
-            asset2 = (await db.execute(select(KBAsset).where(KBAsset.id == int(asset_id)))).scalar_one_or_none()
-            if not asset2 or asset2.status == ASSET_STATUS_DELETED:
-                return
-            async with db.begin():
-                asset2.mime_type = sr.mime_type or asset2.mime_type
-                asset2.source_type = sr.source_type or asset2.source_type
-                await _set_asset_status(db, asset=asset2, status=ASSET_STATUS_READY, meta_patch=sr.meta or None)
-                job2 = (await db.execute(select(KBIndexJob).where(KBIndexJob.id == int(job.id)))).scalar_one_or_none()
-                if job2:
-                    job2.status = INDEX_JOB_STATUS_DONE
-                    job2.finished_at = datetime.now(timezone.utc)
-                    await db.flush()
+        with metrics.measure(STAGE_SNIFF):
+            sr = await sniff(filename=asset.filename, mime_type_hint=asset.mime_type, storage=storage, key=str(asset.storage_key))
+        meta_patch: dict[str, Any] = dict(sr.meta or {})
+        if sr.source_type is None:  # 处理不了的类型按失败处理，不能0个chunk就标成ready
+            raise UnsupportedDocumentError(UNSUPPORTED_DOCUMENT_TYPE)
+        if sr.source_type == "document":  # 音视频和图片暂时没有抽取阶段
+            doc = await _process_document(
+                session_maker=session_maker,
+                storage=storage,
+                qdrant=qdrant,
+                es=es,
+                redis=redis,
+                asset=asset,
+                mime_type=sr.mime_type,
+                cp=cp,
+                metrics=metrics,
+                fanout=fanout,
+            )
+            if STAGE_FANOUT in doc:  # 资产和job保持processing/running，由合并任务收尾
+                if lease is not None:  # workspace槽位跟着各段走，合并或失败时才释放
+                    lease.hand_off()
+                return False
+            meta_patch.update(doc)
+        ready = await _mark_ready(
+            session_maker,
+            asset_id=int(asset_id),
+            job_id=cp.job_id,
+            mime_type=sr.mime_type,
+            source_type=sr.source_type,
+            meta_patch=meta_patch or None,
+            job_meta_patch={"metrics": metrics.as_dict()},
+        )
     except Exception as e:
+        transient = is_transient(e)
+        retrying = transient and not final_attempt
+        await _mark_failed(
+            session_maker,
+            asset_id=int(asset_id),
+            job_id=cp.job_id,
+            error=str(e),
+            job_meta_patch={"metrics": metrics.as_dict()},
+            final=not retrying,
+        )
+        await progress.publish(EVENT_FAILED, error=str(e), retrying=retrying)
+        if retrying:
+            logger.warning("kb_ingest_transient_failure", exc_info=True, extra={"asset_id": int(asset_id), "job_id": cp.job_id})
+            raise TransientIngestError(f"asset {int(asset_id)}: {type(e).__name__}: {e}") from e
+        await dead_letter.push(
+            redis,
+            asset_id=int(asset_id),
+            job_id=cp.job_id,
+            attempt=int(cp.meta.get("attempt") or 1),
+            error=str(e),
+            error_type=type(e).__name__,
+            transient=transient,
+        )
+        return False
+    if ready:
+        await progress.publish(EVENT_READY, mime_type=sr.mime_type, source_type=sr.source_type)
+    await record_histograms(redis, kind=sr.mime_type or sr.source_type, metrics=metrics)
+    await dead_letter.clear(redis, asset_id=int(asset_id))
+    return ready
+
+
+async def run_ingestion_fair(
+    *,
+    session_maker: async_sessionmaker[AsyncSession],
+    storage: StorageBackend,
+    qdrant: AsyncQdrantClient,
+    es: AsyncElasticsearch,
+    redis: Redis | None,
+    asset_id: int,
+    workspace_id: int | None = None,
+    sha256: str | None = None,
+    token: str | None = None,
+    final_attempt: bool = True,
+    fanout: FanoutDispatcher | None = None,
+) -> bool:
+    # 拿不到workspace的槽位就返回False，由调用方推迟重投，而不是占着worker等待
+    if workspace_id is None or (token and sha256 is None):
         async with session_maker() as db:
-            asset3 = (await db.execute(select(KBAsset).where(KBAsset.id == int(asset_id)))).scalar_one_or_none()
             async with db.begin():
-                if asset3 and asset3.status != ASSET_STATUS_DELETED:
-                    await _set_asset_status(db, asset=asset3, status=ASSET_STATUS_FAILED, meta_patch={"error": str(e)})
-                if job is not None:
-                    job3 = (await db.execute(select(KBIndexJob).where(KBIndexJob.id == int(job.id)))).scalar_one_or_none()
-                    if job3:
-                        job3.status = INDEX_JOB_STATUS_FAILED
-                        job3.error = str(e)
-                        job3.finished_at = datetime.now(timezone.utc)
-                        await db.flush()
+                row = (
+                    await db.execute(select(KBAsset.workspace_id, KBAsset.sha256).where(KBAsset.id == int(asset_id)))
+                ).one_or_none()
+        if row is None:
+            return True
+        workspace_id, sha256 = row.workspace_id, row.sha256
+
+    # 同一份内容在同一pipeline版本下只处理一次，RabbitMQ重复投递的消息直接跳过
+    key = idem_key(asset_id=int(asset_id), sha256=sha256) if redis is not None and token and sha256 else None
+    owner = owner_id(str(token))
+    if redis is not None and key is not None:
+        state = await claim(redis, key=key, owner=owner)
+        if state == CLAIM_BUSY:  # 另一个worker正在跑；推迟重投，持有者挂了的话等租约过期后再认领
+            logger.info("kb_ingest_duplicate_busy", extra={"asset_id": int(asset_id)})
+            return False
+        if state != CLAIM_OK:
+            logger.info("kb_ingest_duplicate_skipped", extra={"asset_id": int(asset_id), "state": state})
+            return True
+    ready = False
+    try:
+        async with renewing(redis, key=key, owner=owner):
+            async with workspace_slot(redis, workspace_id=int(workspace_id), member=str(int(asset_id))) as lease:
+                if not lease.acquired:
+                    return False
+                ready = await run_ingestion(
+                    session_maker=session_maker,
+                    storage=storage,
+                    qdrant=qdrant,
+                    es=es,
+                    redis=redis,
+                    asset_id=int(asset_id),
+                    final_attempt=final_attempt,
+                    fanout=fanout,
+                    lease=lease,
+                )
+    finally:
+        if redis is not None and key is not None:
+            if ready:
+                await complete(redis, key=key)
+            else:  # 失败或推迟的都放开，后续的重试和重投还要能认领
+                await release(redis, key=key, owner=owner)
+    return True
+
+
+async def run_ingestion_batch(
+    *,
+    session_maker: async_sessionmaker[AsyncSession],
+    storage: StorageBackend,
+    qdrant: AsyncQdrantClient,
+    es: AsyncElasticsearch,
+    redis: Redis | None,
+    asset_ids: list[int],
+    concurrency: int | None = None,
+    token: str | None = None,
+    final_attempt: bool = True,
+    fanout: FanoutDispatcher | None = None,
+) -> dict[str, Any]:
+    # 一批资产共用同一组连接，同时在跑的数量有上限，避免把db连接池占满
+    sem = asyncio.Semaphore(max(1, int(concurrency or settings.kb_ingest_batch_concurrency)))
+    ids = list(dict.fromkeys(int(x) for x in asset_ids))
+    async with session_maker() as db:
+        async with db.begin():
+            rows = {
+                int(r.id): r
+                for r in await db.execute(select(KBAsset.id, KBAsset.workspace_id, KBAsset.sha256).where(KBAsset.id.in_(ids)))
+            }
+
+    async def _one(asset_id: int) -> bool:
+        if asset_id not in rows:
+            return True
+        async with sem:
+            return await run_ingestion_fair(
+                session_maker=session_maker,
+                storage=storage,
+                qdrant=qdrant,
+                es=es,
+                redis=redis,
+                asset_id=asset_id,
+                workspace_id=int(rows[asset_id].workspace_id),
+                sha256=rows[asset_id].sha256,
+                token=token,
+                final_attempt=final_attempt,
+                fanout=fanout,
+            )
+
+    results = await asyncio.gather(*(_one(x) for x in ids), return_exceptions=True)
+    failed: list[int] = []
+    deferred: list[int] = []
+    retry: list[int] = []
+    for asset_id, r in zip(ids, results):
+        if isinstance(r, Exception) and is_transient(r):
+            retry.append(asset_id)
+        elif isinstance(r, BaseException):  # 单个资产的异常不影响同批次的其它资产
+            logger.error("kb_ingest_batch_item_failed", exc_info=r, extra={"asset_id": asset_id})
+            failed.append(asset_id)
+        elif r is False:
+            deferred.append(asset_id)
+    return {"count": len(ids), "failed": failed, "deferred": deferred, "retry": retry}
+
+
+async def finish_fanout(
+    *,
+    session_maker: async_sessionmaker[AsyncSession],
+    storage: StorageBackend,
+    qdrant: AsyncQdrantClient,
+    es: AsyncElasticsearch,
+    redis: Redis | None,
+    asset_id: int,
+    job_id: int,
+    parts: list[dict[str, Any]],
+    final_attempt: bool = True,
+) -> bool:
+    async with session_maker() as db:
+        async with db.begin():
+            ws = (await db.execute(select(KBAsset.workspace_id).where(KBAsset.id == int(asset_id)))).scalar_one_or_none()
+    try:
+        return await _finish_fanout(
+            session_maker=session_maker,
+            storage=storage,
+            qdrant=qdrant,
+            es=es,
+            redis=redis,
+            asset_id=int(asset_id),
+            job_id=int(job_id),
+            parts=parts,
+            final_attempt=final_attempt,
+        )
+    finally:
+        if redis is not None and ws is not None:  # 拆分时交出来的workspace槽位到这里才释放
+            await release_slot(redis, workspace_id=int(ws), member=str(int(asset_id)))
+
+
+async def _finish_fanout(
+    *,
+    session_maker: async_sessionmaker[AsyncSession],
+    storage: StorageBackend,
+    qdrant: AsyncQdrantClient,
+    es: AsyncElasticsearch,
+    redis: Redis | None,
+    asset_id: int,
+    job_id: int,
+    parts: list[dict[str, Any]],
+    final_attempt: bool,
+) -> bool:
+    if any(p.get("skipped") for p in parts):  # 处理期间资产被删除或重新上传，这一轮的暂存结果作废
+        await discard_staged(session_maker, qdrant, asset_id=int(asset_id))
+        return False
+    chunks = await merge_parts(session_maker, asset_id=int(asset_id))
+    async with session_maker() as db:
+        async with db.begin():
+            meta = (await db.execute(select(KBIndexJob.meta).where(KBIndexJob.id == int(job_id)))).scalar_one_or_none()
+    cp = JobCheckpoint(session_maker, job_id=int(job_id), meta=meta)
+    await cp.finish_many({
+        STAGE_EXTRACT: {
+            "sections": sum(int(p["sections"]) for p in parts),
+            "chars": sum(int(p["chars"]) for p in parts),
+            "parts": len(parts),
+        },
+        STAGE_CHUNK: {
+            "chunks": chunks,
+            "tokens": sum(int(p["tokens"]) for p in parts),
+            "reused": sum(int(p["reused"]) for p in parts),
+        },
+        STAGE_EMBED: {"embedded": sum(int(p["embedded"]) for p in parts), "model": str(settings.kb_embed_model)},
+    })
+    # 前面的阶段都标记完成了，再走一遍常规流程就是从断点续跑：只剩ES索引、清理旧向量和状态收尾
+    return await run_ingestion(
+        session_maker=session_maker,
+        storage=storage,
+        qdrant=qdrant,
+        es=es,
+        redis=redis,
+        asset_id=int(asset_id),
+        final_attempt=final_attempt,
+    )
+
+
+async def fail_fanout(
+    *,
+    session_maker: async_sessionmaker[AsyncSession],
+    qdrant: AsyncQdrantClient,
+    redis: Redis | None,
+    asset_id: int,
+    job_id: int,
+    error: str,
+    error_type: str,
+    transient: bool,
+) -> None:
+    # 某一段最终失败：整份文档算失败，重新入队时会重新拆分。
+    # 先清fanout标记再删暂存：还在跑的其它段写完后看到标记没了，会自己删掉这之后写进来的部分
+    await _mark_failed(session_maker, asset_id=int(asset_id), job_id=int(job_id), error=error, job_meta_patch={STAGE_FANOUT: None})
+    await discard_staged(session_maker, qdrant, asset_id=int(asset_id))
+    await dead_letter.push(
+        redis,
+        asset_id=int(asset_id),
+        job_id=int(job_id),
+        attempt=1,
+        error=error,
+        error_type=error_type,
+        transient=transient,
+    )
+    async with session_maker() as db:
+        async with db.begin():
+            ws = (await db.execute(select(KBAsset.workspace_id).where(KBAsset.id == int(asset_id)))).scalar_one_or_none()
+    if ws is not None:
+        if redis is not None:
+            await release_slot(redis, workspace_id=int(ws), member=str(int(asset_id)))
+        progress = ProgressPublisher(redis, workspace_id=int(ws), asset_id=int(asset_id), job_id=int(job_id))
+        await progress.publish(EVENT_FAILED, error=error, retrying=False)
@@ -0,0 +1,130 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import time
+from contextlib import asynccontextmanager, suppress
+from typing import Any, AsyncIterator, Awaitable, Callable
+
+from fastapi import Request
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+PROGRESS_CHANNEL_PREFIX = "kb:ingest:progress"
+
+EVENT_STARTED = "started"
+EVENT_STAGE = "stage"
+EVENT_FANOUT = "fanout"
+EVENT_PART = "part"
+EVENT_READY = "ready"
+EVENT_FAILED = "failed"
+
+
+def channel(workspace_id: int) -> str:
+    return f"{PROGRESS_CHANNEL_PREFIX}:{int(workspace_id)}"
+
+
+class ProgressPublisher:  # 一个job的进度发布器：pub/sub不落盘，发不出去只记日志，不影响入库本身
+    def __init__(self, redis: Redis | None, *, workspace_id: int, asset_id: int, job_id: int) -> None:
+        self.redis = redis
+        self.workspace_id = int(workspace_id)
+        self.asset_id = int(asset_id)
+        self.job_id = int(job_id)
+
+    async def publish(self, event: str, **fields: Any) -> None:
+        if self.redis is None:
+            return
+        payload = {"event": event, "asset_id": self.asset_id, "job_id": self.job_id, "ts": round(time.time(), 3), **fields}
+        try:
+            await self.redis.publish(channel(self.workspace_id), json.dumps(payload, ensure_ascii=False, default=str))
+        except RedisError:
+            logger.warning("kb_ingest_progress_publish_failed", exc_info=True, extra={"asset_id": self.asset_id})
+
+
+class ProgressHub:
+    # 每个API进程只开一条订阅连接（按前缀psubscribe），再按workspace分发给本进程里的SSE连接；
+    # 浏览器开得再多也不会一个连接占一个redis连接
+    def __init__(self, redis: Redis) -> None:
+        self.redis = redis
+        self._subs: dict[int, set[asyncio.Queue[bytes]]] = {}
+        self._task: asyncio.Task[None] | None = None
+
+    def _ensure_running(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def _dispatch(self, raw_channel: Any, data: bytes) -> None:
+        ch = raw_channel.decode() if isinstance(raw_channel, bytes) else str(raw_channel)
+        for q in self._subs.get(int(ch.rsplit(":", 1)[1]), ()):
+            if q.full():  # 慢的客户端丢最旧的事件，不能拖住其他连接
+                q.get_nowait()
+            q.put_nowait(data)
+
+    async def _run(self) -> None:
+        # 第一次有人订阅时启动，之后一直挂着直到进程退出，断线自动重连
+        while True:
+            pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.psubscribe(f"{PROGRESS_CHANNEL_PREFIX}:*")
+                while True:
+                    msg = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                    if msg is not None:
+                        self._dispatch(msg["channel"], msg["data"])
+            except RedisError:
+                logger.warning("kb_ingest_progress_subscribe_failed", exc_info=True)
+                await asyncio.sleep(1.0)
+            finally:
+                with suppress(RedisError):
+                    await pubsub.aclose()
+
+    @asynccontextmanager
+    async def subscribe(self, workspace_id: int) -> AsyncIterator[asyncio.Queue[bytes]]:
+        q: asyncio.Queue[bytes] = asyncio.Queue(maxsize=256)
+        self._subs.setdefault(int(workspace_id), set()).add(q)
+        self._ensure_running()
+        try:
+            yield q
+        finally:
+            subs = self._subs.get(int(workspace_id))
+            if subs is not None:
+                subs.discard(q)
+                if not subs:
+                    del self._subs[int(workspace_id)]
+
+    async def close(self) -> None:
+        self._subs.clear()
+        if self._task is not None:
+            self._task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._task
+
+
+def get_progress_hub(request: Request) -> ProgressHub:
+    return request.app.state.kb_progress
+
+
+async def sse_events(
+    hub: ProgressHub,
+    *,
+    workspace_id: int,
+    asset_id: int | None,
+    is_disconnected: Callable[[], Awaitable[bool]],
+) -> AsyncIterator[bytes]:
+    keepalive = float(settings.kb_progress_keepalive_seconds)
+    async with hub.subscribe(workspace_id) as q:
+        yield b"retry: 3000\n\n"
+        while not await is_disconnected():
+            try:
+                data = await asyncio.wait_for(q.get(), timeout=keepalive)
+            except asyncio.TimeoutError:
+                yield b": ping\n\n"  # 注释行保活，防止代理把空闲连接掐掉
+                continue
+            ev = json.loads(data)
+            if asset_id is not None and ev.get("asset_id") != int(asset_id):
+                continue
+            yield f"event: {ev.get('event')}\ndata: ".encode() + data + b"\n\n"
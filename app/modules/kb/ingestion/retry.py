@@ -0,0 +1,67 @@
+from __future__ import annotations
+
+import asyncio
+import random
+
+import elastic_transport
+import httpx
+from qdrant_client.http.exceptions import ResponseHandlingException, UnexpectedResponse
+from redis.exceptions import ConnectionError as RedisConnectionError
+from redis.exceptions import TimeoutError as RedisTimeoutError
+from sqlalchemy.exc import DBAPIError, InterfaceError, OperationalError
+
+from app.core.config import settings
+
+# 429和网关类错误说明对端暂时不可用，其余4xx重试也没用
+_RETRY_STATUS = {408, 429, 500, 502, 503, 504}
+
+
+class TransientIngestError(Exception):  # 本次尝试因为依赖服务抖动失败，job断点已保存，交给任务层重试
+    pass
+
+
+def _status(e: BaseException) -> int | None:
+    if isinstance(e, UnexpectedResponse):
+        return e.status_code
+    if isinstance(e, elastic_transport.ApiError):
+        return int(e.meta.status)
+    if isinstance(e, httpx.HTTPStatusError):
+        return e.response.status_code
+    return None
+
+
+def is_transient(e: BaseException) -> bool:
+    # 沿着__cause__/__context__往上找，steps里包装过的异常也能识别出来
+    seen: set[int] = set()
+    cur: BaseException | None = e
+    while cur is not None and id(cur) not in seen:
+        seen.add(id(cur))
+        if isinstance(cur, TransientIngestError):
+            return True
+        if isinstance(cur, DBAPIError) and cur.connection_invalidated:
+            return True
+        if isinstance(cur, (
+            OperationalError,
+            InterfaceError,
+            elastic_transport.ConnectionError,
+            elastic_transport.ConnectionTimeout,
+            ResponseHandlingException,
+            httpx.TransportError,
+            RedisConnectionError,
+            RedisTimeoutError,
+            asyncio.TimeoutError,
+            ConnectionError,
+            TimeoutError,
+        )):
+            return True
+        if _status(cur) in _RETRY_STATUS:
+            return True
+        cur = cur.__cause__ or cur.__context__
+    return False
+
+
+def backoff_seconds(retries: int) -> float:
+    # 指数退避加全抖动：同一时刻失败的一批任务会被打散，不会一起回来压垮刚恢复的服务
+    base = float(settings.kb_ingest_retry_base_seconds)
+    cap = float(settings.kb_ingest_retry_max_seconds)
+    return random.uniform(0.0, min(cap, base * (2 ** max(0, int(retries)))))
@@ -0,0 +1,140 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import random
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Any, AsyncIterator
+
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+SLOTS_REDIS_KEY_PREFIX = "kb:ingest:slots"
+
+# 每个workspace一个有序集合：member是占用槽位的资产，score是租约到期时间（毫秒）。
+# 先清掉过期的租约再判断数量，worker被杀之后槽位最多占用一个租约时长就会自动释放。
+_ACQUIRE_LUA = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+if redis.call('ZSCORE', KEYS[1], ARGV[1]) or redis.call('ZCARD', KEYS[1]) < tonumber(ARGV[2]) then
+  redis.call('ZADD', KEYS[1], now + tonumber(ARGV[3]), ARGV[1])
+  redis.call('PEXPIRE', KEYS[1], tonumber(ARGV[3]))
+  return 1
+end
+return 0
+"""
+
+_USAGE_LUA = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+return redis.call('ZRANGEBYSCORE', KEYS[1], now, '+inf', 'WITHSCORES')
+"""
+
+
+def _key(workspace_id: int) -> str:
+    return f"{SLOTS_REDIS_KEY_PREFIX}:{int(workspace_id)}"
+
+
+def slot_limit() -> int:
+    return int(settings.kb_ingest_workspace_max_inflight)
+
+
+def defer_seconds() -> float:
+    # 加一点抖动，被推迟的任务不会在同一时刻一起回来抢槽位
+    base = float(settings.kb_ingest_defer_seconds)
+    return base + random.uniform(0.0, base)
+
+
+async def try_acquire(redis: Redis, *, workspace_id: int, member: str) -> bool:
+    limit = slot_limit()
+    if limit <= 0:  # 0表示不限制
+        return True
+    lease_ms = int(float(settings.kb_ingest_slot_lease_seconds) * 1000)
+    try:
+        return bool(await redis.eval(_ACQUIRE_LUA, 1, _key(workspace_id), str(member), limit, lease_ms))
+    except RedisError:
+        # 公平调度只是保护手段，redis不可用时放行，不能让入库整体停摆
+        logger.warning("kb_ingest_slot_acquire_failed", exc_info=True, extra={"workspace_id": int(workspace_id)})
+        return True
+
+
+async def release(redis: Redis, *, workspace_id: int, member: str) -> None:
+    try:
+        await redis.zrem(_key(workspace_id), str(member))
+    except RedisError:
+        logger.warning("kb_ingest_slot_release_failed", exc_info=True, extra={"workspace_id": int(workspace_id)})
+
+
+async def _heartbeat(redis: Redis, *, workspace_id: int, member: str) -> None:
+    # 长任务定期续租，租约时长只需要覆盖worker失联后的回收时间
+    interval = max(1.0, float(settings.kb_ingest_slot_lease_seconds) / 3.0)
+    while True:
+        await asyncio.sleep(interval)
+        await try_acquire(redis, workspace_id=workspace_id, member=member)
+
+
+@dataclass
+class SlotLease:
+    acquired: bool
+    handed_off: bool = False  # 租约已经交给后续任务（拆分后的PDF各段），退出时不释放
+
+    def hand_off(self) -> None:
+        self.handed_off = True
+
+
+@asynccontextmanager
+async def workspace_slot(redis: Redis | None, *, workspace_id: int, member: str) -> AsyncIterator[SlotLease]:
+    if redis is None or slot_limit() <= 0:
+        yield SlotLease(acquired=True)
+        return
+    if not await try_acquire(redis, workspace_id=workspace_id, member=member):
+        yield SlotLease(acquired=False)
+        return
+    lease = SlotLease(acquired=True)
+    hb = asyncio.create_task(_heartbeat(redis, workspace_id=workspace_id, member=member))
+    try:
+        yield lease
+    finally:
+        hb.cancel()
+        if not lease.handed_off:
+            await release(redis, workspace_id=workspace_id, member=member)
+
+
+@asynccontextmanager
+async def renewing_slot(redis: Redis | None, *, workspace_id: int, member: str) -> AsyncIterator[None]:
+    # 接手别人交出来的租约：运行期间续租，不负责释放。
+    # 各段在队列里等待的时间超过租约时长时槽位会先被回收，和worker失联的情况一样
+    if redis is None or slot_limit() <= 0:
+        yield
+        return
+    await try_acquire(redis, workspace_id=workspace_id, member=member)
+    hb = asyncio.create_task(_heartbeat(redis, workspace_id=workspace_id, member=member))
+    try:
+        yield
+    finally:
+        hb.cancel()
+
+
+async def slot_usage(redis: Redis, *, workspace_id: int) -> dict[str, Any]:
+    raw = await redis.eval(_USAGE_LUA, 1, _key(workspace_id))
+    leases = [
+        {"member": (m.decode() if isinstance(m, bytes) else str(m)), "expires_at_ms": int(float(s))}
+        for m, s in zip(raw[0::2], raw[1::2])
+    ]
+    return {"workspace_id": int(workspace_id), "in_flight": len(leases), "limit": slot_limit(), "leases": leases}
+
+
+async def all_slot_usage(redis: Redis) -> list[dict[str, Any]]:
+    out: list[dict[str, Any]] = []
+    async for k in redis.scan_iter(match=f"{SLOTS_REDIS_KEY_PREFIX}:*", count=500):
+        key = k.decode() if isinstance(k, bytes) else str(k)
+        usage = await slot_usage(redis, workspace_id=int(key.rsplit(":", 1)[1]))
+        if usage["in_flight"]:
+            out.append(usage)
+    return sorted(out, key=lambda u: u["in_flight"], reverse=True)
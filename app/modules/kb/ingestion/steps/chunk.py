@@ -0,0 +1,236 @@
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Any, AsyncIterator, Awaitable, Callable
+
+import tiktoken
+from sqlalchemy import delete, func, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from app.core.config import settings
+from app.modules.kb.ingestion.steps.extract import ExtractedSection
+from app.modules.kb.ingestion.utils import sha256_text
+from app.modules.kb.models import KBChunk
+
+_PARA_SEP = "\n\n"
+
+
+@dataclass(frozen=True)
+class ChunkDraft:
+    chunk_index: int
+    text: str
+    token_count: int
+    meta: dict[str, Any] | None = None
+
+
+@dataclass
+class _Pending:  # 正在拼装中的chunk
+    tokens: list[int] = field(default_factory=list)
+    page_start: int | None = None
+    page_end: int | None = None
+    heading: str | None = None
+
+    def add_source(self, meta: dict[str, Any] | None) -> None:
+        m = meta or {}
+        page = m.get("page")
+        if page is not None:
+            self.page_start = page if self.page_start is None else self.page_start
+            self.page_end = page
+        if self.heading is None and m.get("heading"):
+            self.heading = str(m["heading"])
+
+    def meta(self) -> dict[str, Any] | None:
+        m: dict[str, Any] = {"tokens": len(self.tokens)}
+        if self.page_start is not None:
+            m["page_start"] = self.page_start
+            m["page_end"] = self.page_end
+        if self.heading:
+            m["heading"] = self.heading
+        return m
+
+
+@lru_cache(maxsize=8)
+def _encoding(name: str) -> tiktoken.Encoding:
+    return tiktoken.get_encoding(name)
+
+
+class TokenChunker:
+    def __init__(self, *, encoding_name: str, max_tokens: int, overlap_tokens: int) -> None:
+        if int(max_tokens) <= 0:
+            raise ValueError("bad_chunk_max_tokens")
+        if int(overlap_tokens) < 0 or int(overlap_tokens) >= int(max_tokens):
+            raise ValueError("bad_chunk_overlap_tokens")
+        self.enc = _encoding(str(encoding_name))
+        self.max_tokens = int(max_tokens)
+        self.overlap_tokens = int(overlap_tokens)
+        self._sep = self.enc.encode(_PARA_SEP)
+
+    @classmethod
+    def from_settings(cls) -> "TokenChunker":
+        return cls(
+            encoding_name=settings.kb_chunk_encoding,
+            max_tokens=settings.kb_chunk_max_tokens,
+            overlap_tokens=settings.kb_chunk_overlap_tokens,
+        )
+
+    def _encode(self, s: str) -> list[int]:
+        return self.enc.encode(s, disallowed_special=())
+
+    def _char_boundary(self, toks: list[int], i: int) -> bool:
+        # 字节级BPE的一个token可能只是某个多字节UTF-8字符的一部分：下一个token以续字节开头时，
+        # 在i处切开会把这个字符劈成两半，decode出U+FFFD
+        return i <= 0 or i >= len(toks) or (self.enc.decode_single_token_bytes(toks[i])[0] & 0xC0) != 0x80
+
+    def _cut(self, toks: list[int], room: int) -> int:
+        # 不超过room的最后一个字符边界；room连一个完整字符都放不下时往后多带几个token（一个字符最多4字节）
+        i = room
+        while i > 0 and not self._char_boundary(toks, i):
+            i -= 1
+        if i > 0:
+            return i
+        i = room
+        while not self._char_boundary(toks, i):
+            i += 1
+        return i
+
+    async def chunks(self, sections: AsyncIterator[ExtractedSection]) -> AsyncIterator[ChunkDraft]:
+        idx = 0
+        cur = _Pending()
+        body = 0  # cur里除了overlap前缀之外新加入的token数，为0说明没有新内容，不单独成块
+
+        def emit() -> ChunkDraft:
+            nonlocal idx
+            d = ChunkDraft(chunk_index=idx, text=self.enc.decode(cur.tokens).strip(), token_count=len(cur.tokens), meta=cur.meta())
+            idx += 1
+            return d
+
+        def restart() -> _Pending:
+            start = max(0, len(cur.tokens) - self.overlap_tokens) if self.overlap_tokens else len(cur.tokens)
+            while not self._char_boundary(cur.tokens, start):  # overlap从完整的字符开始
+                start += 1
+            nxt = _Pending(tokens=cur.tokens[start:])
+            nxt.page_start = cur.page_end
+            nxt.heading = cur.heading
+            return nxt
+
+        async for sec in sections:
+            # 每个section（页、标题段）重新开始装，chunk和overlap都不跨section：
+            # 改一句话只会让所在section里的chunk变化，后面的content_hash不受影响，增量重建时还能复用向量
+            cur, body = _Pending(), 0
+            for para in sec.text.split(_PARA_SEP):
+                if not para.strip():
+                    continue
+                toks = self._encode(para)
+                sep = self._sep if cur.tokens else []
+                if body and len(cur.tokens) + len(sep) + len(toks) > self.max_tokens:
+                    yield emit()
+                    cur, body = restart(), 0
+                    if len(cur.tokens) + len(self._sep) + len(toks) > self.max_tokens >= len(toks):
+                        cur = _Pending()  # 带上overlap就放不下，但段落本身放得下：宁可不要overlap也不把段落切碎
+                    sep = self._sep if cur.tokens else []
+                cur.add_source(sec.meta)
+                if len(cur.tokens) + len(sep) >= self.max_tokens:  # overlap加分隔符就占满了，没有位置放新内容
+                    cur.tokens, sep = [], []
+                cur.tokens.extend(sep)
+                # 单个段落就超过预算时按token窗口硬切，切点落在字符边界上；每次切出的块至少带一个完整字符
+                while len(cur.tokens) + len(toks) > self.max_tokens:
+                    room = self._cut(toks, self.max_tokens - len(cur.tokens))
+                    cur.tokens.extend(toks[:room])
+                    toks = toks[room:]
+                    body += room
+                    yield emit()
+                    cur, body = restart(), 0
+                    cur.add_source(sec.meta)
+                cur.tokens.extend(toks)
+                body += len(toks)
+            if body:  # 只剩overlap前缀的尾巴不输出
+                yield emit()
+
+
+def _chunk_row(asset_id: int, d: ChunkDraft, refs_by_hash: dict[str, str | None]) -> dict[str, Any]:
+    h = sha256_text(d.text)
+    return {
+        "asset_id": int(asset_id),
+        "chunk_index": int(d.chunk_index),
+        "text": d.text,
+        "content_hash": h,
+        "meta": d.meta,
+        "embedding_ref": refs_by_hash.get(h),  # 上一版本里已有同内容的向量就直接沿用，否则留空交给embed阶段
+    }
+
+
+async def _load_refs_by_hash(db: AsyncSession, *, asset_id: int) -> dict[str, str | None]:
+    # 老数据没有content_hash时在库里现算，避免把整段文本拉回应用
+    h = func.coalesce(KBChunk.content_hash, func.encode(func.sha256(func.convert_to(KBChunk.text, "UTF8")), "hex"))
+    async with db.begin():
+        rows = (await db.execute(select(h, KBChunk.embedding_ref).where(KBChunk.asset_id == int(asset_id)))).all()
+    out: dict[str, str | None] = {}
+    for hv, ref in rows:
+        if ref or str(hv) not in out:
+            out[str(hv)] = str(ref) if ref else None
+    return out
+
+
+async def _upsert_batch(db: AsyncSession, rows: list[dict[str, Any]]) -> None:
+    # 一个批次一条多行INSERT；重试的任务命中uq_kb_asset_chunk_index后走UPDATE
+    stmt = pg_insert(KBChunk).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        constraint="uq_kb_asset_chunk_index",
+        set_={
+            "text": stmt.excluded.text,
+            "content_hash": stmt.excluded.content_hash,
+            "meta": stmt.excluded.meta,
+            "embedding_ref": stmt.excluded.embedding_ref,
+        },
+    )
+    async with db.begin():
+        await db.execute(stmt)
+
+
+async def write_chunks(
+    *,
+    session_maker: async_sessionmaker[AsyncSession],
+    asset_id: int,
+    chunks: AsyncIterator[ChunkDraft],
+    batch_size: int | None = None,
+    resume_after: int = -1,
+    on_batch: Callable[[int, int], Awaitable[None]] | None = None,
+    index_offset: int = 0,
+    index_span: int | None = None,
+) -> dict[str, Any]:
+    # index_offset/index_span：拆分处理的大PDF每一段写到自己的一段暂存序号里，合并时再统一重排
+    bs = max(1, int(batch_size or settings.kb_chunk_insert_batch_size))
+    total = 0
+    tokens = 0
+    reused = 0
+    async with session_maker() as db:
+        refs_by_hash = await _load_refs_by_hash(db, asset_id=int(asset_id))
+        rows: list[dict[str, Any]] = []
+
+        async def flush() -> None:
+            await _upsert_batch(db, rows)
+            if on_batch is not None:
+                await on_batch(int(rows[-1]["chunk_index"]), total)
+
+        async for d in chunks:
+            total += 1
+            tokens += int(d.token_count)
+            if d.chunk_index <= resume_after:  # 续跑时上次已经提交过的chunk：切块结果是确定的，不用重写
+                continue
+            row = _chunk_row(asset_id, d, refs_by_hash)
+            row["chunk_index"] += int(index_offset)
+            rows.append(row)
+            reused += 1 if row["embedding_ref"] else 0
+            if len(rows) >= bs:
+                await flush()
+                rows = []
+        if rows:
+            await flush()
+        tail = delete(KBChunk).where(KBChunk.asset_id == int(asset_id), KBChunk.chunk_index >= int(index_offset) + total)
+        if index_span is not None:
+            tail = tail.where(KBChunk.chunk_index < int(index_offset) + int(index_span))
+        async with db.begin():  # 上一次运行如果切出了更多chunk，把尾部多余的删掉
+            await db.execute(tail)
+    return {"chunks": total, "tokens": tokens, "reused": reused}
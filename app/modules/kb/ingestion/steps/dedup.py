@@ -0,0 +1,149 @@
+from __future__ import annotations
+
+from typing import Any
+
+from qdrant_client import AsyncQdrantClient
+from qdrant_client.models import PointStruct
+from sqlalchemy import case, delete, func, literal, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from sqlalchemy.orm import aliased
+
+from app.core.config import settings
+from app.modules.kb.consts import ASSET_STATUS_READY
+from app.modules.kb.ingestion.utils import sha256_text
+from app.modules.kb.models import KBAsset, KBChunk
+from app.modules.kb.vectors import PAYLOAD_ASSET_ID, PAYLOAD_WORKSPACE_ID, chunk_point_id, collection_name
+
+
+async def find_ready_duplicate(session_maker: async_sessionmaker[AsyncSession], *, asset: KBAsset) -> int | None:
+    # 同一workspace里内容hash相同、且已经处理完成的资产（走idx_kb_asset_ws_sha256）
+    if not asset.sha256:
+        return None
+    async with session_maker() as db:
+        async with db.begin():
+            return (
+                await db.execute(
+                    select(KBAsset.id)
+                    .where(
+                        KBAsset.workspace_id == int(asset.workspace_id),
+                        KBAsset.sha256 == str(asset.sha256),
+                        KBAsset.status == ASSET_STATUS_READY,
+                        KBAsset.id != int(asset.id),
+                    )
+                    .order_by(KBAsset.id)
+                    .limit(1)
+                )
+            ).scalar_one_or_none()
+
+
+async def _clone_rows(db: AsyncSession, *, src_asset_id: int, asset_id: int) -> int:
+    # 整批复制在数据库里一条INSERT ... SELECT完成，不经过应用进程
+    src = select(
+        literal(int(asset_id)).label("asset_id"),
+        KBChunk.chunk_index,
+        KBChunk.text,
+        func.coalesce(KBChunk.content_hash, func.encode(func.sha256(func.convert_to(KBChunk.text, "UTF8")), "hex")),
+        KBChunk.meta,
+    ).where(KBChunk.asset_id == int(src_asset_id))
+    stmt = pg_insert(KBChunk).from_select(["asset_id", "chunk_index", "text", "content_hash", "meta"], src)
+    stmt = stmt.on_conflict_do_update(
+        constraint="uq_kb_asset_chunk_index",
+        set_={
+            "text": stmt.excluded.text,
+            "content_hash": stmt.excluded.content_hash,
+            "meta": stmt.excluded.meta,
+            "embedding_ref": case(
+                (KBChunk.content_hash == stmt.excluded.content_hash, KBChunk.embedding_ref),
+                else_=None,
+            ),
+        },
+    )
+    async with db.begin():
+        total = int((await db.execute(stmt)).rowcount or 0)
+        await db.execute(delete(KBChunk).where(KBChunk.asset_id == int(asset_id), KBChunk.chunk_index >= total))
+    return total
+
+
+async def _clone_vectors(
+    db: AsyncSession,
+    *,
+    qdrant: AsyncQdrantClient,
+    src_asset_id: int,
+    asset: KBAsset,
+    batch_size: int,
+) -> int:
+    dst = aliased(KBChunk)
+    src = aliased(KBChunk)
+    collection = collection_name()
+    last = -1
+    cloned = 0
+    while True:
+        async with db.begin():
+            rows = (
+                await db.execute(
+                    select(dst.id, dst.chunk_index, dst.text, dst.content_hash, src.embedding_ref)
+                    .join(src, (src.asset_id == int(src_asset_id)) & (src.chunk_index == dst.chunk_index))
+                    .where(
+                        dst.asset_id == int(asset.id),
+                        dst.embedding_ref.is_(None),
+                        src.embedding_ref.is_not(None),
+                        dst.chunk_index > last,
+                    )
+                    .order_by(dst.chunk_index)
+                    .limit(batch_size)
+                )
+            ).all()
+        if not rows:
+            break
+        last = int(rows[-1].chunk_index)
+
+        # 直接从qdrant取源向量另存一份，payload换成新资产；找不到的留给embed阶段补算
+        found = await qdrant.retrieve(
+            collection_name=collection,
+            ids=list({str(r.embedding_ref) for r in rows}),
+            with_vectors=True,
+            with_payload=False,
+        )
+        vec_by_id = {str(p.id): p.vector for p in found if p.vector is not None}
+        points: list[PointStruct] = []
+        updates: list[dict[str, Any]] = []
+        for r in rows:
+            vec = vec_by_id.get(str(r.embedding_ref))
+            if vec is None:
+                continue
+            pid = chunk_point_id(asset_id=int(asset.id), content_hash=str(r.content_hash or sha256_text(r.text)))
+            points.append(
+                PointStruct(
+                    id=pid,
+                    vector=vec,
+                    payload={PAYLOAD_WORKSPACE_ID: int(asset.workspace_id), PAYLOAD_ASSET_ID: int(asset.id)},
+                )
+            )
+            updates.append({"id": int(r.id), "embedding_ref": pid})
+        if not points:
+            continue
+        await qdrant.upsert(collection_name=collection, points=points, wait=True)
+        async with db.begin():
+            await db.execute(update(KBChunk), updates)
+        cloned += len(points)
+    return cloned
+
+
+async def clone_from_duplicate(
+    *,
+    session_maker: async_sessionmaker[AsyncSession],
+    qdrant: AsyncQdrantClient,
+    src_asset_id: int,
+    asset: KBAsset,
+) -> dict[str, Any]:
+    async with session_maker() as db:
+        chunks = await _clone_rows(db, src_asset_id=int(src_asset_id), asset_id=int(asset.id))
+        vectors = await _clone_vectors(
+            db,
+            qdrant=qdrant,
+            src_asset_id=int(src_asset_id),
+            asset=asset,
+            batch_size=max(1, int(settings.kb_embed_batch_size)),
+        )
+    return {"source_asset_id": int(src_asset_id), "chunks": chunks, "vectors": vectors}
@@ -0,0 +1,80 @@
+from __future__ import annotations
+
+from typing import Any, Awaitable, Callable
+
+from qdrant_client import AsyncQdrantClient
+from qdrant_client.models import PointStruct
+from redis.asyncio import Redis
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from app.core.config import settings
+from app.modules.kb.embeddings import encode_texts
+from app.modules.kb.ingestion.utils import sha256_text
+from app.modules.kb.models import KBAsset, KBChunk
+from app.modules.kb.vectors import PAYLOAD_ASSET_ID, PAYLOAD_WORKSPACE_ID, chunk_point_id, ensure_collection
+
+
+async def embed_chunks(
+    *,
+    session_maker: async_sessionmaker[AsyncSession],
+    qdrant: AsyncQdrantClient,
+    redis: Redis | None,
+    asset: KBAsset,
+    batch_size: int | None = None,
+    start_after: int = -1,
+    end_before: int | None = None,
+    on_batch: Callable[[int, int], Awaitable[None]] | None = None,
+) -> dict[str, Any]:
+    bs = max(1, int(batch_size or settings.kb_embed_batch_size))
+    last = int(start_after)
+    embedded = 0
+    batches = 0
+    async with session_maker() as db:
+        while True:
+            # 只处理还没有向量引用的chunk，按chunk_index做keyset分页
+            q = (
+                select(KBChunk.id, KBChunk.chunk_index, KBChunk.text, KBChunk.content_hash)
+                .where(
+                    KBChunk.asset_id == int(asset.id),
+                    KBChunk.embedding_ref.is_(None),
+                    KBChunk.chunk_index > last,
+                )
+                .order_by(KBChunk.chunk_index)
+                .limit(bs)
+            )
+            if end_before is not None:
+                q = q.where(KBChunk.chunk_index < int(end_before))
+            async with db.begin():
+                rows = (await db.execute(q)).all()
+            if not rows:
+                break
+
+            vecs = await encode_texts([str(r.text) for r in rows], redis=redis)
+            collection = await ensure_collection(qdrant, dim=len(vecs[0]))
+            refs = [
+                chunk_point_id(asset_id=int(asset.id), content_hash=str(r.content_hash or sha256_text(r.text)))
+                for r in rows
+            ]
+            points = [
+                PointStruct(
+                    id=pid,
+                    vector=vec,
+                    payload={PAYLOAD_WORKSPACE_ID: int(asset.workspace_id), PAYLOAD_ASSET_ID: int(asset.id)},
+                )
+                for pid, vec in zip(refs, vecs)
+            ]
+            await qdrant.upsert(collection_name=collection, points=points, wait=True)
+
+            async with db.begin():  # 按主键批量回写embedding_ref，一个批次一次executemany
+                await db.execute(
+                    update(KBChunk),
+                    [{"id": int(r.id), "embedding_ref": pid} for r, pid in zip(rows, refs)],
+                )
+
+            last = int(rows[-1].chunk_index)
+            embedded += len(rows)
+            batches += 1
+            if on_batch is not None:
+                await on_batch(last, embedded)
+    return {"embedded": embedded, "batches": batches, "model": str(settings.kb_embed_model)}
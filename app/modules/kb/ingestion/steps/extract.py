@@ -0,0 +1,323 @@
+from __future__ import annotations
+
+import asyncio
+import codecs
+import os
+import re
+import tempfile
+from dataclasses import dataclass
+from html.parser import HTMLParser
+from typing import IO, Any, AsyncIterator, Iterator, TypeVar
+
+from docx import Document
+from docx.table import Table
+from docx.text.paragraph import Paragraph
+from pypdf import PdfReader
+
+from app.core.config import settings
+from app.infra.blob_storage.interface import StorageBackend
+
+T = TypeVar("T")
+
+KIND_PDF = "pdf"
+KIND_DOCX = "docx"
+KIND_TEXT = "text"
+KIND_MARKDOWN = "markdown"
+KIND_HTML = "html"
+
+_MIME_KINDS: dict[str, str] = {
+    "application/pdf": KIND_PDF,
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.document": KIND_DOCX,
+    "text/markdown": KIND_MARKDOWN,
+    "text/x-markdown": KIND_MARKDOWN,
+    "text/html": KIND_HTML,
+    "application/xhtml+xml": KIND_HTML,
+    "text/plain": KIND_TEXT,
+}
+
+_EXT_KINDS: dict[str, str] = {
+    ".pdf": KIND_PDF,
+    ".docx": KIND_DOCX,
+    ".md": KIND_MARKDOWN,
+    ".markdown": KIND_MARKDOWN,
+    ".html": KIND_HTML,
+    ".htm": KIND_HTML,
+    ".txt": KIND_TEXT,
+}
+
+_RE_MD_HEADING = re.compile(r"^\s{0,3}#{1,6}\s+\S")
+_RE_MD_FENCE = re.compile(r"^\s{0,3}(```|~~~)")
+_RE_INLINE_WS = re.compile(r"[ \t\f\v\u00a0]+")
+_RE_BLANK_LINES = re.compile(r"\n{3,}")
+
+_END = object()
+
+
+@dataclass(frozen=True)
+class ExtractedSection:
+    index: int		# 在文档内的顺序号，从0开始
+    text: str
+    meta: dict[str, Any] | None = None		# 页码、标题等定位信息
+
+
+# 失败时写进资产meta.error的错误码
+UNSUPPORTED_DOCUMENT_TYPE = "unsupported_document_type"
+
+
+class UnsupportedDocumentError(ValueError):
+    pass
+
+
+def document_kind(*, mime_type: str | None, filename: str | None) -> str | None:
+    ext = os.path.splitext(str(filename or "").strip())[1].lower()
+    ml = (mime_type or "").split(";", 1)[0].strip().lower()
+    kind = _MIME_KINDS.get(ml)
+    if kind == KIND_TEXT and _EXT_KINDS.get(ext) == KIND_MARKDOWN:  # 很多系统把.md报成text/plain
+        return KIND_MARKDOWN
+    if kind:
+        return kind
+    if ml.startswith("text/"):
+        return _EXT_KINDS.get(ext) or KIND_TEXT
+    return _EXT_KINDS.get(ext)
+
+
+def normalize_text(s: str) -> str:
+    s = (s or "").replace("\x00", "").replace("\r\n", "\n").replace("\r", "\n")
+    lines = [_RE_INLINE_WS.sub(" ", ln).strip() for ln in s.split("\n")]
+    return _RE_BLANK_LINES.sub("\n\n", "\n".join(lines)).strip()
+
+
+async def _iter_in_thread(it: Iterator[T]) -> AsyncIterator[T]:
+    # 解析器都是同步且吃CPU的，每次只在线程里推进一步，事件循环不会被整份文档卡住
+    while True:
+        item = await asyncio.to_thread(next, it, _END)
+        if item is _END:
+            return
+        yield item  # type: ignore[misc]
+
+
+async def _spool(storage: StorageBackend, key: str) -> IO[bytes]:
+    # pdf/docx解析需要可seek的文件对象；小文件留在内存，大文件自动落到临时文件
+    f = tempfile.SpooledTemporaryFile(max_size=int(settings.kb_extract_spool_max_bytes))
+    try:
+        async for b in storage.open_stream(key=key):
+            f.write(b)
+        f.seek(0)
+    except BaseException:
+        f.close()
+        raise
+    return f  # type: ignore[return-value]
+
+
+def _iter_pdf(f: IO[bytes], pages: tuple[int, int] | None = None) -> Iterator[tuple[str, dict[str, Any]]]:
+    reader = PdfReader(f, strict=False)
+    n = len(reader.pages)
+    start, end = pages or (0, n)  # 页码区间左闭右开，从0开始
+    for i in range(max(0, int(start)), min(n, int(end))):
+        yield (reader.pages[i].extract_text() or ""), {"page": i + 1, "page_count": n}
+
+
+async def pdf_page_count(storage: StorageBackend, key: str) -> int:
+    f = await _spool(storage, key)
+    try:
+        return await asyncio.to_thread(lambda: len(PdfReader(f, strict=False).pages))
+    finally:
+        f.close()
+
+
+def _docx_table_text(t: Table) -> str:
+    return "\n".join(" | ".join(c.text.strip() for c in row.cells) for row in t.rows)
+
+
+def _iter_docx(f: IO[bytes]) -> Iterator[tuple[str, dict[str, Any]]]:
+    doc = Document(f)
+    limit = int(settings.kb_extract_section_chars)
+    buf: list[str] = []
+    size = 0
+    heading: str | None = None
+    for el in doc.element.body.iterchildren():
+        tag = str(el.tag).rsplit("}", 1)[-1]
+        if tag == "p":
+            p = Paragraph(el, doc)
+            txt = p.text or ""
+            style = str(getattr(p.style, "name", "") or "")
+            if style.startswith("Heading") or style == "Title":
+                if size:
+                    yield "\n".join(buf), {"heading": heading}
+                    buf, size = [], 0
+                heading = txt.strip() or heading
+        elif tag == "tbl":
+            txt = _docx_table_text(Table(el, doc))
+        else:
+            continue
+        buf.append(txt)
+        size += len(txt) + 1
+        if size >= limit:
+            yield "\n".join(buf), {"heading": heading}
+            buf, size = [], 0
+    if size:
+        yield "\n".join(buf), {"heading": heading}
+
+
+async def _iter_decoded(storage: StorageBackend, key: str) -> AsyncIterator[str]:
+    dec = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+    async for b in storage.open_stream(key=key):
+        s = dec.decode(b)
+        if s:
+            yield s
+    s = dec.decode(b"", final=True)
+    if s:
+        yield s
+
+
+async def _iter_lines(storage: StorageBackend, key: str) -> AsyncIterator[str]:
+    tail = ""
+    async for s in _iter_decoded(storage, key):
+        parts = (tail + s).split("\n")
+        tail = parts.pop()
+        for ln in parts:
+            yield ln.rstrip("\r")
+    if tail:
+        yield tail.rstrip("\r")
+
+
+async def _iter_text(storage: StorageBackend, key: str, *, markdown: bool) -> AsyncIterator[tuple[str, dict[str, Any]]]:
+    limit = int(settings.kb_extract_section_chars)
+    buf: list[str] = []
+    size = 0
+    heading: str | None = None
+    in_fence = False
+    async for ln in _iter_lines(storage, key):
+        if markdown and _RE_MD_FENCE.match(ln):
+            in_fence = not in_fence
+        is_heading = markdown and not in_fence and bool(_RE_MD_HEADING.match(ln))
+        if is_heading:
+            if size:
+                yield "\n".join(buf), {"heading": heading}
+                buf, size = [], 0
+            heading = ln.strip().lstrip("#").strip() or heading
+        buf.append(ln)
+        size += len(ln) + 1
+        # 优先在空行处切，避免把段落截断；单段特别长时兜底硬切
+        if size >= limit and ((not ln.strip() and not in_fence) or size >= 4 * limit):
+            yield "\n".join(buf), {"heading": heading}
+            buf, size = [], 0
+    if size:
+        yield "\n".join(buf), {"heading": heading}
+
+
+class _HTMLSectionParser(HTMLParser):
+    _SKIP = {"script", "style", "noscript", "template", "head", "svg"}
+    _HEADINGS = {"h1", "h2", "h3", "h4", "h5", "h6"}
+    _BLOCK = {
+        "p", "div", "br", "li", "ul", "ol", "tr", "td", "th", "table", "section", "article",
+        "header", "footer", "nav", "aside", "pre", "blockquote", "hr", "dd", "dt",
+    } | _HEADINGS
+
+    def __init__(self, *, limit: int) -> None:
+        super().__init__(convert_charrefs=True)
+        self._limit = int(limit)
+        self._skip = 0
+        self._buf: list[str] = []
+        self._size = 0
+        self._heading: str | None = None
+        self._heading_parts: list[str] | None = None
+        self.sections: list[tuple[str, dict[str, Any]]] = []
+
+    def _flush(self) -> None:
+        txt = "".join(self._buf)
+        if txt.strip():
+            self.sections.append((txt, {"heading": self._heading}))
+        self._buf, self._size = [], 0
+
+    def handle_starttag(self, tag: str, attrs: list[tuple[str, str | None]]) -> None:
+        if tag in self._SKIP:
+            self._skip += 1
+            return
+        if tag in self._HEADINGS:
+            self._flush()
+            self._heading_parts = []
+        if tag in self._BLOCK:
+            self._buf.append("\n")
+
+    def handle_endtag(self, tag: str) -> None:
+        if tag in self._SKIP:
+            self._skip = max(0, self._skip - 1)
+            return
+        if tag in self._HEADINGS and self._heading_parts is not None:
+            self._heading = " ".join("".join(self._heading_parts).split()) or self._heading
+            self._heading_parts = None
+        if tag in self._BLOCK:
+            self._buf.append("\n")
+            if self._size >= self._limit:
+                self._flush()
+
+    def handle_data(self, data: str) -> None:
+        if self._skip:
+            return
+        self._buf.append(data)
+        self._size += len(data)
+        if self._heading_parts is not None:
+            self._heading_parts.append(data)
+
+    def finish(self) -> None:
+        self.close()
+        self._flush()
+
+
+async def _iter_html(storage: StorageBackend, key: str) -> AsyncIterator[tuple[str, dict[str, Any]]]:
+    parser = _HTMLSectionParser(limit=int(settings.kb_extract_section_chars))
+    async for s in _iter_decoded(storage, key):
+        parser.feed(s)
+        if parser.sections:
+            done, parser.sections = parser.sections, []
+            for item in done:
+                yield item
+    parser.finish()
+    for item in parser.sections:
+        yield item
+
+
+async def _iter_raw(
+        storage: StorageBackend,
+        key: str,
+        kind: str,
+        pages: tuple[int, int] | None = None) -> AsyncIterator[tuple[str, dict[str, Any]]]:
+    if kind in {KIND_PDF, KIND_DOCX}:
+        f = await _spool(storage, key)
+        try:
+            it = _iter_pdf(f, pages) if kind == KIND_PDF else _iter_docx(f)
+            async for item in _iter_in_thread(it):
+                yield item
+        finally:
+            f.close()
+        return
+    if kind == KIND_HTML:
+        async for item in _iter_html(storage, key):
+            yield item
+        return
+    async for item in _iter_text(storage, key, markdown=(kind == KIND_MARKDOWN)):
+        yield item
+
+
+async def extract_sections(
+    *,
+    storage: StorageBackend,
+    key: str,
+    mime_type: str | None,
+    filename: str | None,
+    pages: tuple[int, int] | None = None,
+) -> AsyncIterator[ExtractedSection]:
+    kind = document_kind(mime_type=mime_type, filename=filename)
+    if kind is None:
+        raise UnsupportedDocumentError(UNSUPPORTED_DOCUMENT_TYPE)
+    if pages is not None and kind != KIND_PDF:  # 只有PDF支持按页拆分
+        raise UnsupportedDocumentError("page_range_requires_pdf")
+    idx = 0
+    async for raw, meta in _iter_raw(storage, key, kind, pages):
+        txt = normalize_text(raw)
+        if not txt:
+            continue
+        m = {k: v for k, v in meta.items() if v is not None}
+        yield ExtractedSection(index=idx, text=txt, meta=m or None)
+        idx += 1
@@ -0,0 +1,177 @@
+from __future__ import annotations
+
+import asyncio
+from typing import Any, Awaitable, Callable
+
+from elasticsearch import AsyncElasticsearch, helpers
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from app.core.config import settings
+from app.modules.kb.es_index import (
+    FIELD_ASSET_ID,
+    FIELD_CHUNK_INDEX,
+    FIELD_TEXT,
+    FIELD_WORKSPACE_ID,
+    ensure_workspace_index,
+    set_refresh_interval,
+    workspace_routing,
+)
+from app.modules.kb.ingestion.utils import sha256_text
+from app.modules.kb.models import KBAsset, KBChunk
+from app.modules.kb.vectors import chunk_point_id
+
+
+def _succeeded(task: asyncio.Task[Any] | None) -> bool:
+    return task is None or (task.done() and not task.cancelled() and task.exception() is None)
+
+
+class _BulkWindow:  # 同时在途的bulk请求数有上限，发满了就等最早完成的那个
+    def __init__(self, es: AsyncElasticsearch, *, max_inflight: int) -> None:
+        self.es = es
+        self.max_inflight = max(1, int(max_inflight))
+        self.pending: set[asyncio.Task[tuple[int, Any]]] = set()
+        self.marks: list[tuple[asyncio.Task[tuple[int, Any]] | None, int]] = []  # 按提交顺序排列
+        self.safe_mark: int | None = None  # 这个位置及之前的批次都已经写成功
+        self.done = 0
+        self.bulks = 0
+
+    def _collect(self, finished: set[asyncio.Task[tuple[int, Any]]]) -> None:
+        for t in finished:
+            ok, _ = t.result()  # raise_on_error=True，失败直接抛BulkIndexError
+            self.done += int(ok)
+        # bulk完成顺序不固定，断点只能推进到连续完成的前缀为止
+        while self.marks and _succeeded(self.marks[0][0]):
+            self.safe_mark = self.marks.pop(0)[1]
+
+    async def submit(self, actions: list[dict[str, Any]], *, mark: int | None = None, **kwargs: Any) -> None:
+        if len(self.pending) >= self.max_inflight:
+            finished, self.pending = await asyncio.wait(self.pending, return_when=asyncio.FIRST_COMPLETED)
+            self._collect(finished)
+        task = None
+        if actions:
+            task = asyncio.create_task(
+                helpers.async_bulk(self.es, actions, chunk_size=len(actions), raise_on_error=True, **kwargs)
+            )
+            self.pending.add(task)
+            self.bulks += 1
+        if mark is not None:
+            self.marks.append((task, int(mark)))
+        if task is None:
+            self._collect(set())
+
+    async def drain(self) -> None:
+        if self.pending:
+            finished, self.pending = await asyncio.wait(self.pending)
+            self._collect(finished)
+
+    def cancel(self) -> None:
+        for t in self.pending:
+            t.cancel()
+        self.pending = set()
+
+
+async def _existing_ids(es: AsyncElasticsearch, *, alias: str, routing: str, ids: list[str]) -> set[str]:
+    res = await es.mget(index=alias, ids=ids, routing=routing, source=False)
+    return {str(d["_id"]) for d in res["docs"] if d.get("found")}
+
+
+async def index_chunks(
+    *,
+    session_maker: async_sessionmaker[AsyncSession],
+    es: AsyncElasticsearch,
+    asset: KBAsset,
+    stale_ids: set[str] | None = None,
+    check_existing: bool = False,
+    start_after: int = -1,
+    on_progress: Callable[[int, int], Awaitable[None]] | None = None,
+) -> dict[str, Any]:
+    ws = int(asset.workspace_id)
+    routing = workspace_routing(ws)
+    alias = await ensure_workspace_index(es, workspace_id=ws)
+    bs = max(1, int(settings.es_bulk_chunk_size))
+    window = _BulkWindow(es, max_inflight=int(settings.es_bulk_max_inflight))
+
+    async with session_maker() as db:
+        async with db.begin():
+            total = int((await db.execute(
+                select(func.count()).select_from(KBChunk).where(KBChunk.asset_id == int(asset.id))
+            )).scalar_one())
+
+        # 大批量写入期间关掉refresh，写完统一恢复成配置值（不恢复成读到的旧值，避免并发任务互相把-1写回去）
+        paused = total >= int(settings.es_bulk_large_threshold)
+        if paused:
+            await set_refresh_interval(es, workspace_id=ws, interval="-1")
+        last = int(start_after)
+        seen: set[str] = set()
+        skipped = 0
+        saved: int | None = None
+        try:
+            while True:
+                async with db.begin():
+                    rows = (
+                        await db.execute(
+                            select(KBChunk.chunk_index, KBChunk.text, KBChunk.content_hash, KBChunk.embedding_ref)
+                            .where(KBChunk.asset_id == int(asset.id), KBChunk.chunk_index > last)
+                            .order_by(KBChunk.chunk_index)
+                            .limit(bs)
+                        )
+                    ).all()
+                if not rows:
+                    break
+                last = int(rows[-1].chunk_index)
+
+                # 文档_id和qdrant的point id一致，检索两路结果可以直接按id融合
+                docs: dict[str, Any] = {}
+                for r in rows:
+                    did = str(r.embedding_ref or chunk_point_id(asset_id=int(asset.id), content_hash=str(r.content_hash or sha256_text(r.text))))
+                    if did not in seen:
+                        seen.add(did)
+                        docs[did] = r
+                if check_existing and docs:  # 重新入库时id由内容决定，已经存在的文档就是最新的，不必重写
+                    for did in await _existing_ids(es, alias=alias, routing=routing, ids=list(docs)):
+                        docs.pop(did, None)
+                        skipped += 1
+                await window.submit([
+                    {
+                        "_op_type": "index",
+                        "_index": alias,
+                        "_id": did,
+                        "_routing": routing,
+                        "_source": {
+                            FIELD_TEXT: str(r.text),
+                            FIELD_WORKSPACE_ID: ws,
+                            FIELD_ASSET_ID: int(asset.id),
+                            FIELD_CHUNK_INDEX: int(r.chunk_index),
+                        },
+                    }
+                    for did, r in docs.items()
+                ], mark=last)
+                if on_progress is not None and window.safe_mark is not None and window.safe_mark != saved:
+                    saved = window.safe_mark
+                    await on_progress(saved, window.done)
+            await window.drain()
+            indexed = window.done
+            if on_progress is not None and window.safe_mark is not None and window.safe_mark != saved:
+                await on_progress(window.safe_mark, indexed)
+
+            stale = sorted(stale_ids or ())
+            for i in range(0, len(stale), bs):
+                await window.submit(
+                    [{"_op_type": "delete", "_index": alias, "_id": did, "_routing": routing} for did in stale[i:i + bs]],
+                    ignore_status=(404,),
+                )
+            await window.drain()
+        except BaseException:
+            window.cancel()
+            raise
+        finally:
+            if paused:
+                await set_refresh_interval(es, workspace_id=ws, interval=str(settings.es_refresh_interval))
+    return {
+        "indexed": indexed,
+        "skipped": skipped,
+        "deleted": window.done - indexed,
+        "bulks": window.bulks,
+        "refresh_paused": paused,
+    }
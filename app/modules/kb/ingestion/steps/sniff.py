@@ -4,6 +4,26 @@ import mimetypes
 from dataclasses import dataclass
 from typing import Any
 
+from app.infra.blob_storage.interface import StorageBackend
+
+SNIFF_BYTES = 8192  # 只读文件头几KB判断类型
+
+_DOCX_MIME = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+
+# (魔数, MIME)，从文件开头按顺序匹配
+_MAGIC: tuple[tuple[bytes, str], ...] = (
+    (b"%PDF-", "application/pdf"),
+    (b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1", "application/msword"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"ID3", "audio/mpeg"),
+    (b"OggS", "audio/ogg"),
+    (b"fLaC", "audio/flac"),
+    (b"\x1a\x45\xdf\xa3", "video/webm"),
+)
+
 
 @dataclass(frozen=True)
 class SniffResult:
@@ -35,12 +55,65 @@ def _source_type_from_mime(m: str | None) -> str | None:
     return None
 
 
-async def sniff(*, filename: str, mime_type_hint: str | None = None) -> SniffResult:
-    mt = (mime_type_hint or "").strip() or None
-    if mt is None:
-        mt, _ = mimetypes.guess_type(str(filename or "").strip())
-    st = _source_type_from_mime(mt)
+def _looks_like_text(head: bytes) -> bool:
+    if not head or b"\x00" in head:
+        return False
+    try:
+        head.decode("utf-8")
+    except UnicodeDecodeError as e:
+        if e.start < len(head) - 3:  # 只允许截断在结尾的多字节字符
+            return False
+    return True
+
+
+def _mime_from_magic(head: bytes, declared: str | None) -> str | None:
+    for magic, mt in _MAGIC:
+        if head.startswith(magic):
+            return mt
+    if head[:4] == b"PK\x03\x04":
+        # zip容器：docx的本地文件头里通常会出现word/目录，但word/不一定排在前几KB里，
+        # 看不到时声明（或扩展名）是docx就保留docx，交给抽取阶段去真正打开
+        if b"word/" in head or declared == _DOCX_MIME:
+            return _DOCX_MIME
+        return "application/zip"
+    if head[:4] == b"RIFF" and head[8:12] in (b"WAVE", b"WEBP", b"AVI "):
+        return {b"WAVE": "audio/wav", b"WEBP": "image/webp", b"AVI ": "video/x-msvideo"}[head[8:12]]
+    if head[4:8] == b"ftyp":  # ISO BMFF：M4A这类品牌是音频，其余按视频处理
+        return "audio/mp4" if head[8:11] == b"M4A" else "video/mp4"
+    if head[:2] in (b"\xff\xfb", b"\xff\xf3", b"\xff\xf2"):
+        return "audio/mpeg"
+    if _looks_like_text(head):
+        lead = head[:512].lstrip().lower()
+        if lead.startswith((b"<!doctype html", b"<html")):
+            return "text/html"
+        # markdown之类没有魔数，声明的是文本类型就保留声明
+        return declared if (declared or "").startswith("text/") else "text/plain"
+    return None
+
+
+async def sniff(
+        *,
+        filename: str,
+        mime_type_hint: str | None = None,
+        storage: StorageBackend | None = None,
+        key: str | None = None) -> SniffResult:
+    declared = (mime_type_hint or "").strip() or None
+    guessed, _ = mimetypes.guess_type(str(filename or "").strip())
+    if declared is None or (_source_type_from_mime(declared) is None and guessed):
+        declared = guessed  # application/octet-stream这类笼统的声明不如扩展名有用
+    mt = declared
     meta: dict[str, Any] = {"filename": str(filename or "").strip()}
+    if storage is not None and key:
+        # 文件名和上传时声明的类型都不可信，有内容时以文件头为准
+        magic = _mime_from_magic(await storage.get_range(key=key, start=0, length=SNIFF_BYTES), declared)
+        if magic and _source_type_from_mime(magic) is None and _source_type_from_mime(declared) is not None:
+            meta["sniffed_mime_type"] = magic  # 不用一个处理不了的笼统类型顶掉能处理的声明类型
+        elif magic:
+            mt = magic
+            meta["mime_source"] = "magic"
+            if declared and declared != magic:
+                meta["declared_mime_type"] = declared
+    st = _source_type_from_mime(mt)
     if mt:
         meta["mime_type"] = mt
     if st:
@@ -0,0 +1,98 @@
+from __future__ import annotations
+
+import asyncio
+import gzip
+import json
+import tempfile
+import zlib
+from typing import Any, AsyncIterator
+
+from app.core.config import settings
+from app.infra.blob_storage.interface import DEFAULT_STREAM_CHUNK_SIZE, StorageBackend
+from app.modules.kb.ingestion.steps.extract import ExtractedSection
+
+EXTRACTED_TEXT_NAME = "extracted-text.jsonl.gz"
+# 抽取或归一化逻辑有变化时加一，旧的缓存自动失效
+EXTRACT_FORMAT_VERSION = 1
+
+
+async def _read_lines(storage: StorageBackend, key: str) -> AsyncIterator[bytes]:
+    d = zlib.decompressobj(16 + zlib.MAX_WBITS)  # gzip格式，边下载边解压
+    buf = b""
+    async for part in storage.open_stream(key=key):
+        buf += d.decompress(part)
+        *lines, buf = buf.split(b"\n")
+        for ln in lines:
+            if ln:
+                yield ln
+    buf += d.flush()
+    if buf.strip():
+        yield buf
+
+
+async def _sections(lines: AsyncIterator[bytes]) -> AsyncIterator[ExtractedSection]:
+    async for ln in lines:
+        row = json.loads(ln)
+        yield ExtractedSection(index=int(row["i"]), text=str(row["text"]), meta=row.get("meta"))
+
+
+async def open_cached_sections(storage: StorageBackend, *, key: str, sha256: str | None) -> AsyncIterator[ExtractedSection] | None:
+    # 头一行记录了源文件hash和格式版本，对不上就当作没有缓存
+    if not sha256 or not await storage.exists(key=key):
+        return None
+    lines = _read_lines(storage, key)
+    try:
+        head = json.loads(await lines.__anext__())
+    except (StopAsyncIteration, ValueError, zlib.error):
+        await lines.aclose()
+        return None
+    if head.get("v") != EXTRACT_FORMAT_VERSION or head.get("sha256") != sha256:
+        await lines.aclose()
+        return None
+    return _sections(lines)
+
+
+class TextCacheWriter:  # 抽取结果边产出边压缩写进临时文件，全部成功后才上传
+    def __init__(self, *, sha256: str | None, mime_type: str | None) -> None:
+        self.sha256 = sha256
+        self._tmp = tempfile.SpooledTemporaryFile(max_size=int(settings.kb_extract_spool_max_bytes))
+        self._gz = gzip.GzipFile(fileobj=self._tmp, mode="wb", compresslevel=6)
+        self._offset = 0
+        self._write({"v": EXTRACT_FORMAT_VERSION, "sha256": sha256, "mime_type": mime_type})
+
+    def _write(self, row: dict[str, Any]) -> None:
+        self._gz.write(json.dumps(row, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n")
+
+    async def tee(self, sections: AsyncIterator[ExtractedSection]) -> AsyncIterator[ExtractedSection]:
+        async for sec in sections:
+            # offset是该段在整篇归一化文本里的起始字符位置，配合meta里的页码可以定位回原文
+            meta = dict(sec.meta or {})
+            meta["offset"] = self._offset
+            self._offset += len(sec.text)
+            self._write({"i": sec.index, "text": sec.text, "meta": meta})
+            yield sec
+
+    async def commit(self, storage: StorageBackend, *, key: str) -> int:
+        if not self.sha256:
+            self.close()
+            return 0
+        self._gz.close()
+        self._tmp.seek(0)
+        try:
+            # 从临时文件分块读出来流式上传，压缩后的整份文本也不会一次性读进内存
+            stored = await storage.put_stream(key=key, chunks=self._chunks(), content_type="application/gzip")
+        finally:
+            self.close()
+        return int(stored.size)
+
+    async def _chunks(self) -> AsyncIterator[bytes]:
+        while True:
+            b = await asyncio.to_thread(self._tmp.read, DEFAULT_STREAM_CHUNK_SIZE)  # 超过上限的部分已经落盘
+            if not b:
+                return
+            yield b
+
+    def close(self) -> None:
+        if not self._gz.closed:
+            self._gz.close()
+        self._tmp.close()
@@ -1,7 +1,23 @@
 from __future__ import annotations
 
 import hashlib
+from typing import Any
+
+from sqlalchemy import JSON, cast, func, literal, text
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.sql.elements import ColumnElement
 
 
 def sha256_bytes(data: bytes) -> str:
     return hashlib.sha256(data).hexdigest()
+
+
+def sha256_text(s: str) -> str:
+    return hashlib.sha256(str(s).encode("utf-8")).hexdigest()
+
+
+def json_merge(col: Any, patch: dict[str, Any] | ColumnElement[Any]) -> ColumnElement[Any]:
+    # JSON列在库里转成jsonb做顶层合并再转回来，不用先把整个meta读回应用
+    rhs = literal(patch, JSONB) if isinstance(patch, dict) else patch
+    merged = func.coalesce(cast(col, JSONB), text("'{}'::jsonb")).op("||", return_type=JSONB)(rhs)
+    return cast(merged, JSON)
@@ -17,6 +17,7 @@ class KBAsset(Base):
         Index("idx_kb_asset_ws_time", "workspace_id", "created_at"),
         Index("idx_kb_asset_status", "status"),
         Index("idx_kb_asset_creator", "created_by", "created_at"),
+        Index("idx_kb_asset_ws_sha256", "workspace_id", "sha256"),
         {"comment": "Knowledge base assets (documents/audio/video/images)"},
     )
 
@@ -54,6 +55,7 @@ class KBChunk(Base):
     __table_args__ = (
         UniqueConstraint("asset_id", "chunk_index", name="uq_kb_asset_chunk_index"),
         Index("idx_kb_chunk_asset", "asset_id"),
+        Index("idx_kb_chunk_embedding_ref", "embedding_ref"),
         {"comment": "Extracted chunks for retrieval"},
     )
 
@@ -62,6 +64,7 @@ class KBChunk(Base):
 
     chunk_index: Mapped[int] = mapped_column(Integer, nullable=False)
     text: Mapped[str] = mapped_column(Text, nullable=False)
+    content_hash: Mapped[str | None] = mapped_column(String(64), nullable=True)  # 文本的sha256，增量重建时按它判断chunk是否变化
     meta: Mapped[dict[str, Any] | None] = mapped_column(JSON, nullable=True)
 
     embedding_ref: Mapped[str | None] = mapped_column(String(128), nullable=True)  # 这个文本块在向量数据库中需要记录的一些信息
@@ -85,4 +88,25 @@ class KBIndexJob(Base):
 
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False, server_default=func.current_timestamp())
     started_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
-    finished_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
\ No newline at end of file
+    finished_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
+
+
+class KBBlobRef(Base):
+    __tablename__ = "kb_blob_refs"
+    __table_args__ = (
+        Index("idx_kb_blob_ref_gc", "ref_count", "updated_at"),
+        {"comment": "Content-addressed blobs shared by assets, keyed by sha256"},
+    )
+
+    sha256: Mapped[str] = mapped_column(String(64), primary_key=True)
+    storage_key: Mapped[str] = mapped_column(String(1024), nullable=False)
+    size_bytes: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    ref_count: Mapped[int] = mapped_column(Integer, nullable=False, server_default=text("0"))  # 引用它的未删除资产数，归零后由清理任务删掉
+
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False, server_default=func.current_timestamp())
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        nullable=False,
+        server_default=func.current_timestamp(),
+        onupdate=func.current_timestamp(),
+    )
@@ -0,0 +1,185 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import Any
+
+from elasticsearch import AsyncElasticsearch, NotFoundError
+from qdrant_client import AsyncQdrantClient
+from qdrant_client.http.exceptions import UnexpectedResponse
+from qdrant_client.models import FieldCondition, Filter, MatchAny, MatchValue
+from redis.asyncio import Redis
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.modules.kb.consts import ASSET_STATUS_READY
+from app.modules.kb.embeddings import encode_query
+from app.modules.kb.es_index import FIELD_ASSET_ID, FIELD_TEXT, FIELD_WORKSPACE_ID, workspace_alias, workspace_routing
+from app.modules.kb.models import KBAsset, KBChunk
+from app.modules.kb.vectors import PAYLOAD_ASSET_ID, PAYLOAD_WORKSPACE_ID, collection_name
+
+
+@dataclass(frozen=True)
+class SearchHit:
+    chunk_id: int
+    asset_id: int
+    chunk_index: int
+    text: str
+    score: float
+    vector_rank: int | None = None
+    lexical_rank: int | None = None
+    meta: dict[str, Any] | None = None
+
+
+def _ms(t0: float) -> float:
+    return round((time.perf_counter() - t0) * 1000.0, 3)
+
+
+async def _vector_search(
+    qdrant: AsyncQdrantClient,
+    *,
+    redis: Redis | None,
+    workspace_id: int,
+    query: str,
+    limit: int,
+    asset_ids: list[int] | None,
+    timings: dict[str, float],
+) -> list[str]:
+    t0 = time.perf_counter()
+    vec = await encode_query(query, redis=redis)
+    timings["embed_ms"] = _ms(t0)
+
+    must: list[Any] = [FieldCondition(key=PAYLOAD_WORKSPACE_ID, match=MatchValue(value=int(workspace_id)))]
+    if asset_ids:
+        must.append(FieldCondition(key=PAYLOAD_ASSET_ID, match=MatchAny(any=[int(x) for x in asset_ids])))
+    t1 = time.perf_counter()
+    try:
+        res = await qdrant.query_points(
+            collection_name=collection_name(),
+            query=vec,
+            query_filter=Filter(must=must),
+            limit=int(limit),
+            with_payload=False,
+        )
+        ids = [str(p.id) for p in res.points]
+    except UnexpectedResponse as e:
+        if e.status_code != 404:  # collection还没建（还没有任何入库的文档）
+            raise
+        ids = []
+    timings["vector_ms"] = _ms(t1)
+    return ids
+
+
+async def _lexical_search(
+    es: AsyncElasticsearch,
+    *,
+    workspace_id: int,
+    query: str,
+    limit: int,
+    asset_ids: list[int] | None,
+    timings: dict[str, float],
+) -> list[str]:
+    filters: list[dict[str, Any]] = [{"term": {FIELD_WORKSPACE_ID: int(workspace_id)}}]
+    if asset_ids:
+        filters.append({"terms": {FIELD_ASSET_ID: [int(x) for x in asset_ids]}})
+    t0 = time.perf_counter()
+    try:
+        res = await es.search(
+            index=workspace_alias(workspace_id),
+            routing=workspace_routing(workspace_id),
+            query={"bool": {"must": [{"match": {FIELD_TEXT: query}}], "filter": filters}},
+            size=int(limit),
+            source=False,
+        )
+        ids = [str(h["_id"]) for h in res["hits"]["hits"]]
+    except NotFoundError:  # 这个workspace还没有索引
+        ids = []
+    timings["lexical_ms"] = _ms(t0)
+    return ids
+
+
+def rrf_fuse(rankings: list[list[str]], *, k: int) -> dict[str, float]:
+    # reciprocal rank fusion：只看名次不看分数，两路打分尺度不同也能直接合并
+    scores: dict[str, float] = {}
+    for ranking in rankings:
+        for rank, rid in enumerate(ranking, start=1):
+            scores[rid] = scores.get(rid, 0.0) + 1.0 / (int(k) + rank)
+    return scores
+
+
+async def _hydrate(db: AsyncSession, *, workspace_id: int, refs: list[str]) -> dict[str, Any]:
+    if not refs:
+        return {}
+    rows = (
+        await db.execute(
+            select(KBChunk.id, KBChunk.asset_id, KBChunk.chunk_index, KBChunk.text, KBChunk.meta, KBChunk.embedding_ref)
+            .join(KBAsset, KBAsset.id == KBChunk.asset_id)
+            .where(
+                KBChunk.embedding_ref.in_(refs),
+                KBAsset.workspace_id == int(workspace_id),
+                KBAsset.status == ASSET_STATUS_READY,
+            )
+            .order_by(KBChunk.chunk_index)
+        )
+    ).all()
+    out: dict[str, Any] = {}
+    for r in rows:
+        out.setdefault(str(r.embedding_ref), r)  # 同一资产里文本完全相同的chunk共用一个point，取第一个
+    return out
+
+
+async def hybrid_search(
+    *,
+    db: AsyncSession,
+    qdrant: AsyncQdrantClient,
+    es: AsyncElasticsearch,
+    redis: Redis | None,
+    workspace_id: int,
+    query: str,
+    top_k: int,
+    asset_ids: list[int] | None = None,
+) -> tuple[list[SearchHit], dict[str, float]]:
+    t0 = time.perf_counter()
+    timings: dict[str, float] = {}
+    limit = max(int(top_k), int(top_k) * int(settings.kb_search_candidate_multiplier))
+
+    # 向量和关键词两路并发，耗时取决于较慢的一路而不是两者之和
+    vec_ids, lex_ids = await asyncio.gather(
+        _vector_search(qdrant, redis=redis, workspace_id=workspace_id, query=query, limit=limit, asset_ids=asset_ids, timings=timings),
+        _lexical_search(es, workspace_id=workspace_id, query=query, limit=limit, asset_ids=asset_ids, timings=timings),
+    )
+
+    t1 = time.perf_counter()
+    scores = rrf_fuse([vec_ids, lex_ids], k=int(settings.kb_search_rrf_k))
+    vec_rank = {rid: i for i, rid in enumerate(vec_ids, start=1)}
+    lex_rank = {rid: i for i, rid in enumerate(lex_ids, start=1)}
+    ranked = sorted(scores.items(), key=lambda kv: kv[1], reverse=True)
+    timings["fuse_ms"] = _ms(t1)
+
+    t2 = time.perf_counter()
+    # 多取一些候选去回表，被删除或不属于当前workspace的会在这里被过滤掉
+    rows = await _hydrate(db, workspace_id=workspace_id, refs=[rid for rid, _ in ranked[:limit]])
+    hits: list[SearchHit] = []
+    for rid, score in ranked:
+        r = rows.get(rid)
+        if r is None:
+            continue
+        hits.append(
+            SearchHit(
+                chunk_id=int(r.id),
+                asset_id=int(r.asset_id),
+                chunk_index=int(r.chunk_index),
+                text=str(r.text),
+                score=float(score),
+                vector_rank=vec_rank.get(rid),
+                lexical_rank=lex_rank.get(rid),
+                meta=r.meta,
+            )
+        )
+        if len(hits) >= int(top_k):
+            break
+    timings["hydrate_ms"] = _ms(t2)
+    timings["total_ms"] = _ms(t0)
+    return hits, timings
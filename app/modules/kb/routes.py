@@ -0,0 +1,232 @@
+from __future__ import annotations
+
+from elasticsearch import AsyncElasticsearch
+from fastapi import APIRouter, Depends, Query, Request
+from fastapi.responses import FileResponse, StreamingResponse
+from qdrant_client import AsyncQdrantClient
+from redis.asyncio import Redis
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.api_response import ok
+from app.core.api_schemas import ApiResponse
+from app.core.errors import raise_err
+from app.infra.blob_storage.deps import get_storage
+from app.infra.blob_storage.interface import StorageBackend
+from app.infra.db.deps import get_db
+from app.infra.elasticsearch_client import get_es
+from app.infra.qdrant_client import get_qdrant
+from app.infra.redis_client import get_redis
+from app.modules.audit.service import record
+from app.modules.auth.models import User
+from app.modules.authz.deps import permission_required
+from app.modules.authz.scope_keys import scope_global, scope_workspace
+from app.modules.kb.ingestion.dead_letter import list_dead
+from app.modules.kb.ingestion.metrics import read_histograms
+from app.modules.kb.ingestion.progress import ProgressHub, get_progress_hub, sse_events
+from app.modules.kb.ingestion.slots import all_slot_usage, slot_usage
+from app.modules.kb.models import KBAsset
+from app.modules.kb.retrieval import hybrid_search
+from app.modules.kb.service import get_asset, upload_asset
+from app.modules.kb.schemas import (
+    AssetResp,
+    IngestDeadLetterListResp,
+    IngestDeadLetterRow,
+    IngestMetricsResp,
+    IngestSlotsListResp,
+    IngestSlotsResp,
+    IngestStageMetrics,
+    SearchHitRow,
+    SearchReq,
+    SearchResp,
+)
+
+router = APIRouter(prefix="/kb", tags=["kb"])
+
+
+def _workspace_id(request: Request) -> int:
+    wid = getattr(request.state, "workspace_id", None)  # TenantContextMiddleware从header/query/path里解析出来的
+    if not wid:
+        raise_err("kb.workspace_required")
+    return int(wid)
+
+
+def _workspace_scope(request: Request) -> str:
+    return scope_workspace(_workspace_id(request))
+
+
+def _global_scope(_request: Request) -> str:
+    return scope_global()
+
+
+DocReader = permission_required("doc.read", scope_builder=_workspace_scope)
+DocWriter = permission_required("doc.write", scope_builder=_workspace_scope)
+WorkspaceManager = permission_required("workspace.manage", scope_builder=_workspace_scope)
+GlobalManager = permission_required("workspace.manage", scope_builder=_global_scope)
+
+
+@router.post("/search", response_model=ApiResponse[SearchResp])
+async def search(
+        req: SearchReq,
+        request: Request,
+        me: User = Depends(DocReader),
+        db: AsyncSession = Depends(get_db),
+        qdrant: AsyncQdrantClient = Depends(get_qdrant),
+        es: AsyncElasticsearch = Depends(get_es),
+        redis: Redis = Depends(get_redis),
+):
+    wid = _workspace_id(request)
+    hits, timings = await hybrid_search(
+        db=db,
+        qdrant=qdrant,
+        es=es,
+        redis=redis,
+        workspace_id=wid,
+        query=req.query,
+        top_k=req.top_k,
+        asset_ids=req.asset_ids,
+    )
+
+    record(
+        action="kb.search",
+        status="ok",
+        scope_key=scope_workspace(wid),
+        meta={"top_k": int(req.top_k), "count": len(hits), "total_ms": timings.get("total_ms"), "actor_user_id": int(me.id)},
+    )
+
+    items = [
+        SearchHitRow(
+            chunk_id=h.chunk_id,
+            asset_id=h.asset_id,
+            chunk_index=h.chunk_index,
+            text=h.text,
+            score=h.score,
+            vector_rank=h.vector_rank,
+            lexical_rank=h.lexical_rank,
+            meta=h.meta,
+        )
+        for h in hits
+    ]
+    return ok(SearchResp(items=items), meta={"timings_ms": timings})
+
+
+def _asset_resp(a: KBAsset, *, queue: str | None = None) -> AssetResp:
+    return AssetResp(
+        id=int(a.id),
+        workspace_id=int(a.workspace_id),
+        project_id=a.project_id,
+        filename=a.filename,
+        title=a.title,
+        mime_type=a.mime_type,
+        size_bytes=a.size_bytes,
+        sha256=a.sha256,
+        status=a.status,
+        queue=queue,
+    )
+
+
+@router.post("/assets", response_model=ApiResponse[AssetResp])
+async def upload(
+        request: Request,
+        filename: str = Query(min_length=1, max_length=512),
+        title: str | None = Query(default=None, max_length=512),
+        project_id: int | None = Query(default=None),
+        me: User = Depends(DocWriter),
+        db: AsyncSession = Depends(get_db),
+        storage: StorageBackend = Depends(get_storage),
+):
+    # 请求体就是文件原始内容（不走multipart），Content-Type当作mime提示
+    wid = _workspace_id(request)
+    ct = (request.headers.get("content-type") or "").split(";", 1)[0].strip() or None
+    a, queue = await upload_asset(
+        db,
+        storage,
+        workspace_id=wid,
+        project_id=project_id,
+        created_by=int(me.id),
+        filename=filename,
+        title=title,
+        mime_type=None if ct == "application/octet-stream" else ct,
+        chunks=request.stream(),
+    )
+    record(
+        action="kb.asset_upload",
+        status="ok",
+        scope_key=scope_workspace(wid),
+        meta={"asset_id": int(a.id), "size_bytes": int(a.size_bytes or 0), "queue": queue, "actor_user_id": int(me.id)},
+    )
+    return ok(_asset_resp(a, queue=queue))
+
+
+@router.get("/assets/{asset_id}/content")
+async def download(
+        asset_id: int,
+        request: Request,
+        me: User = Depends(DocReader),
+        db: AsyncSession = Depends(get_db),
+        storage: StorageBackend = Depends(get_storage),
+):
+    a = await get_asset(db, workspace_id=_workspace_id(request), asset_id=asset_id)
+    if not a.storage_key:
+        raise_err("kb.asset_not_found")
+    media_type = a.mime_type or "application/octet-stream"
+    path = storage.local_path(key=a.storage_key)
+    if path is not None:
+        # 本地盘交给FileResponse：服务器支持pathsend时走sendfile零拷贝，另外自带Range/断点续传
+        return FileResponse(path, media_type=media_type, filename=a.filename)
+    return StreamingResponse(
+        storage.open_stream(key=a.storage_key),
+        media_type=media_type,
+        headers={"Content-Length": str(int(a.size_bytes))} if a.size_bytes is not None else None,
+    )
+
+
+@router.get("/ingest/slots", response_model=ApiResponse[IngestSlotsResp])
+async def ingest_slots(
+        request: Request,
+        me: User = Depends(WorkspaceManager),
+        redis: Redis = Depends(get_redis),
+):
+    # 当前workspace正在占用的入库槽位，用来观察公平调度是否生效
+    return ok(IngestSlotsResp(**await slot_usage(redis, workspace_id=_workspace_id(request))))
+
+
+@router.get("/ingest/slots/all", response_model=ApiResponse[IngestSlotsListResp])
+async def ingest_slots_all(
+        me: User = Depends(GlobalManager),
+        redis: Redis = Depends(get_redis),
+):
+    return ok(IngestSlotsListResp(items=[IngestSlotsResp(**u) for u in await all_slot_usage(redis)]))
+
+
+@router.get("/ingest/metrics", response_model=ApiResponse[IngestMetricsResp])
+async def ingest_metrics(
+        me: User = Depends(GlobalManager),
+        redis: Redis = Depends(get_redis),
+):
+    # 各阶段按文件类型聚合的耗时直方图和吞吐，单个job的明细在job的meta.metrics里
+    return ok(IngestMetricsResp(items=[IngestStageMetrics(**r) for r in await read_histograms(redis)]))
+
+
+@router.get("/ingest/dead", response_model=ApiResponse[IngestDeadLetterListResp])
+async def ingest_dead_letters(
+        limit: int = Query(default=100, ge=1, le=1000),
+        me: User = Depends(GlobalManager),
+        redis: Redis = Depends(get_redis),
+):
+    # 最终失败的入库任务，按失败时间倒序；资产重新处理成功后会自动移出
+    return ok(IngestDeadLetterListResp(items=[IngestDeadLetterRow(**r) for r in await list_dead(redis, limit=limit)]))
+
+
+@router.get("/ingest/events")
+async def ingest_events(
+        request: Request,
+        asset_id: int | None = Query(default=None),
+        me: User = Depends(DocReader),
+        hub: ProgressHub = Depends(get_progress_hub),
+):
+    # SSE推送当前workspace的入库进度，前端不用再轮询资产和job表；asset_id只看单个文件
+    return StreamingResponse(
+        sse_events(hub, workspace_id=_workspace_id(request), asset_id=asset_id, is_disconnected=request.is_disconnected),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -0,0 +1,92 @@
+from __future__ import annotations
+
+from typing import Any
+
+from pydantic import BaseModel, Field
+
+
+class SearchReq(BaseModel):
+    query: str = Field(min_length=1, max_length=2000)
+    top_k: int = Field(default=10, ge=1, le=50)
+    asset_ids: list[int] | None = Field(default=None, max_length=100)  # 只在这些资产里检索
+
+
+class SearchHitRow(BaseModel):
+    chunk_id: int
+    asset_id: int
+    chunk_index: int
+    text: str
+    score: float  # RRF融合后的分数
+    vector_rank: int | None = None  # 在向量检索结果里的名次，没命中为空
+    lexical_rank: int | None = None  # 在关键词检索结果里的名次，没命中为空
+    meta: dict[str, Any] | None = None
+
+
+class SearchResp(BaseModel):
+    items: list[SearchHitRow]
+
+
+class AssetResp(BaseModel):
+    id: int
+    workspace_id: int
+    project_id: int | None = None
+    filename: str
+    title: str | None = None
+    mime_type: str | None = None
+    size_bytes: int | None = None
+    sha256: str | None = None
+    status: str
+    queue: str | None = None  # 上传后投递到的入库队列
+
+
+class IngestSlotLease(BaseModel):
+    member: str  # 占用槽位的asset_id
+    expires_at_ms: int  # 租约到期时间，worker正常运行时会持续续租
+
+
+class IngestSlotsResp(BaseModel):
+    workspace_id: int
+    in_flight: int
+    limit: int  # 0表示不限制
+    leases: list[IngestSlotLease]
+
+
+class IngestSlotsListResp(BaseModel):
+    items: list[IngestSlotsResp]
+
+
+class IngestMetricsBucket(BaseModel):
+    le: str  # 桶上限（毫秒），"+Inf"兜底
+    count: int  # 累计计数
+
+
+class IngestStageMetrics(BaseModel):
+    stage: str
+    kind: str  # 文件的mime类型
+    count: int
+    wall_ms_sum: float
+    cpu_ms_sum: float
+    bytes_sum: int
+    chunks_sum: int
+    bytes_per_s: float | None = None
+    p50_ms: float | None = None  # 由直方图估算，只精确到桶上限
+    p95_ms: float | None = None
+    buckets: list[IngestMetricsBucket]
+
+
+class IngestMetricsResp(BaseModel):
+    items: list[IngestStageMetrics]
+
+
+class IngestDeadLetterRow(BaseModel):
+    asset_id: int
+    job_id: int
+    attempt: int
+    error: str
+    error_type: str
+    transient: bool  # 临时错误重试次数用完；False表示文件本身有问题，重投也没用
+    failed_at: int
+
+
+class IngestDeadLetterListResp(BaseModel):
+    items: list[IngestDeadLetterRow]
@@ -1,22 +1,23 @@
 from __future__ import annotations
 
-import hashlib
-from typing import Any
+from dataclasses import replace
+from typing import Any, AsyncIterator
 
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.core.config import settings
 from app.core.errors import raise_err
+from app.infra.blob_storage.interface import StorageBackend, StoredObject
+from app.modules.kb import blob_refs
 from app.modules.kb.consts import (
     ASSET_STATUS_DELETED,
     ASSET_STATUS_PENDING,
     ASSET_STATUS_UPLOADED,
 )
+from app.modules.kb.ingestion.dispatch import enqueue_ingest
 from app.modules.kb.models import KBAsset
-
-
-def _sha256(data: bytes) -> str:
-    return hashlib.sha256(data).hexdigest()
+from app.modules.kb.storage_keys import asset_staging_key, blob_content_key
 
 
 async def create_asset(
@@ -40,10 +41,11 @@ async def create_asset(
         status=ASSET_STATUS_PENDING,
         meta=dict(meta) if meta is not None else None,
     )
-    async with db.begin():
-        db.add(a)
-        await db.flush()
-        await db.refresh(a)
+    # 请求里的session在鉴权时已经自动开了事务，这里直接在里面写再提交，不能再db.begin()
+    db.add(a)
+    await db.flush()
+    await db.refresh(a)
+    await db.commit()
     return a
 
 
@@ -51,34 +53,108 @@ async def mark_uploaded(
     db: AsyncSession,
     *,
     asset_id: int,
-    storage_key: str,
-    size_bytes: int,
-    sha256: str,
+    stored: StoredObject,
 ) -> KBAsset:
+    # 大小和摘要都取存储写入时算好的结果，上传路径上只哈希一遍
     a = (await db.execute(select(KBAsset).where(KBAsset.id == int(asset_id)))).scalar_one_or_none()
     if not a or a.status == ASSET_STATUS_DELETED:
+        await db.rollback()
         raise_err("error.http", http_status=404, message="asset_not_found")
-    async with db.begin():
-        a.storage_key = str(storage_key)
-        a.size_bytes = int(size_bytes)
-        a.sha256 = str(sha256)
-        a.status = ASSET_STATUS_UPLOADED
-        await db.flush()
-        await db.refresh(a)
+    a.storage_key = str(stored.key)
+    a.size_bytes = int(stored.size)
+    a.sha256 = str(stored.sha256) if stored.sha256 else None
+    a.status = ASSET_STATUS_UPLOADED
+    await db.flush()
+    await db.refresh(a)
+    await db.commit()
     return a
 
 
 async def soft_delete_asset(db: AsyncSession, *, asset_id: int) -> None:
     a = (await db.execute(select(KBAsset).where(KBAsset.id == int(asset_id)))).scalar_one_or_none()
     if not a or a.status == ASSET_STATUS_DELETED:
+        await db.rollback()
         return
-    async with db.begin():
-        a.status = ASSET_STATUS_DELETED
-        await db.flush()
-
+    a.status = ASSET_STATUS_DELETED
+    if a.sha256 and a.storage_key == blob_content_key(sha256=a.sha256):  # 老的按资产存放的文件不参与引用计数
+        await blob_refs.release(db, sha256=a.sha256)
+    await db.commit()
+
+
+async def get_asset(db: AsyncSession, *, workspace_id: int, asset_id: int) -> KBAsset:
+    a = (
+        await db.execute(
+            select(KBAsset).where(
+                KBAsset.id == int(asset_id),
+                KBAsset.workspace_id == int(workspace_id),
+                KBAsset.status != ASSET_STATUS_DELETED,
+            )
+        )
+    ).scalar_one_or_none()
+    if a is None:
+        raise_err("kb.asset_not_found")
+    return a
 
-async def compute_upload_digest(data: bytes) -> tuple[int, str]:
-    return (len(data), _sha256(data))
 
+async def _limited(chunks: AsyncIterator[bytes], max_bytes: int) -> AsyncIterator[bytes]:
+    n = 0
+    async for b in chunks:
+        n += len(b)
+        if n > max_bytes:  # 超限立刻中断，不把剩下的内容读完
+            raise_err("kb.upload_too_large", meta={"max_bytes": int(max_bytes)})
+        yield b
 
 
+async def upload_asset(
+    db: AsyncSession,
+    storage: StorageBackend,
+    *,
+    workspace_id: int,
+    project_id: int | None,
+    created_by: int,
+    filename: str,
+    chunks: AsyncIterator[bytes],
+    mime_type: str | None = None,
+    title: str | None = None,
+) -> tuple[KBAsset, str]:
+    # 请求体按块直接写进暂存位置，不在内存里攒整个文件；写失败的资产标记删除。
+    # 写完按sha256挪到内容寻址的位置，同样的内容已经有了就丢掉暂存的这份，只加引用计数
+    a = await create_asset(
+        db,
+        workspace_id=workspace_id,
+        project_id=project_id,
+        created_by=created_by,
+        filename=filename,
+        mime_type=mime_type,
+        title=title,
+    )
+    staging = asset_staging_key(workspace_id=int(a.workspace_id), asset_id=int(a.id))
+    try:
+        stored = await storage.put_stream(key=staging, chunks=_limited(chunks, int(settings.kb_upload_max_bytes)), content_type=mime_type)
+        if stored.size <= 0 or not stored.sha256:
+            await storage.delete(key=staging)
+            raise_err("kb.upload_empty")
+    except Exception:
+        await db.rollback()
+        await soft_delete_asset(db, asset_id=int(a.id))
+        raise
+    stored = replace(stored, key=blob_content_key(sha256=stored.sha256))
+    # 先占引用再放内容：引用数大于0的内容不会被清理任务删掉
+    await blob_refs.acquire(db, sha256=stored.sha256, storage_key=stored.key, size_bytes=stored.size)
+    await db.commit()
+    try:
+        if await storage.exists(key=stored.key):
+            await storage.delete(key=staging)
+        else:
+            await storage.move(src=staging, dst=stored.key)
+        a = await mark_uploaded(db, asset_id=int(a.id), stored=stored)
+    except Exception:
+        await db.rollback()
+        await blob_refs.release(db, sha256=stored.sha256)
+        await db.commit()
+        await soft_delete_asset(db, asset_id=int(a.id))
+        await storage.delete(key=staging)
+        raise
+    queue = await enqueue_ingest(a, db=db)
+    await db.commit()
+    return a, queue
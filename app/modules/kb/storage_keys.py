@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import hashlib
+import uuid
 
 
 def _h(s: str) -> str:
@@ -13,6 +14,19 @@ def asset_original_key(*, workspace_id: int, asset_id: int, filename: str) -> st
     return f"kb/ws/{int(workspace_id)}/assets/{int(asset_id)}/original/{salt}/{fn}"
 
 
+def asset_staging_key(*, workspace_id: int, asset_id: int) -> str:
+    # 上传时先写这里，算出sha256后再挪到内容寻址的位置
+    return f"kb/ws/{int(workspace_id)}/assets/{int(asset_id)}/staging/{uuid.uuid4().hex}"
+
+
+def blob_content_key(*, sha256: str) -> str:
+    # 全局按内容寻址：内容相同的文件不管哪个workspace上传都只存一份
+    h = str(sha256).strip().lower()
+    if len(h) != 64 or any(c not in "0123456789abcdef" for c in h):
+        raise ValueError("bad_sha256")
+    return f"kb/cas/sha256/{h[:2]}/{h[2:4]}/{h}"
+
+
 def asset_derivative_key(*, workspace_id: int, asset_id: int, name: str) -> str:
     nm = str(name or "").strip() or "derivative"
     salt = _h(f"{int(workspace_id)}:{int(asset_id)}:{nm}")[:16]
@@ -0,0 +1,50 @@
+from __future__ import annotations
+
+import uuid
+
+from qdrant_client import AsyncQdrantClient
+from qdrant_client.models import Distance, PayloadSchemaType, PointIdsList, VectorParams
+
+from app.core.config import settings
+
+_POINT_NS = uuid.UUID("2ce529dc-aa90-4b16-94ab-5b8ea56ef61d")
+
+PAYLOAD_WORKSPACE_ID = "workspace_id"
+PAYLOAD_ASSET_ID = "asset_id"
+
+_DELETE_BATCH = 1000
+
+_ensured: set[str] = set()
+
+
+def collection_name() -> str:
+    return str(settings.qdrant_collection)
+
+
+def chunk_point_id(*, asset_id: int, content_hash: str) -> str:
+    # point id由资产和文本内容决定：同一资产里内容没变的chunk，重跑时落在同一个point上
+    return str(uuid.uuid5(_POINT_NS, f"{int(asset_id)}:{content_hash}"))
+
+
+async def ensure_collection(client: AsyncQdrantClient, *, dim: int) -> str:
+    name = collection_name()
+    if name in _ensured:
+        return name
+    if not await client.collection_exists(name):
+        await client.create_collection(
+            collection_name=name,
+            vectors_config=VectorParams(size=int(dim), distance=Distance.COSINE),
+        )
+        await client.create_payload_index(name, field_name=PAYLOAD_WORKSPACE_ID, field_schema=PayloadSchemaType.INTEGER)
+        await client.create_payload_index(name, field_name=PAYLOAD_ASSET_ID, field_schema=PayloadSchemaType.INTEGER)
+    _ensured.add(name)
+    return name
+
+
+async def delete_points(client: AsyncQdrantClient, ids: list[str]) -> int:
+    name = collection_name()
+    if not ids or not await client.collection_exists(name):
+        return 0
+    for i in range(0, len(ids), _DELETE_BATCH):
+        await client.delete(collection_name=name, points_selector=PointIdsList(points=list(ids[i:i + _DELETE_BATCH])), wait=True)
+    return len(ids)
@@ -1,5 +1,7 @@
 from __future__ import annotations
 
+import os
+
 from redis.asyncio import Redis
 
 from app.core.config import settings
@@ -8,7 +10,7 @@ from app.infra.db.engine import create_engine
 from app.infra.db.session import create_session_maker
 from app.infra.elasticsearch_client import create_es_client
 from app.infra.qdrant_client import create_qdrant_client
-from app.infra.blob_storage.local_fs import LocalFSStorage
+from app.infra.blob_storage.factory import create_storage
 
 
 class WorkerState:
@@ -26,12 +28,20 @@ class WorkerState:
         )
         self.es = create_es_client()
         self.qdrant = create_qdrant_client()
-        self.storage = LocalFSStorage(root_dir=str(settings.blob_local_root))
+        self.storage = create_storage(read_cache=True)
 
 
 _state: WorkerState | None = None
 
 
+def _reset_state_after_fork() -> None:
+    global _state
+    _state = None  # 连接池里的socket不能跨进程共享，子进程里按需重建
+
+
+os.register_at_fork(after_in_child=_reset_state_after_fork)
+
+
 def get_state() -> WorkerState:  # 返回上面这些组件的状态
     global _state
     if _state is None:
@@ -0,0 +1,124 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import signal
+
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from app.core.config import settings
+from app.modules.kb.embeddings import shutdown_pool
+from app.modules.kb.ingestion.pg_queue import PG_QUEUE_CHANNEL, ClaimedJob, claim, close_stale, extend_leases, requeue
+from app.modules.kb.ingestion.pipeline import run_ingestion_fair
+from app.modules.kb.ingestion.retry import backoff_seconds, is_transient
+from app.modules.kb.ingestion.slots import defer_seconds
+from app.workers.main import WorkerState, get_state
+
+logger = logging.getLogger(__name__)
+
+# KB_INGEST_BACKEND=pg时的入库worker，不经过RabbitMQ：
+#   python -m app.workers.pg_worker
+# 多开几个进程就能横向扩展，每个进程一次认领一批job，互相之间靠SKIP LOCKED错开。
+
+
+async def _run_job(st: WorkerState, job: ClaimedJob) -> None:
+    final = job.retries >= int(settings.kb_ingest_max_retries)
+    error = "superseded"
+    try:
+        ran = await run_ingestion_fair(
+            session_maker=st.db_session_maker,
+            storage=st.storage,
+            qdrant=st.qdrant,
+            es=st.es,
+            redis=st.redis,
+            asset_id=job.asset_id,
+            workspace_id=job.workspace_id,
+            final_attempt=final,
+        )
+    except Exception as e:
+        if is_transient(e) and not final:
+            await requeue(st.db_session_maker, job_id=job.job_id, delay_seconds=backoff_seconds(job.retries), retry=True)
+            return
+        logger.error("kb_pg_queue_job_failed", exc_info=True, extra={"job_id": job.job_id, "asset_id": job.asset_id})
+        error, ran = str(e), True
+    if not ran:  # workspace槽位满了，放回队列稍后再取
+        await requeue(st.db_session_maker, job_id=job.job_id, delay_seconds=defer_seconds(), retry=False)
+        return
+    await close_stale(st.db_session_maker, job_id=job.job_id, error=error)
+
+
+async def _listen(engine: AsyncEngine, wake: asyncio.Event) -> AsyncConnection | None:
+    # 入队时会pg_notify，收到就立刻去认领；连不上LISTEN就退回纯轮询
+    try:
+        conn = await engine.connect()
+        raw = await conn.get_raw_connection()
+        await raw.driver_connection.add_listener(PG_QUEUE_CHANNEL, lambda *_: wake.set())
+        return conn
+    except Exception:
+        logger.warning("kb_pg_queue_listen_failed", exc_info=True)
+        return None
+
+
+async def _heartbeat(st: WorkerState, inflight: dict[int, asyncio.Task[None]]) -> None:
+    interval = max(1.0, float(settings.kb_pg_queue_lease_seconds) / 3.0)
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await extend_leases(st.db_session_maker, job_ids=list(inflight))
+        except Exception:
+            logger.warning("kb_pg_queue_heartbeat_failed", exc_info=True)
+
+
+async def serve(stop: asyncio.Event) -> None:
+    st = get_state()
+    cap = max(1, int(settings.kb_ingest_batch_concurrency))
+    batch = max(1, int(settings.kb_pg_queue_batch_size))
+    inflight: dict[int, asyncio.Task[None]] = {}
+    wake = asyncio.Event()
+    listener = await _listen(st.db_engine, wake)
+    hb = asyncio.create_task(_heartbeat(st, inflight))
+
+    def _done(job_id: int) -> None:
+        inflight.pop(job_id, None)
+        wake.set()
+
+    try:
+        while not stop.is_set():
+            wake.clear()
+            want = min(batch, cap - len(inflight))
+            jobs: list[ClaimedJob] = []
+            if want > 0:
+                try:
+                    jobs = await claim(st.db_session_maker, limit=want)
+                except Exception:
+                    logger.warning("kb_pg_queue_claim_failed", exc_info=True)
+            for job in jobs:
+                t = asyncio.create_task(_run_job(st, job))
+                inflight[job.job_id] = t
+                t.add_done_callback(lambda _t, k=job.job_id: _done(k))
+            if jobs and len(jobs) == want:  # 取满了说明还有积压，不等通知直接再取
+                continue
+            stop_wait = asyncio.create_task(stop.wait())
+            wake_wait = asyncio.create_task(wake.wait())
+            await asyncio.wait({stop_wait, wake_wait}, timeout=float(settings.kb_pg_queue_poll_seconds), return_when=asyncio.FIRST_COMPLETED)
+            stop_wait.cancel()
+            wake_wait.cancel()
+    finally:
+        # 手上的job跑完再退出；被强杀的话租约过期后会被别的worker接走
+        await asyncio.gather(*inflight.values(), return_exceptions=True)
+        hb.cancel()
+        if listener is not None:
+            await listener.close()
+        shutdown_pool()
+
+
+async def main() -> None:
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    await serve(stop)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
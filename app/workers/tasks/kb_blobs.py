@@ -0,0 +1,20 @@
+from __future__ import annotations
+
+from app.core.config import settings
+from app.infra.celery.celery_app import celery_app
+from app.modules.kb.blob_refs import sweep
+from app.workers.main import get_state
+from app.workers.utils import run_async
+
+
+@celery_app.task(name="kb.sweep_blobs")
+def sweep_blobs() -> dict:
+    # 由celery beat定时触发：删掉引用数归零且过了宽限期的内容寻址文件
+    st = get_state()
+    n = run_async(sweep(
+        st.db_session_maker,
+        st.storage,
+        grace_seconds=int(settings.kb_blob_gc_grace_seconds),
+        limit=int(settings.kb_blob_gc_batch_size),
+    ))
+    return {"deleted": int(n)}
@@ -1,13 +1,136 @@
 from __future__ import annotations
 
+from typing import Any
+
+from app.core.config import settings
 from app.infra.celery.celery_app import celery_app
-from app.modules.kb.ingestion.pipeline import run_ingestion
+from app.modules.kb.ingestion.dispatch import dispatch_pdf_parts
+from app.modules.kb.ingestion.fanout import run_part
+from app.modules.kb.ingestion.pipeline import fail_fanout, finish_fanout, run_ingestion_batch, run_ingestion_fair
+from app.modules.kb.ingestion.retry import backoff_seconds, is_transient
+from app.modules.kb.ingestion.slots import defer_seconds
 from app.workers.main import get_state
 from app.workers.utils import run_async
 
 
-@celery_app.task(name="kb.ingest_asset")
-def ingest_asset(asset_id: int) -> dict:
+def _defer(task: Any, *, args: list[Any], kwargs: dict[str, Any] | None = None) -> None:
+    # workspace槽位已满：原样投回当前队列，稍后再试，不算失败也不占重试次数
+    queue = (task.request.delivery_info or {}).get("routing_key")
+    task.apply_async(args=args, kwargs=kwargs or {}, countdown=defer_seconds(), queue=queue)
+
+
+def _final_attempt(task: Any) -> bool:
+    return int(task.request.retries) >= int(task.max_retries)
+
+
+# acks_late：worker在处理中途挂掉时消息会被重投，重复投递由pipeline里的幂等key挡住
+@celery_app.task(name="kb.ingest_asset", bind=True, acks_late=True, max_retries=settings.kb_ingest_max_retries)
+def ingest_asset(self, asset_id: int, workspace_id: int | None = None, sha256: str | None = None) -> dict:
+    st = get_state()
+    try:
+        ran = run_async(run_ingestion_fair(
+            session_maker=st.db_session_maker,
+            storage=st.storage,
+            qdrant=st.qdrant,
+            es=st.es,
+            redis=st.redis,
+            asset_id=int(asset_id),
+            workspace_id=workspace_id,
+            sha256=sha256,
+            token=self.request.id,
+            final_attempt=_final_attempt(self),
+            fanout=dispatch_pdf_parts,
+        ))
+    except Exception as e:
+        if is_transient(e) and not _final_attempt(self):
+            raise self.retry(exc=e, countdown=backoff_seconds(self.request.retries))
+        raise
+    if not ran:
+        _defer(self, args=[int(asset_id)], kwargs={"workspace_id": workspace_id, "sha256": sha256})
+    return {"ok": True, "asset_id": int(asset_id), "deferred": not ran}
+
+
+@celery_app.task(name="kb.ingest_assets", bind=True, acks_late=True, max_retries=settings.kb_ingest_max_retries)
+def ingest_assets(self, asset_ids: list[int]) -> dict:
+    # 批量回填用：整批在进程级事件循环上跑，连接池只建一次。
+    # 只通过dispatch.enqueue_ingest_many发送，它按资产大小和类型分好了队列；直接send_task会全部落到kb.small
+    st = get_state()
+    try:
+        out = run_async(run_ingestion_batch(
+            session_maker=st.db_session_maker,
+            storage=st.storage,
+            qdrant=st.qdrant,
+            es=st.es,
+            redis=st.redis,
+            asset_ids=[int(x) for x in asset_ids],
+            token=self.request.id,
+            final_attempt=_final_attempt(self),
+            fanout=dispatch_pdf_parts,
+        ))
+    except Exception as e:
+        if is_transient(e) and not _final_attempt(self):
+            raise self.retry(exc=e, countdown=backoff_seconds(self.request.retries))
+        raise
+    if out["deferred"]:
+        _defer(self, args=[out["deferred"]])
+    if out["retry"]:
+        if not _final_attempt(self):  # 只重试这一批里遇到临时错误的资产
+            raise self.retry(args=[out["retry"]], countdown=backoff_seconds(self.request.retries))
+        out["failed"] = out["failed"] + out["retry"]
+    return {"ok": not out["failed"], **out}
+
+
+@celery_app.task(name="kb.ingest_pdf_part", bind=True, acks_late=True, max_retries=settings.kb_ingest_max_retries)
+def ingest_pdf_part(self, asset_id: int, job_id: int, part: int, start: int, end: int, mime_type: str | None = None) -> dict:
+    # 大PDF拆分出来的一段：抽取、切块、编码，chunk写在这一段的暂存序号里
+    st = get_state()
+    try:
+        return run_async(run_part(
+            session_maker=st.db_session_maker,
+            storage=st.storage,
+            qdrant=st.qdrant,
+            redis=st.redis,
+            asset_id=int(asset_id),
+            job_id=int(job_id),
+            part=int(part),
+            pages=(int(start), int(end)),
+            mime_type=mime_type,
+        ))
+    except Exception as e:
+        transient = is_transient(e)
+        if transient and not _final_attempt(self):
+            raise self.retry(exc=e, countdown=backoff_seconds(self.request.retries))
+        # 有一段最终失败chord就不会回调合并，在这里把整份文档标记失败
+        run_async(fail_fanout(
+            session_maker=st.db_session_maker,
+            qdrant=st.qdrant,
+            redis=st.redis,
+            asset_id=int(asset_id),
+            job_id=int(job_id),
+            error=str(e),
+            error_type=type(e).__name__,
+            transient=transient,
+        ))
+        raise
+
+
+@celery_app.task(name="kb.ingest_pdf_merge", bind=True, acks_late=True, max_retries=settings.kb_ingest_max_retries)
+def ingest_pdf_merge(self, parts: list[dict], asset_id: int, job_id: int) -> dict:
     st = get_state()
-    run_async(run_ingestion(session_maker=st.db_session_maker, asset_id=int(asset_id)))
-    return {"ok": True, "asset_id": int(asset_id)}
\ No newline at end of file
+    try:
+        ready = run_async(finish_fanout(
+            session_maker=st.db_session_maker,
+            storage=st.storage,
+            qdrant=st.qdrant,
+            es=st.es,
+            redis=st.redis,
+            asset_id=int(asset_id),
+            job_id=int(job_id),
+            parts=parts,
+            final_attempt=_final_attempt(self),
+        ))
+    except Exception as e:
+        if is_transient(e) and not _final_attempt(self):
+            raise self.retry(exc=e, countdown=backoff_seconds(self.request.retries))
+        raise
+    return {"ok": True, "asset_id": int(asset_id), "parts": len(parts), "ready": ready}
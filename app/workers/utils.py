@@ -1,8 +1,29 @@
 from __future__ import annotations
 
 import asyncio
+import os
 from typing import Any, Awaitable
 
+_loop: asyncio.AbstractEventLoop | None = None
+
+
+def _reset_loop_after_fork() -> None:
+    global _loop
+    _loop = None  # 父进程的事件循环（selector、线程池）在fork出来的子进程里不能用
+
+
+os.register_at_fork(after_in_child=_reset_loop_after_fork)
+
+
+def worker_loop() -> asyncio.AbstractEventLoop:
+    # 每个worker进程只有一个长期存在的事件循环，绑定在它上面的asyncpg连接池、http客户端可以跨任务复用
+    global _loop
+    if _loop is None or _loop.is_closed():
+        _loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(_loop)
+    return _loop
+
+
 # 这个工具类一般用在celery框架的里面
 def run_async(coro: Awaitable[Any]) -> Any:  # 这是一个异步任务的工具函数
     try:
@@ -11,4 +32,4 @@ def run_async(coro: Awaitable[Any]) -> Any:  # 这是一个异步任务的工具
         loop = None  # 如果没有，就设置loop变量为空
     if loop and loop.is_running():  #
         return asyncio.run_coroutine_threadsafe(coro, loop).result()  # 如果在执行那就正常执行
-    return asyncio.run(coro)  # 否则就创建一个新的异步任务去运行
+    return worker_loop().run_until_complete(coro)  # 否则在进程级的事件循环上运行，不再每次新建
@@ -0,0 +1,143 @@
+"""Count database round trips spent on KB ingestion status transitions.
+
+Compares the previous select-then-flush transitions with the current
+UPDATE ... RETURNING ones in app.modules.kb.ingestion.pipeline. Needs a
+migrated database reachable through DATABASE_URL and an existing workspace
+and user to own the scratch assets, which are deleted afterwards.
+
+    PYTHONPATH=. python scripts/bench_kb_status_roundtrips.py --workspace-id 1 --user-id 1 -n 200
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import time
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable
+
+from sqlalchemy import delete, event, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+from app.core.config import settings
+from app.infra.db.session import create_session_maker
+from app.modules.kb.consts import (
+    ASSET_STATUS_PROCESSING,
+    ASSET_STATUS_READY,
+    ASSET_STATUS_UPLOADED,
+    INDEX_JOB_STATUS_DONE,
+    INDEX_JOB_STATUS_RUNNING,
+)
+from app.modules.kb.ingestion.pipeline import _mark_ready, _start_job
+from app.modules.kb.models import KBAsset, KBIndexJob
+
+_META_PATCH = {"kind": "document", "extract": {"sections": 3, "chars": 1200}, "chunk": {"chunks": 4}}
+
+
+class RoundTrips:
+    def __init__(self) -> None:
+        self.n = 0
+
+    def install(self, sync_engine: Any) -> None:
+        # 每条语句、每次BEGIN/COMMIT/ROLLBACK都是一次和数据库的往返
+        for name in ("before_cursor_execute", "begin", "commit", "rollback"):
+            event.listen(sync_engine, name, self._hit)
+
+    def _hit(self, *args: Any, **kwargs: Any) -> None:
+        self.n += 1
+
+
+async def _legacy(sm: async_sessionmaker[AsyncSession], asset_id: int) -> None:
+    # 改造前的写法：每个阶段新开session，先查出ORM对象，在Python里拼meta再flush
+    async with sm() as db:
+        async with db.begin():
+            asset = (await db.execute(select(KBAsset).where(KBAsset.id == asset_id))).scalar_one()
+            job = KBIndexJob(asset_id=asset_id, status=INDEX_JOB_STATUS_RUNNING, started_at=datetime.now(timezone.utc))
+            db.add(job)
+            asset.status = ASSET_STATUS_PROCESSING
+            asset.meta = dict(asset.meta or {}) or None
+            await db.flush()
+    async with sm() as db:
+        async with db.begin():
+            asset2 = (await db.execute(select(KBAsset).where(KBAsset.id == asset_id))).scalar_one()
+            m = dict(asset2.meta or {})
+            m.update(_META_PATCH)
+            asset2.status = ASSET_STATUS_READY
+            asset2.meta = m
+            await db.flush()
+            job2 = (await db.execute(select(KBIndexJob).where(KBIndexJob.id == int(job.id)))).scalar_one()
+            job2.status = INDEX_JOB_STATUS_DONE
+            job2.finished_at = datetime.now(timezone.utc)
+            await db.flush()
+
+
+async def _current(sm: async_sessionmaker[AsyncSession], asset_id: int) -> None:
+    started = await _start_job(sm, asset_id=asset_id)
+    assert started is not None
+    _, cp = started
+    await _mark_ready(sm, asset_id=asset_id, job_id=cp.job_id, mime_type="text/plain", source_type="document", meta_patch=_META_PATCH)
+
+
+async def _make_assets(sm: async_sessionmaker[AsyncSession], *, workspace_id: int, user_id: int, n: int) -> list[int]:
+    async with sm() as db:
+        async with db.begin():
+            rows = await db.execute(
+                insert(KBAsset).returning(KBAsset.id),
+                [
+                    {
+                        "workspace_id": workspace_id,
+                        "created_by": user_id,
+                        "filename": f"bench-{i}.txt",
+                        "storage_key": f"bench/status-roundtrips/{i}",
+                        "status": ASSET_STATUS_UPLOADED,
+                    }
+                    for i in range(n)
+                ],
+            )
+            return [int(x) for x in rows.scalars()]
+
+
+async def _drop_assets(sm: async_sessionmaker[AsyncSession], ids: list[int]) -> None:
+    async with sm() as db:
+        async with db.begin():
+            await db.execute(delete(KBIndexJob).where(KBIndexJob.asset_id.in_(ids)))
+            await db.execute(delete(KBAsset).where(KBAsset.id.in_(ids)))
+
+
+async def _run(
+    name: str,
+    flow: Callable[[async_sessionmaker[AsyncSession], int], Awaitable[None]],
+    sm: async_sessionmaker[AsyncSession],
+    counter: RoundTrips,
+    ids: list[int],
+) -> None:
+    counter.n = 0
+    t0 = time.perf_counter()
+    for asset_id in ids:
+        await flow(sm, asset_id)
+    elapsed = time.perf_counter() - t0
+    print(f"{name:>8}: {counter.n / len(ids):6.2f} round trips/ingest  {elapsed * 1000.0 / len(ids):7.3f} ms/ingest")
+
+
+async def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--workspace-id", type=int, required=True)
+    ap.add_argument("--user-id", type=int, required=True)
+    ap.add_argument("-n", "--iterations", type=int, default=200)
+    args = ap.parse_args()
+
+    engine = create_async_engine(settings.database_url, pool_size=1, max_overflow=0)
+    sm = create_session_maker(engine)
+    counter = RoundTrips()
+    counter.install(engine.sync_engine)
+    legacy_ids = await _make_assets(sm, workspace_id=args.workspace_id, user_id=args.user_id, n=args.iterations)
+    current_ids = await _make_assets(sm, workspace_id=args.workspace_id, user_id=args.user_id, n=args.iterations)
+    try:
+        await _run("legacy", _legacy, sm, counter, legacy_ids)
+        await _run("current", _current, sm, counter, current_ids)
+    finally:
+        await _drop_assets(sm, legacy_ids + current_ids)
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())